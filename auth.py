@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised by PasswordHasher.submit() when max_pending jobs are already waiting."""
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and checking on a small pool of threads, so a slow
+    KDF never runs on a Socket.IO handler or the game loop. hashlib's scrypt
+    and pbkdf2 release the GIL while they work, so the pool really does run
+    beside the rest of the engine.
+
+    The pool is bounded twice: `workers` threads hash at once, and at most
+    `max_pending` jobs (running or waiting) are accepted before submit()
+    raises HasherBusy, so a login storm queues a bounded amount of work
+    instead of an unbounded backlog.
+
+    `method` is passed to werkzeug's generate_password_hash ("scrypt",
+    "scrypt:16384:8:1", "pbkdf2:sha256:600000", ...). Hashes made with another
+    method still verify; needs_rehash() tells when one should be redone.
+    """
+
+    def __init__(self, workers=2, max_pending=64, method="scrypt", observer=None):
+        self.method = method
+        self.max_pending = max_pending
+        self.observer = observer  # observer(op, seconds) after each job
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hasher")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._prefix = None  # the method as it is spelled inside a hash, e.g. "scrypt:32768:8:1"
+        self.stats = {"hashed": 0, "checked": 0, "rejected": 0}
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) on the pool and returns its Future, or raises HasherBusy."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _timed(self, op, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.stats[op] += 1
+            if self.observer is not None:
+                self.observer(op, time.perf_counter() - start)
+
+    def hash(self, password):
+        """generate_password_hash on the pool. Returns a Future of the hash."""
+        return self.submit(self._timed, "hashed", generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """
+        check_password_hash on the pool. Returns a Future of (ok, new_hash):
+        new_hash is a fresh hash of the password when it matched but pwhash
+        was made with another method or cost (see needs_rehash), else None.
+        """
+        return self.submit(self._timed, "checked", self._verify, pwhash, password)
+
+    def _verify(self, pwhash, password):
+        if not check_password_hash(pwhash, password):
+            return False, None
+        if self.needs_rehash(pwhash):
+            return True, generate_password_hash(password, self.method)
+        return True, None
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with another method or cost than ours. Runs on the pool."""
+        if self._prefix is None:
+            # Spelled out by werkzeug (defaults filled in), so hash once to learn it
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return pwhash.split("$", 1)[0] != self._prefix
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RateLimiter:
+    """
+    Allows `limit` hits per key in any `window` seconds. hit() records one and
+    returns 0, or, once the key is over the limit, records nothing and returns
+    how many seconds until it may try again. Keys that have gone quiet are
+    pruned as the table grows, so a spray of one-off keys can't pile up.
+    """
+
+    def __init__(self, limit, window, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = {}  # key -> deque of hit times, oldest first
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        hits = self._hits.get(key)
+        if hits is not None:
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if not hits:
+                del self._hits[key]
+                hits = None
+        return hits
+
+    def retry_after(self, key, now=None):
+        """Seconds until key may hit again, without recording anything."""
+        now = time.time() if now is None else now
+        with self._lock:
+            hits = self._recent(key, now)
+            if hits is None or len(hits) < self.limit:
+                return 0
+            return hits[0] + self.window - now
+
+    def hit(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            hits = self._recent(key, now)
+            if hits is not None and len(hits) >= self.limit:
+                return hits[0] + self.window - now
+            if hits is None:
+                if len(self._hits) >= self.max_keys:
+                    self._prune(now)
+                hits = self._hits[key] = deque()
+            hits.append(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def _prune(self, now):
+        for key in [key for key, hits in self._hits.items() if hits[-1] <= now - self.window]:
+            del self._hits[key]
+
+    def __len__(self):
+        return len(self._hits)
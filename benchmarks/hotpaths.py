@@ -0,0 +1,256 @@
+"""
+Times the engine's hot paths against a throwaway DB, with no sockets or
+network, so it runs the same on a laptop or a plain CI box:
+
+    room desc    send_room_desc on a room with many items and monsters
+    combat       one combat_tick round
+    dispatch     a command through run_command, per verb
+    db           save_player + flush + load_player_data round trips
+    inventory    use, drop + get, and inv for a player hoarding every item
+    who          the `who` scan with 10, 1k and 10k players online
+
+    python benchmarks/hotpaths.py --save benchmarks/baseline.json
+    python benchmarks/hotpaths.py --compare benchmarks/baseline.json --threshold 0.25
+
+Each benchmark keeps the fastest of --repeat runs (the least disturbed by
+the rest of the box, as timeit recommends) and the median. With --compare,
+any benchmark whose fastest run got slower than the baseline's by more
+than the threshold is flagged and the exit status is 1.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MIN_RUN_SECONDS = 0.02  # calls per run are scaled up until one run takes this long
+
+
+def measure(fn, repeat, max_number=100000):
+    """Seconds per call of fn(), one figure per run, timeit style (GC off while timing)."""
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(fn, repeat, max_number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _measure(fn, repeat, max_number):
+    number = 1
+    while number < max_number:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= MIN_RUN_SECONDS:
+            break
+        number *= 2
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    return runs
+
+
+def wait_for_login(mud, name, timeout=30):
+    """login answers from the game loop once the password hash is done; returns the sid."""
+    deadline = time.time() + timeout
+    while name.lower() not in mud.sid_by_name:
+        if time.time() > deadline:
+            raise RuntimeError(f"{name} did not log in")
+        time.sleep(0.01)
+    return mud.sid_by_name[name.lower()]
+
+
+class Bench:
+    def __init__(self, mud, repeat):
+        self.mud = mud
+        self.repeat = repeat
+        self.results = {}
+        self.client = mud.socketio.test_client(mud.app, auth={"proto": 3})
+        self.client.emit('command', {'msg': "login benchmark pw"})
+        self.sid = wait_for_login(mud, "benchmark")
+        self.p = mud.players[self.sid]
+        self.p['current_hp'] = 10 ** 9
+        self.p['stats']['Attunement'] = 500
+
+    def run(self, name, fn):
+        runs = measure(fn, self.repeat)
+        self.client.get_received()  # don't let the test client's inbox grow
+        self.results[name] = {"median_us": statistics.median(runs) * 1e6, "min_us": min(runs) * 1e6,
+                              "runs": len(runs)}
+        print(f"{name:<28} {self.results[name]['median_us']:>12.2f} {self.results[name]['min_us']:>12.2f}")
+
+    def busy_room(self, items=200, monsters=50):
+        mud = self.mud
+        room_id = "bench"
+        mud.WORLD[room_id] = {
+            "name": "The Benchmark Hall", "desc": "Crowded with everything at once.",
+            "portals": {rid: {"name": mud.WORLD[rid]['name'], "min_attunement": i * 10}
+                        for i, rid in enumerate(list(mud.WORLD)[:12])},
+            "items": mud.floors.from_list(list(mud.ITEMS)[i % len(mud.ITEMS)] for i in range(items)),
+            "monsters": [],
+        }
+        for i in range(monsters):
+            template = mud.monsters.MonsterTemplate(f"bench_rat_{i}", "bench_rat",
+                                                    {"name": f"Bench Rat {i}", "max_hp": 10 ** 9, "atk": 1, "xp": 1,
+                                                     "gold": 1, "loot": "potion"})
+            m = mud.monsters.Monster(f"{room_id}.{i}", template, room=room_id)
+            mud.WORLD[room_id]['monsters'].append(m)
+            mud.MONSTERS[m.id] = m
+        mud.move_player(self.sid, room_id)
+        return room_id
+
+    def room_desc(self):
+        mud = self.mud
+        room_id = self.busy_room()
+        for proto in (1, 3):
+            mud.sessions[self.sid]['proto'] = proto
+            self.run(f"room_desc.p{proto}.cached", lambda: mud.send_room_desc(self.sid))
+
+            def cold():
+                mud.touch_room(room_id)
+                mud.sessions[self.sid]['seen_rooms'].discard(room_id)
+                mud.send_room_desc(self.sid)
+            self.run(f"room_desc.p{proto}.cold", cold)
+        mud.sessions[self.sid]['proto'] = 3
+
+    def combat(self):
+        mud = self.mud
+        target = mud.WORLD["bench"]['monsters'][0].id
+
+        def round_():
+            mud.set_combat_target(self.sid, target)
+            mud.combat_tick(self.sid)
+        self.run("combat_tick", round_)
+        mud.set_combat_target(self.sid, None)
+
+    def dispatch(self):
+        mud = self.mud
+        mud.move_player(self.sid, "1")
+        verbs = ["look", "who", "stats", "inv", "help", "list", "where benchmark", "top",
+                 "say hello", "inspect guard", "no_such_verb"]
+        for msg in verbs:
+            self.run(f"dispatch.{msg.split()[0]}", lambda: mud.run_command(self.sid, {'msg': msg}))
+        # go there and back, per move
+        self.run("dispatch.go", lambda: (mud.run_command(self.sid, {'msg': "go 2"}),
+                                          mud.run_command(self.sid, {'msg': "go 1"})))
+        self.results["dispatch.go"]["median_us"] /= 2
+        self.results["dispatch.go"]["min_us"] /= 2  # printed above as the pair
+
+    def db(self):
+        mud = self.mud
+
+        def round_trip():
+            self.p['gold'] += 1
+            mud.save_player(self.p)
+            mud.load_player_data("benchmark")  # flushes the queue first
+        self.run("db.save_load", round_trip)
+        self.run("db.save_enqueue", lambda: mud.save_player(self.p))
+        mud.flush_saves()
+
+    def inventory(self, stack=90):
+        mud = self.mud
+        mud.move_player(self.sid, "1")
+        hoard = self.p['inventory']
+        for item_id in mud.ITEMS:
+            hoard.add(item_id, stack - hoard.count(item_id))
+
+        def use():
+            hoard.add("potion")
+            mud.run_command(self.sid, {'msg': "use potion"})
+        self.run("inventory.use", use)
+        self.run("inventory.drop_get", lambda: (mud.run_command(self.sid, {'msg': "drop potion"}),
+                                                mud.run_command(self.sid, {'msg': "get potion"})))
+        self.results["inventory.drop_get"]["median_us"] /= 2
+        self.results["inventory.drop_get"]["min_us"] /= 2  # printed above as the pair
+        self.run("inventory.inv", lambda: mud.run_command(self.sid, {'msg': "inv"}))
+        mud.flush_saves()
+
+    def who(self):
+        mud = self.mud
+        for count in (10, 1000, 10000):
+            fake = [f"fake{count}-{i}" for i in range(count - len(mud.players))]
+            for i, sid in enumerate(fake):
+                mud.attach_player(sid, {"name": f"Ghost{i}", "location": str(1 + i % 20), "level": 1 + i % 30,
+                                        "xp": 0, "gold": 0, "stats": {"Attunement": 0, "Hardiness": 60, "Wit": 12},
+                                        "current_hp": 60, "equipped": None, "inventory": mud.INVENTORY.new()})
+            for proto in (1, 3):
+                mud.sessions[self.sid]['proto'] = proto
+                self.run(f"who.{count}.p{proto}", lambda: mud.run_command(self.sid, {'msg': "who"}))
+            for sid in fake:
+                mud.detach_player(sid)
+        mud.sessions[self.sid]['proto'] = 3
+
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    print(f"\n{'benchmark (min)':<28} {'baseline us':>12} {'now us':>12} {'change':>8}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<28} {'-':>12} {now['min_us']:>12.2f}      new")
+            continue
+        change = now['min_us'] / before['min_us'] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<28} {before['min_us']:>12.2f} {now['min_us']:>12.2f} {change * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7, help="timed runs per benchmark")
+    parser.add_argument("--only", help="comma separated groups: room_desc,combat,dispatch,db,inventory,who")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="compare against this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before flagging, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["MUD_DB_PATH"] = os.path.join(tmp, "players.db")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import main as mud
+    # The timed code paths shouldn't race the background threads for the GIL
+    mud.SAVE_FLUSH_INTERVAL = 3600
+
+    bench = Bench(mud, args.repeat)
+    groups = ["room_desc", "combat", "dispatch", "db", "inventory", "who"]
+    if args.only:
+        groups = [group for group in groups if group in args.only.split(",")]
+    if "combat" in groups and "room_desc" not in groups:
+        bench.busy_room()
+    print(f"{'benchmark':<28} {'median us':>12} {'min us':>12}")
+    for group in groups:
+        getattr(bench, group)()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                                "created": time.strftime("%Y-%m-%d %H:%M:%S")},
+                       "results": bench.results}, f, indent=2, sort_keys=True)
+        print(f"\nsaved {len(bench.results)} results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(bench.results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{regressions} regression(s) over {args.threshold * 100:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
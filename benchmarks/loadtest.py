@@ -0,0 +1,422 @@
+"""
+Load-tests the server with a swarm of scripted bots. Each bot registers with
+`login`, then keeps picking a verb from the mix (go, attack, say, shout, who,
+top, look) with a think time in between, until the run ends.
+
+Bots either drive socketio.test_client in this process (--mode inproc, the
+server's handler time only) or connect real websockets to a server
+(--mode socket, the full round trip). Socket mode starts its own main.py, or
+gateway.py with --gateway-workers, unless --url points at a running server.
+Either way nothing leaves the machine and the DB is a throwaway one.
+
+    python benchmarks/loadtest.py --bots 50 --seconds 30
+    python benchmarks/loadtest.py --mode socket --bots 200 --mix fighter
+    python benchmarks/loadtest.py --mode socket --gateway-workers 4 --mix go=5,say=3,who=1
+
+Reports commands/sec, latency percentiles per verb (until the command has
+been handled, see SocketBot; for login, until the bot is in, retries
+included), peak thread count and RSS of the server process, and
+the DB commit rate (plus rows written per second in inproc mode).
+Against --url, start the server with MUD_LOGIN_IP_LIMIT raised: every bot
+logs in from the same address.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MIXES = {
+    "default": "go=30,attack=15,say=20,shout=5,who=10,top=10,look=10",
+    "explorer": "go=60,look=30,who=5,top=5",
+    "fighter": "attack=50,go=30,look=20",
+    "social": "say=45,shout=15,who=25,top=15",
+}
+CHATTER = ("hail!", "anyone seen the exit?", "this castle is huge", "lol", "need a healer")
+
+
+def parse_mix(text):
+    pairs = [part.split("=") for part in MIXES.get(text, text).split(",")]
+    verbs = [verb for verb, _ in pairs]
+    weights = [float(weight) for _, weight in pairs]
+    return verbs, weights
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Bot:
+    """One scripted player. Subclasses provide connect/send/close."""
+    timeout = 10.0
+
+    def __init__(self, index, verbs, weights, think, seed):
+        self.name = f"bot{index}"
+        self.verbs, self.weights = verbs, weights
+        self.think = think
+        self.rng = random.Random(f"{seed}-{index}")
+        self.exits = []
+        self.latencies = {}  # verb -> [seconds]
+        self.errors = 0
+        self.login_result = None  # "ok" or "retry" once the server has answered a login
+        self.login_retries = 0
+
+    def command_for(self, verb):
+        if verb == "go":
+            return f"go {self.rng.choice(self.exits)}" if self.exits else "look"
+        if verb in ("say", "shout"):
+            return f"{verb} {self.rng.choice(CHATTER)}"
+        return verb
+
+    def observe(self, event, data):
+        # Track the exits we can open, from protocol 2+ room states
+        if event == 'state' and isinstance(data, dict) and data.get('t') == 'room':
+            self.exits = [exit for exit in json.loads(data['view'])['exits'][::2] if exit is not None]
+        elif event == 'status' and isinstance(data, dict):
+            msg = data.get('msg', '')
+            if "Welcome back" in msg or "registered and logged in" in msg:
+                self.login_result = "ok"
+            elif "try again" in msg.lower():
+                self.login_result = "retry"  # throttled, or the login pool is full
+        elif event == 'batch':
+            for inner_event, inner_data in data:
+                self.observe(inner_event, inner_data)
+
+    def timed(self, verb, msg):
+        start = time.perf_counter()
+        try:
+            self.send(msg)
+        except Exception:
+            self.errors += 1
+            return
+        self.latencies.setdefault(verb, []).append(time.perf_counter() - start)
+
+    def poll(self):
+        time.sleep(0.01)
+
+    def login(self, deadline):
+        """
+        Logs in, backing off and retrying when turned away. The server answers
+        a login once the password hash is done, after the command itself
+        returns, so this times the whole wait until the bot is in.
+        """
+        start = time.perf_counter()
+        while time.time() < deadline:
+            self.login_result = None
+            try:
+                self.send(f"login {self.name} pw")
+                answer_by = time.time() + self.timeout
+                while self.login_result is None and time.time() < answer_by:
+                    self.poll()
+            except Exception:
+                self.errors += 1
+                return False
+            if self.login_result == "ok":
+                self.latencies.setdefault("login", []).append(time.perf_counter() - start)
+                return True
+            if self.login_result is None:
+                self.errors += 1
+                return False
+            self.login_retries += 1
+            time.sleep(self.rng.uniform(0.5, 1.5))
+        return False
+
+    def run(self, deadline):
+        try:
+            self.connect()
+            if not self.login(deadline):
+                return
+            self.timed("look", "look")
+            while time.time() < deadline:
+                verb = self.rng.choices(self.verbs, self.weights)[0]
+                self.timed(verb, self.command_for(verb))
+                time.sleep(self.rng.uniform(0.5, 1.5) * self.think)
+        finally:
+            self.close()
+
+
+class InProcBot(Bot):
+    mud = None  # the imported main module
+
+    def connect(self):
+        self.client = self.mud.socketio.test_client(self.mud.app, auth={"proto": 3})
+        self.drain()
+
+    def drain(self):
+        for packet in self.client.get_received():
+            self.observe(packet['name'], packet['args'][0] if packet['args'] else None)
+
+    def send(self, msg):
+        # The handler runs in this thread, so this times the server's own work
+        self.client.emit('command', {'msg': msg})
+        self.drain()
+
+    def poll(self):
+        time.sleep(0.01)
+        self.drain()
+
+    def close(self):
+        if self.client.is_connected():
+            self.client.disconnect()
+
+
+class SocketBot(Bot):
+    """
+    Speaks Engine.IO 4 / Socket.IO 5 over a raw websocket. A command counts as
+    done when the server acks it (main.py acks once the handler has run and
+    flushed its output). Gateways ack as soon as they have forwarded the
+    event, so behind gateway.py the bot instead follows each command with a
+    'hello' and waits for the reply: the engine runs events in order, so
+    that reply means the command is done too.
+    """
+    url = None
+    marker = "ack"
+
+    def connect(self):
+        import simple_websocket
+        self.ws = simple_websocket.Client.connect(self.url)
+        self.frames = queue.Queue()
+        self.ws.receive(timeout=self.timeout)  # Engine.IO open packet
+        self.ws.send('40' + json.dumps({"proto": 3}))
+        threading.Thread(target=self.reader, daemon=True).start()
+        # The engine's greeting can overtake the gateway's connect reply
+        pending = {'connected', 'hello'}
+        while pending:
+            frame = self.frames.get(timeout=self.timeout)
+            if frame is None:
+                raise ConnectionError("server closed the connection")
+            pending.discard(frame)
+
+    def reader(self):
+        try:
+            while True:
+                frame = self.ws.receive()
+                if frame is None:
+                    break
+                if frame == '2':  # ping
+                    self.ws.send('3')
+                    continue
+                if frame.startswith('42'):
+                    event, *args = json.loads(frame[2:])
+                    self.observe(event, args[0] if args else None)
+                    if event == 'hello' or (event == 'batch' and any(e == 'hello' for e, _ in args[0])):
+                        self.frames.put('hello')
+                elif frame.startswith('43'):
+                    self.frames.put('ack')
+                elif frame.startswith('40'):
+                    self.frames.put('connected')
+        except Exception:
+            pass
+        self.frames.put(None)
+
+    def wait_frame(self, wanted):
+        while True:
+            frame = self.frames.get(timeout=self.timeout)
+            if frame is None:
+                raise ConnectionError("server closed the connection")
+            if frame == wanted:
+                return
+
+    def send(self, msg):
+        if self.marker == "ack":
+            self.ws.send('421' + json.dumps(['command', {'msg': msg}]))
+        else:
+            self.ws.send('42' + json.dumps(['command', {'msg': msg}]))
+            self.ws.send('42' + json.dumps(['hello', {'proto': 3}]))
+        self.wait_frame(self.marker)
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+def proc_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def process_tree(pid):
+    """pid and all its descendants (gateway.py runs the engine and workers as children)."""
+    parents = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if entry.isdigit():
+            ppid = proc_status(entry, "PPid")
+            if ppid is not None:
+                parents.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        tree.append(current)
+        todo.extend(parents.get(current, ()))
+    return tree
+
+
+class Sampler(threading.Thread):
+    """Samples the server's threads, RSS and DB commits (via data_version) while the run goes."""
+
+    def __init__(self, pid, db_path):
+        super().__init__(daemon=True)
+        self.pid, self.db_path = pid, db_path
+        self.peak_threads = self.peak_rss_kb = 0
+        self.commits = 0
+        self.running = True
+
+    def run(self):
+        conn = None
+        last_version = None
+        while self.running:
+            pids = process_tree(self.pid) if self.pid != os.getpid() else [self.pid]
+            threads = sum(proc_status(pid, "Threads") or 0 for pid in pids)
+            rss = sum(proc_status(pid, "VmRSS") or 0 for pid in pids)
+            if not threads and self.pid == os.getpid():
+                threads = threading.active_count()
+            self.peak_threads = max(self.peak_threads, threads)
+            self.peak_rss_kb = max(self.peak_rss_kb, rss)
+            if self.db_path:
+                try:
+                    if conn is None and os.path.exists(self.db_path):
+                        conn = sqlite3.connect(self.db_path)
+                    if conn is not None:
+                        version = conn.execute("PRAGMA data_version").fetchone()[0]
+                        if last_version is not None and version != last_version:
+                            self.commits += 1
+                        last_version = version
+                except sqlite3.Error:
+                    pass
+            time.sleep(0.05)  # well under the 2s write-behind interval, so no commit is missed
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, db_path):
+    port = free_port()
+    # Every bot connects from 127.0.0.1, so lift the per-address login limit
+    env = dict(os.environ, MUD_DB_PATH=db_path, MUD_PORT=str(port), MUD_HOST="127.0.0.1", MUD_DEBUG="0",
+               MUD_LOGIN_IP_LIMIT=str(10 ** 6))
+    if args.gateway_workers:
+        env["MUD_QUEUE"] = f"unix://{os.path.join(os.path.dirname(db_path), 'fanout.sock')}"
+        cmd = [sys.executable, "gateway.py", "--workers", str(args.gateway_workers)]
+    else:
+        cmd = [sys.executable, "main.py"]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket"
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("inproc", "socket"), default="inproc")
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between a bot's commands")
+    parser.add_argument("--mix", default="default", help=f"one of {', '.join(MIXES)} or verb=weight,...")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which bots join")
+    parser.add_argument("--seed", default="loadtest")
+    parser.add_argument("--url", help="socket mode: a running server's Engine.IO websocket URL")
+    parser.add_argument("--gateway-workers", type=int, default=0,
+                        help="socket mode: run (or, with --url, expect) gateway.py with this many workers")
+    args = parser.parse_args()
+    verbs, weights = parse_mix(args.mix)
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "players.db")
+    server = None
+    if args.mode == "inproc":
+        os.environ["MUD_DB_PATH"] = db_path
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        import main as mud
+        InProcBot.mud = mud
+        bot_class, pid = InProcBot, os.getpid()
+    else:
+        if args.gateway_workers:
+            SocketBot.marker = "hello"
+        if args.url:
+            SocketBot.url, pid, db_path = args.url, None, None
+        else:
+            server, SocketBot.url = start_server(args, db_path)
+            pid = server.pid
+        bot_class = SocketBot
+
+    bots = [bot_class(i, verbs, weights, args.think, args.seed) for i in range(args.bots)]
+    sampler = Sampler(pid, db_path)
+    sampler.start()
+    start = time.time()
+    deadline = start + args.ramp + args.seconds
+    threads = []
+    for i, bot in enumerate(bots):
+        thread = threading.Thread(target=bot.run, args=(deadline,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.ramp / max(1, args.bots))
+    for thread in threads:
+        thread.join(args.seconds + 60)
+    elapsed = time.time() - start
+    time.sleep(2.5)  # let the last write-behind flush land
+    sampler.running = False
+    sampler.join()
+
+    by_verb = {}
+    for bot in bots:
+        for verb, values in bot.latencies.items():
+            by_verb.setdefault(verb, []).extend(values)
+    total = sum(len(values) for values in by_verb.values())
+    errors = sum(bot.errors for bot in bots)
+    retries = sum(bot.login_retries for bot in bots)
+
+    print(f"{args.bots} bots, mode {args.mode}, mix {MIXES.get(args.mix, args.mix)}, {elapsed:.1f}s")
+    print(f"commands: {total} ({total / elapsed:.1f}/s), errors: {errors}, login retries: {retries}")
+    print(f"{'verb':<8} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for verb in sorted(by_verb, key=lambda v: -len(by_verb[v])):
+        values = sorted(by_verb[verb])
+        print(f"{verb:<8} {len(values):>7} {percentile(values, 0.5) * 1000:>8.2f} "
+              f"{percentile(values, 0.95) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f} "
+              f"{values[-1] * 1000:>8.2f}")
+    if pid is not None:
+        print(f"server: peak threads {sampler.peak_threads}, peak RSS {sampler.peak_rss_kb / 1024:.1f} MB"
+              + (" (all processes)" if args.gateway_workers else ""))
+    if db_path:
+        print(f"db: {sampler.commits} commits ({sampler.commits / elapsed:.2f}/s)", end="")
+        if args.mode == "inproc":
+            stats = InProcBot.mud.SAVE_STATS
+            rows = stats['rows_written'] + stats['item_deltas_written']
+            print(f", {rows} rows ({rows / elapsed:.1f}/s), {stats['merged']} saves merged", end="")
+        print()
+
+    if server is not None:
+        server.terminate()
+        server.wait(15)
+
+
+if __name__ == '__main__':
+    main()
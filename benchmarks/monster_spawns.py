@@ -0,0 +1,120 @@
+"""
+Memory and access cost of spawned monsters (see monsters.py), with no
+server, against the dicts every monster used to be: a full copy of its
+template with id, hp and dead_until added.
+
+    spawn    bytes per spawn (tracemalloc) and time per spawn, for --count
+             monsters spread over the templates in monsters.json, plain and
+             scaled by depth the way worldgen.py scales them
+    access   what one combat round reads and writes on its monster (name,
+             atk, hp, xp, gold, loot), per round
+
+    python benchmarks/monster_spawns.py
+    python benchmarks/monster_spawns.py --count 200000
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import worlddata  # noqa: E402
+from monsters import TemplateTable  # noqa: E402
+
+DEPTHS = 18  # regions between the entrance and the far corner of the shipped worldgen.json
+DEPTH_SCALE = 0.15
+
+
+def dict_spawn(monster_id, template_id, template, overrides):
+    """How a monster was spawned before monsters.py."""
+    monster = dict(template, **overrides)
+    monster['id'] = monster_id
+    monster['template'] = template_id
+    monster['hp'] = monster['max_hp']
+    monster['dead_until'] = 0
+    return monster
+
+
+def scaled(template, depth):
+    scale = 1 + DEPTH_SCALE * depth
+    return {field: int(round(template[field] * scale)) for field in ("max_hp", "atk", "xp", "gold")}
+
+
+def spawn_plan(templates, count, depth_scaled):
+    ids = sorted(templates)
+    return [(f"{i // 2}.{i % 2}", ids[i % len(ids)],
+             scaled(templates[ids[i % len(ids)]], i % DEPTHS) if depth_scaled else {}) for i in range(count)]
+
+
+def spawn_all(spawn, plan):
+    return [spawn(monster_id, template_id, overrides) for monster_id, template_id, overrides in plan]
+
+
+def measure(spawn, plan):
+    """(bytes, seconds) for spawning the plan, timed on a second run without tracemalloc slowing it down."""
+    gc.collect()
+    tracemalloc.start()
+    spawn_all(spawn, plan)
+    size = tracemalloc.get_traced_memory()[1]  # the peak: every spawn, just before the list was freed
+    tracemalloc.stop()
+    gc.collect()
+    start = time.perf_counter()
+    _ = spawn_all(spawn, plan)  # freed after the clock stops, not timed
+    return size, time.perf_counter() - start
+
+
+def spawn(templates, count):
+    for depth_scaled in (False, True):
+        plan = spawn_plan(templates, count, depth_scaled)
+        label = "scaled" if depth_scaled else "plain"
+        # The list holding them is the same size either way
+        dicts, dict_time = measure(lambda mid, tid, o: dict_spawn(mid, tid, templates[tid], o), plan)
+        table = TemplateTable(templates)
+        slim, slim_time = measure(table.spawn, plan)
+        print(f"spawn.{label:<7} {count} monsters: dict {dicts / count:.0f} B, {dict_time / count * 1e6:.2f} us each; "
+              f"Monster {slim / count:.0f} B, {slim_time / count * 1e6:.2f} us each "
+              f"({len(table)} templates incl. variants)")
+
+
+def access(templates, rounds):
+    template_id = sorted(templates)[0]
+    old = dict_spawn("0.0", template_id, templates[template_id], {})
+    new = TemplateTable(templates).spawn("0.0", template_id)
+
+    def dict_round():
+        old['hp'] -= 10
+        return old['name'], old['atk'], old['hp'], old['xp'], old['gold'], old['loot']
+
+    def slim_round():
+        new.hp -= 10
+        t = new.template
+        return t.name, t.atk, new.hp, t.xp, t.gold, t.loot
+
+    for label, fn in (("dict", dict_round), ("Monster", slim_round)):
+        times = []
+        for _ in range(7):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                fn()
+            times.append((time.perf_counter() - start) / rounds)
+        print(f"access.{label:<8} {rounds} rounds: median {statistics.median(times) * 1e9:.0f} ns per round")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(ROOT, "data"), help="data directory with monsters.json")
+    parser.add_argument("--count", type=int, default=50000, help="monsters spawned")
+    parser.add_argument("--rounds", type=int, default=200000, help="combat rounds timed by the access benchmark")
+    args = parser.parse_args()
+
+    templates = worlddata.load(args.data, rooms=False).templates
+    spawn(templates, args.count)
+    access(templates, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Counts outbound frames with and without batching, by putting a crowd of
+players in a handful of rooms where they chat, look, walk in and out and
+fight (game loop combat rounds) for a while against a throwaway DB. Half the
+crowd speaks protocol 2 (one frame per message), half protocol 3 ('batch'
+frames, with other players' chatter held to the next tick), mixed in the
+same rooms so both see the same traffic.
+
+Each websocket frame is one send() on the socket, so frames saved is also
+the number of send syscalls saved.
+
+    python benchmarks/outbound_frames.py --players 120 --rooms 6 --seconds 15
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def wait_for_login(mud, name, timeout=30):
+    """login answers from the game loop once the password hash is done; returns the sid."""
+    deadline = time.time() + timeout
+    while name.lower() not in mud.sid_by_name:
+        if time.time() > deadline:
+            raise RuntimeError(f"{name} did not log in")
+        time.sleep(0.01)
+    return mud.sid_by_name[name.lower()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=120, help="players online, split evenly between protocols")
+    parser.add_argument("--rooms", type=int, default=6, help="rooms the players are spread over")
+    parser.add_argument("--seconds", type=float, default=15.0, help="how long to run")
+    parser.add_argument("--rate", type=float, default=0.5, help="commands per player per second")
+    parser.add_argument("--combat-round", type=float, default=1.0, help="seconds per combat round")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["MUD_DB_PATH"] = os.path.join(tmp, "players.db")
+    # Logins aren't measured here; a cheap hash and a deep enough pool queue let them all in at once
+    os.environ["MUD_PASSWORD_HASH"] = "pbkdf2:sha256:1000"
+    os.environ["MUD_HASH_QUEUE"] = str(args.players)
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import main as mud
+
+    mud.COMBAT_ROUND_SECONDS = args.combat_round
+    arenas = list(itertools.islice((rid for rid, room in mud.WORLD.items()
+                                    if room.get('monsters') and room.get('portals')), args.rooms))
+    for rid in arenas:
+        for m in mud.WORLD[rid]['monsters']:
+            # fights last the whole run
+            m.template = mud.MONSTER_TEMPLATES.variant(m.template.template_id, {"max_hp": 10 ** 9, "is_roaming": False})
+            m.hp = 10 ** 9
+
+    clients = []  # (proto, name, client)
+    for i in range(args.players):
+        proto = 2 + (i // len(arenas)) % 2
+        client = mud.socketio.test_client(mud.app, auth={"proto": proto})
+        name = f"crowd{i}"
+        client.emit('command', {'msg': f"login {name} pw"})
+        clients.append((proto, name, client))
+    for i, (_, name, _) in enumerate(clients):
+        sid = wait_for_login(mud, name)
+        mud.players[sid]['current_hp'] = 10 ** 9
+        mud.players[sid]['stats']['Attunement'] = 10 ** 6  # every portal opens
+        mud.move_player(sid, arenas[i % len(arenas)])
+    for _, _, client in clients:
+        client.get_received()
+
+    # Half of each room fights, the other half talks and moves around
+    for i, (_, name, client) in enumerate(clients):
+        if i % 4 < 2:
+            client.emit('command', {'msg': "attack"})
+
+    script = ("say anyone seen the exit?", "look", "who", "say over here")
+    interval = 1.0 / (args.rate * args.players)
+    start = time.time()
+    n = 0
+    while time.time() - start < args.seconds:
+        proto, name, client = clients[n % len(clients)]
+        sid = mud.sid_by_name[name]
+        if (n // len(clients)) % 2 and n % 4 >= 2:
+            # Step out through the first portal and straight back
+            home = mud.players[sid]['location']
+            portal = next(iter(mud.WORLD[home]['portals']))
+            client.emit('command', {'msg': f"go {portal}"})
+            client.emit('command', {'msg': f"go {next(iter(mud.WORLD[portal].get('portals', {})), home)}"})
+            if mud.players[sid]['location'] != home:
+                mud.move_player(sid, home)
+        else:
+            client.emit('command', {'msg': script[n % len(script)]})
+        n += 1
+        time.sleep(max(0.0, start + n * interval - time.time()))
+    elapsed = time.time() - start
+
+    totals = {2: [0, 0], 3: [0, 0]}  # proto -> [messages, frames]
+    for proto, _, client in clients:
+        for packet in client.get_received():
+            totals[proto][1] += 1
+            totals[proto][0] += len(packet['args'][0]) if packet['name'] == 'batch' else 1
+
+    print(f"{args.players} players in {len(arenas)} rooms, {n} commands in {elapsed:.1f}s, "
+          f"{mud.active_combats()} fights")
+    print(f"{'proto':<8} {'messages':>9} {'frames':>8} {'frames/s':>9} {'msgs/frame':>11} {'saved':>7}")
+    for proto, (messages, frames) in totals.items():
+        print(f"{proto:<8} {messages:>9} {frames:>8} {frames / elapsed:>9.0f} "
+              f"{messages / max(1, frames):>11.2f} {100 * (1 - frames / max(1, messages)):>6.0f}%")
+    messages, frames = totals[3]
+    print(f"send() calls saved by batching: {messages - frames} ({(messages - frames) / elapsed:.0f}/s)")
+
+    for _, _, client in clients:
+        client.disconnect()
+
+
+if __name__ == '__main__':
+    main()
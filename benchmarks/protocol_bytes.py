@@ -0,0 +1,82 @@
+"""
+Measures bytes per emit for the HTML 'status' protocol (1) against the
+structured 'state' protocol (2), by driving one client of each through the
+same looks, moves, who, help and combat rounds against a throwaway DB.
+
+    python benchmarks/protocol_bytes.py --players 50 --rounds 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def wait_for_login(mud, name, timeout=30):
+    """login answers from the game loop once the password hash is done; returns the sid."""
+    deadline = time.time() + timeout
+    while name.lower() not in mud.sid_by_name:
+        if time.time() > deadline:
+            raise RuntimeError(f"{name} did not log in")
+        time.sleep(0.01)
+    return mud.sid_by_name[name.lower()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=50, help="extra Guests online, fills the who list")
+    parser.add_argument("--rounds", type=int, default=200, help="command loops per client")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["MUD_DB_PATH"] = os.path.join(tmp, "players.db")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import main as mud
+    mud.EMIT_SAMPLE_EVERY = 1  # exact byte counts
+
+    crowd = [mud.socketio.test_client(mud.app) for _ in range(args.players)]
+    clients = {1: mud.socketio.test_client(mud.app),
+               2: mud.socketio.test_client(mud.app, auth={"proto": 2})}
+    for proto, client in clients.items():
+        client.emit('command', {'msg': f"login bench{proto} pw"})
+        sid = wait_for_login(mud, f"bench{proto}")
+        mud.players[sid]['stats']['Attunement'] = 30  # see most exits
+        mud.players[sid]['current_hp'] = 10 ** 9       # never die mid-run
+
+    for _ in range(args.rounds):
+        for proto, client in clients.items():
+            for msg in ("look", "go 2", "look", "go 1", "who", "help"):
+                client.emit('command', {'msg': msg})
+            sid = mud.sid_by_name[f"bench{proto}"]
+            mud.move_player(sid, "666")
+            mud.set_combat_target(sid, mud.WORLD["666"]["monsters"][0].id)
+            mud.combat_tick(sid)
+            mud.set_combat_target(sid, None)
+            mud.move_player(sid, "1")
+            client.get_received()
+
+    kinds = sorted({key.split(':', 1)[1] for key in mud.EMIT_STATS})
+    print(f"{'kind':<10} {'proto1 B/emit':>14} {'proto2 B/emit':>14} {'saved':>7}")
+    totals = {1: [0, 0], 2: [0, 0]}
+    for kind in kinds:
+        v1 = mud.EMIT_STATS.get(f"status:{kind}")
+        v2 = mud.EMIT_STATS.get(f"state:{kind}")
+        if not v1 or not v2:
+            continue
+        a, b = v1['bytes'] / v1['emits'], v2['bytes'] / v2['emits']
+        for proto, stats in ((1, v1), (2, v2)):
+            totals[proto][0] += stats['bytes']
+            totals[proto][1] += stats['emits']
+        print(f"{kind:<10} {a:>14.0f} {b:>14.0f} {100 * (1 - b / a):>6.0f}%")
+    a, b = (totals[p][0] / max(1, totals[p][1]) for p in (1, 2))
+    print(f"{'overall':<10} {a:>14.0f} {b:>14.0f} {100 * (1 - b / a):>6.0f}%")
+
+    for client in crowd + list(clients.values()):
+        client.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Compares the old connect-per-call SQLite access against the pooled WAL layer
+in storage.py, under a mixed load of player saves, logins and `top` queries.
+
+    python benchmarks/storage_bench.py --seconds 5 --writers 2 --readers 6
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import ConnectionPool  # noqa: E402
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS players
+            (username TEXT PRIMARY KEY, password_hash TEXT, location TEXT,
+             level INTEGER, xp INTEGER, gold INTEGER, attunement INTEGER,
+             hardiness INTEGER, wit INTEGER, current_hp INTEGER, equipped TEXT, inventory TEXT)'''
+UPSERT = "INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SELECT = "SELECT * FROM players WHERE username=?"
+TOP = "SELECT username, level, xp, gold FROM players ORDER BY xp DESC LIMIT ?"
+
+
+def make_row(i, tick):
+    return (f"bench_{i}", "hash", "1", 1 + i % 20, (i * 37 + tick) % 5000, 50, 0, 60, 12, 60, None,
+            json.dumps(["potion"] * (i % 5)))
+
+
+class ConnectPerCall:
+    """The access pattern main.py used before the pool: open, run, commit, close."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, row):
+        conn = sqlite3.connect(self.path)
+        conn.execute(UPSERT, row)
+        conn.commit()
+        conn.close()
+
+    def read(self, sql, args):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+        return rows
+
+
+class Pooled:
+    def __init__(self, path, size):
+        self.pool = ConnectionPool(path, size=size)
+
+    def write(self, row):
+        with self.pool.transaction() as conn:
+            conn.execute(UPSERT, row)
+
+    def read(self, sql, args):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, args).fetchall()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(backend, players, seconds, writers, readers):
+    stop = threading.Event()
+    counts = {"save": 0, "login": 0, "top": 0, "errors": 0}
+    read_lat = []
+    lock = threading.Lock()
+
+    def writer(n):
+        tick = 0
+        while not stop.is_set():
+            tick += 1
+            try:
+                backend.write(make_row((tick * 7 + n) % players, tick))
+                with lock:
+                    counts["save"] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counts["errors"] += 1
+
+    def reader(n):
+        i = n
+        while not stop.is_set():
+            i += 1
+            kind, sql, args = ("top", TOP, (10,)) if i % 4 == 0 else ("login", SELECT, (f"bench_{i % players}",))
+            start = time.perf_counter()
+            try:
+                backend.read(sql, args)
+            except sqlite3.OperationalError:
+                with lock:
+                    counts["errors"] += 1
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                counts[kind] += 1
+                read_lat.append(elapsed)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    result = {k: round(v / seconds, 1) for k, v in counts.items()}
+    result["read_p50_ms"] = round(percentile(read_lat, 50), 3)
+    result["read_p99_ms"] = round(percentile(read_lat, 99), 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=6)
+    parser.add_argument("--pool-size", type=int, default=8)
+    args = parser.parse_args()
+
+    results = {}
+    for label in ("connect-per-call", "pooled-wal"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "players.db")
+            conn = sqlite3.connect(path)
+            conn.execute(SCHEMA)
+            conn.executemany(UPSERT, [make_row(i, 0) for i in range(args.players)])
+            conn.commit()
+            conn.close()
+
+            if label == "pooled-wal":
+                backend = Pooled(path, args.pool_size)
+            else:
+                backend = ConnectPerCall(path)
+            results[label] = run(backend, args.players, args.seconds, args.writers, args.readers)
+            if label == "pooled-wal":
+                backend.pool.close()
+
+    print(f"{'mode':<18} {'save/s':>9} {'login/s':>9} {'top/s':>9} {'err/s':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, r in results.items():
+        print(f"{label:<18} {r['save']:>9} {r['login']:>9} {r['top']:>9} {r['errors']:>7} "
+              f"{r['read_p50_ms']:>8} {r['read_p99_ms']:>8}")
+
+
+if __name__ == '__main__':
+    main()
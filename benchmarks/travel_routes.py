@@ -0,0 +1,82 @@
+"""
+Cost of the travel route index (routes.py) over the shipped world, with no
+server: the hand-written rooms in a RoomStore with the generated ones
+behind them, as main.py sets it up.
+
+    build    time to search out a next-hop table, for destinations spread
+             over the first generated regions, at every attunement tier
+    lookup   time to read a route out of a table already made, and how
+             many portals the routes cross: each one a `go` command, a
+             save and a room description before `travel`
+
+    python benchmarks/travel_routes.py
+    python benchmarks/travel_routes.py --hops 60 --destinations 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import worlddata  # noqa: E402
+import worldgen  # noqa: E402
+from monsters import to_json  # noqa: E402
+from roomstore import RoomStore  # noqa: E402
+from routes import RouteIndex  # noqa: E402
+
+
+def load(data_dir):
+    data = worlddata.load(data_dir)
+    gen = worldgen.load(data_dir, data, data.rooms)
+    store = RoomStore(os.path.join(tempfile.mkdtemp(), "world.db"), generator=gen, encode=to_json)
+    store.import_rooms(gen.link(data.rooms) if gen else data.rooms, "bench")
+    return store, gen
+
+
+def destinations(gen, count, hops):
+    """Generated rooms near enough the entrance that the searches reach the hand-written rooms."""
+    rng = random.Random(1)
+    span = max(1, hops // 2)
+    return [str(gen.first_id + rng.randrange(span) * gen.width + rng.randrange(span)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(ROOT, "data"), help="data directory")
+    parser.add_argument("--hops", type=int, default=40, help="how far the tables reach (MUD_TRAVEL_MAX_HOPS)")
+    parser.add_argument("--destinations", type=int, default=20, help="destinations searched per tier")
+    args = parser.parse_args()
+
+    store, gen = load(args.data)
+    if gen is None:
+        sys.exit(f"no {worldgen.CONFIG_FILE} in {args.data}")
+    targets = destinations(gen, args.destinations, args.hops)
+    sources = ["1", "2", str(gen.first_id)]
+    for gate in store.gates():
+        index = RouteIndex(store, max_hops=args.hops, max_tables=len(targets))
+        builds, lookups, lengths = [], [], []
+        for target in targets:
+            start = time.perf_counter()
+            index.route(sources[0], target, gate)
+            builds.append(time.perf_counter() - start)
+            for source in sources:
+                start = time.perf_counter()
+                path = index.route(source, target, gate)
+                lookups.append(time.perf_counter() - start)
+                if path:
+                    lengths.append(len(path))
+        searched = index.stats['rooms_searched'] / index.stats['builds']
+        print(f"attunement {gate:>3}: build median {statistics.median(builds) * 1000:.1f} ms, "
+              f"max {max(builds) * 1000:.1f} ms ({searched:.0f} rooms each); "
+              f"lookup median {statistics.median(lookups) * 1e6:.1f} us; "
+              f"{len(lengths)} of {len(targets) * len(sources)} routes found, "
+              f"{statistics.mean(lengths) if lengths else 0:.1f} portals on average")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
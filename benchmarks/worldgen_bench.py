@@ -0,0 +1,168 @@
+"""
+Measures the generated world (worldgen.py) on its own, with no server:
+
+    generate     cost per room of WorldGenerator.generate(), and of portals()
+    determinism  the same rooms, byte for byte, from another process with a
+                 different PYTHONHASHSEED
+    reachable    rooms reachable from the entrance, walking portals() only,
+                 with no attunement and with the most any shortcut needs
+    resident     every generated room looked up once through a RoomStore
+                 with a memory budget, in walking order; process RSS before
+                 and after, and what the store kept resident
+
+    python benchmarks/worldgen_bench.py
+    python benchmarks/worldgen_bench.py --budget-mb 16 --compare-dict
+
+--compare-dict also holds every generated room in a plain dict, the way
+WORLD used to hold the world, to show what the budget saves.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import worlddata  # noqa: E402
+import worldgen  # noqa: E402
+from monsters import to_json  # noqa: E402
+from roomstore import RoomStore  # noqa: E402
+
+DIGEST_SAMPLE = 500
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def digest(gen):
+    """Hash of a fixed spread of generated rooms. Also run in a child process, see determinism()."""
+    step = max(1, len(gen) // DIGEST_SAMPLE)
+    rooms = [gen.generate(str(gen.first_id + i)) for i in range(0, len(gen), step)]
+    return hashlib.sha256(json.dumps(rooms, sort_keys=True, default=to_json).encode()).hexdigest()
+
+
+def load(data_dir):
+    data = worlddata.load(data_dir, rooms=False)
+    gen = worldgen.load(data_dir, data)
+    if gen is None:
+        sys.exit(f"no {worldgen.CONFIG_FILE} in {data_dir}")
+    return gen
+
+
+def generate(gen, sample):
+    ids = [str(gen.first_id + i) for i in random.Random(1).sample(range(len(gen)), min(sample, len(gen)))]
+    for label, fn in (("generate", gen.generate), ("portals", gen.portals)):
+        times = []
+        for rid in ids:
+            start = time.perf_counter()
+            fn(rid)
+            times.append(time.perf_counter() - start)
+        print(f"{label:<12} {len(ids)} rooms: median {statistics.median(times) * 1e6:.1f} us, "
+              f"p99 {percentile(times, 0.99) * 1e6:.1f} us")
+
+
+def determinism(gen, data_dir):
+    here = digest(gen)
+    code = ("import sys; sys.path.insert(0, sys.argv[1]); "
+            "from benchmarks.worldgen_bench import digest, load; print(digest(load(sys.argv[2])))")
+    env = dict(os.environ, PYTHONHASHSEED="4242")
+    there = subprocess.run([sys.executable, "-c", code, ROOT, data_dir], capture_output=True, text=True,
+                           env=env, check=True).stdout.strip()
+    print(f"determinism  {DIGEST_SAMPLE} rooms in two processes: {'identical' if here == there else 'DIFFERENT'}")
+    return here == there
+
+
+def walk_order(gen, attunement):
+    """Room ids reachable from the first generated room, breadth first."""
+    first = str(gen.first_id)
+    order, seen = [first], {first}
+    for rid in order:
+        for target, gate in gen.portals(rid).items():
+            if gate <= attunement and target not in seen and target in gen:
+                seen.add(target)
+                order.append(target)
+    return order
+
+
+def reachable(gen):
+    top = max(gen.shortcut_attunement)
+    for attunement in (0, top):
+        start = time.perf_counter()
+        order = walk_order(gen, attunement)
+        print(f"reachable    {len(order)} of {len(gen)} rooms with attunement {attunement} "
+              f"({time.perf_counter() - start:.1f}s)")
+    return order
+
+
+def resident(gen, order, budget_mb):
+    tmp = tempfile.mkdtemp()
+    store = RoomStore(os.path.join(tmp, "world.db"), budget=int(budget_mb * 1024 * 1024), min_idle=0, generator=gen,
+                      encode=to_json)
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    peak = before
+    for i, rid in enumerate(order):
+        store[rid]
+        if i % 5000 == 0:
+            peak = max(peak, rss_mb())
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    rooms, size = store.resident()
+    print(f"resident     looked up {len(order)} rooms in {elapsed:.1f}s ({elapsed / len(order) * 1e6:.0f} us each)")
+    print(f"             {rooms} rooms resident, ~{size / 1024 / 1024:.1f} MB estimated "
+          f"(budget {budget_mb} MB); {store.stats['evictions']} evictions")
+    print(f"             RSS {before:.0f} MB before, {peak:.0f} MB peak, {rss_mb():.0f} MB after")
+    store.close()
+
+
+def compare_dict(gen, order):
+    gc.collect()
+    before = rss_mb()
+    world = {rid: gen.generate(rid) for rid in order}
+    gc.collect()
+    print(f"dict         all {len(world)} rooms in a dict: RSS {before:.0f} MB -> {rss_mb():.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(ROOT, "data"), help="data directory with worldgen.json")
+    parser.add_argument("--sample", type=int, default=5000, help="rooms timed by the generate benchmark")
+    parser.add_argument("--budget-mb", type=float, default=64, help="room store memory budget")
+    parser.add_argument("--compare-dict", action="store_true", help="also hold every room in a dict")
+    args = parser.parse_args()
+
+    gen = load(args.data)
+    print(f"{len(gen)} generated rooms ({gen.width}x{gen.height}, {len(gen.themes)} themes), seed {gen.seed!r}")
+    generate(gen, args.sample)
+    ok = determinism(gen, args.data)
+    order = reachable(gen)
+    resident(gen, order, args.budget_mb)
+    if args.compare_dict:
+        compare_dict(gen, order)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import uuid
+
+from socketio import PubSubManager
+
+# Channels on the queue. Socket.IO emits go out on SOCKETIO_CHANNEL to every
+# gateway worker, which delivers them to the sids it holds. Client events go
+# the other way on ENGINE_CHANNEL, to the one engine process that owns
+# `players` and `WORLD`.
+#
+# Messages cross processes as JSON, the way python-socketio's own RedisManager
+# sends them, and never pickled: unpickling runs code, and anyone able to
+# publish on the channel or connect to the broker could then run theirs in
+# every gateway and the engine.
+SOCKETIO_CHANNEL = "mud-socketio"
+ENGINE_CHANNEL = "mud-engine"
+
+
+class LocalBackend:
+    """
+    In-process pub/sub, for running an engine and gateways in one process
+    (tests, benchmarks). Every listener gets every message on its channel.
+    """
+
+    def __init__(self):
+        self._subscribers = {}  # channel -> list of queues
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for q in subscribers:
+            q.put(message)
+
+    def listen(self, channel):
+        # Subscribe now rather than on the first next(), so nothing published
+        # between here and the listener thread starting is lost
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(q)
+        return iter(q.get, None)
+
+
+# Unix socket broker wire format: a 4 byte big-endian length, then a UTF-8
+# JSON [op, channel, message] array. op is "sub" (message is None) or "pub".
+_HEADER = struct.Struct(">I")
+
+
+def _dumps(message):
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def _send_frame(sock, frame):
+    body = _dumps(frame)
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("broker connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock):
+    size, = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+class UnixSocketBackend:
+    """
+    Pub/sub through a broker on a Unix socket (see serve_broker), for running
+    gateways and the engine as separate processes on one host without Redis.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pub = None
+        self._pub_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def publish(self, channel, message):
+        with self._pub_lock:
+            if self._pub is None:
+                self._pub = self._connect()
+            try:
+                _send_frame(self._pub, ("pub", channel, message))
+            except OSError:
+                # Broker restarted; reconnect once and retry
+                self._pub.close()
+                self._pub = self._connect()
+                _send_frame(self._pub, ("pub", channel, message))
+
+    def listen(self, channel):
+        sock = self._connect()
+        _send_frame(sock, ("sub", channel, None))
+        return self._receive(sock)
+
+    def _receive(self, sock):
+        try:
+            while True:
+                _, _, message = _recv_frame(sock)
+                yield message
+        finally:
+            sock.close()
+
+
+class RedisBackend:
+    """Pub/sub on Redis, for gateways spread over several hosts. Needs `pip install redis`."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("the redis:// queue needs the redis package (pip install redis)")
+        self._redis = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self._redis.publish(channel, _dumps(message))
+
+    def listen(self, channel):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        for item in pubsub.listen():
+            if item.get('type') == 'message':
+                yield json.loads(item['data'])
+
+
+_local_backend = LocalBackend()
+
+
+def open_backend(url):
+    """
+    local://                 in this process only
+    unix:///run/mud.sock     through serve_broker() on that socket
+    redis://host:6379/0      through Redis
+    """
+    if url.startswith("local://"):
+        return _local_backend
+    if url.startswith("unix://"):
+        return UnixSocketBackend(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    raise ValueError(f"unknown queue URL {url!r}")
+
+
+class QueueManager(PubSubManager):
+    """A Socket.IO client manager that shares emits through any backend above."""
+    name = "mud-fanout"
+
+    def __init__(self, backend, channel=SOCKETIO_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.backend = backend
+
+    def _publish(self, data):
+        self.backend.publish(self.channel, data)
+
+    def _listen(self):
+        return self.backend.listen(self.channel)
+
+
+def _bind_broker(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(64)
+    return server
+
+
+def _run_broker(server):
+    subscribers = {}  # channel -> {connection id: (sock, send lock)}
+    lock = threading.Lock()
+
+    def handle(sock):
+        conn_id = uuid.uuid4().hex
+        send_lock = threading.Lock()
+        subscribed = []
+        try:
+            while True:
+                op, channel, message = _recv_frame(sock)
+                if op == "sub":
+                    with lock:
+                        subscribers.setdefault(channel, {})[conn_id] = (sock, send_lock)
+                    subscribed.append(channel)
+                elif op == "pub":
+                    with lock:
+                        targets = list(subscribers.get(channel, {}).values())
+                    for target, target_lock in targets:
+                        try:
+                            with target_lock:
+                                _send_frame(target, ("pub", channel, message))
+                        except OSError:
+                            pass  # its own reader thread cleans it up
+        except (ConnectionError, OSError, ValueError, TypeError):  # gone, or not speaking our frames
+            pass
+        finally:
+            with lock:
+                for channel in subscribed:
+                    subscribers.get(channel, {}).pop(conn_id, None)
+            sock.close()
+
+    while True:
+        sock, _ = server.accept()
+        threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+
+def serve_broker(path):
+    """Runs the Unix socket broker on path until the process exits."""
+    _run_broker(_bind_broker(path))
+
+
+def start_broker(path):
+    """Binds path now and runs the broker on a daemon thread."""
+    thread = threading.Thread(target=_run_broker, args=(_bind_broker(path),), daemon=True)
+    thread.start()
+    return thread
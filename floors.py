@@ -0,0 +1,116 @@
+"""
+What lies on a room's floor, as room['items']: item id -> [placed, dropped,
+dropped_at]. Ten potions dropped one by one are one stack, and picking one
+up is a dict update rather than a search of a list that grows with every
+kill. The dict is plain JSON, so the room store saves it with the rest of
+the room's state.
+
+`placed` is how many the data files put there; those never decay. `dropped`
+is how many players and kills have put down since, and dropped_at when the
+last of them was (time.time(), or 0 while nothing is dropped). A potion
+dropped onto the data files' own potions still decays: only the dropped
+part of a stack is ever reclaimed, by expire() once it has been left alone
+for a while (main.py's floor sweeper does that as drops come due).
+
+A floor holds at most `cap` items. Putting more down pushes the oldest
+drops off first; if only the data files' own items are left, nothing more
+fits.
+"""
+
+
+def from_list(item_ids):
+    """A floor holding item_ids as placed items, a list with repeats, e.g. from the data files or an old saved room."""
+    floor = {}
+    for item_id in item_ids:
+        if item_id is None:
+            continue  # old rooms could hold the loot of monsters without any
+        stack = floor.get(item_id)
+        if stack is None:
+            floor[item_id] = [1, 0, 0]
+        else:
+            stack[0] += 1
+    return floor
+
+
+def count(stack):
+    """Items in a stack, placed and dropped."""
+    return stack[0] + stack[1]
+
+
+def total(floor):
+    """Items on the floor. One term per stack, not per item."""
+    return sum(stack[0] + stack[1] for stack in floor.values())
+
+
+def add(floor, item_id, now, cap, qty=1):
+    """
+    Drops qty of item_id, stamped now. Returns how many older items were
+    pushed off the floor to make room, or None (and nothing is put down) if
+    there is no room even so.
+    """
+    over = total(floor) + qty - cap
+    pushed = 0
+    if over > 0:
+        drops = sorted((stack[2], other) for other, stack in floor.items() if stack[1] and other != item_id)
+        stack = floor.get(item_id)
+        if stack is not None and stack[1]:
+            drops.append((stack[2], item_id))  # its own drops go last, they are being refreshed
+        if sum(floor[other][1] for _, other in drops) < over:
+            return None
+        for _, other in drops:
+            if over <= 0:
+                break
+            taken = min(over, floor[other][1])
+            _take_dropped(floor, other, taken)
+            pushed += taken
+            over -= taken
+    stack = floor.get(item_id)
+    if stack is None:
+        floor[item_id] = [0, qty, now]
+    else:
+        stack[1] += qty
+        stack[2] = now
+    return pushed
+
+
+def _take_dropped(floor, item_id, qty):
+    stack = floor[item_id]
+    stack[1] -= qty
+    if not stack[1]:
+        stack[2] = 0
+        if not stack[0]:
+            del floor[item_id]
+
+
+def take(floor, item_id, qty=1):
+    """
+    Picks qty of item_id up, dropped ones first. False, and nothing taken,
+    if there aren't that many.
+    """
+    stack = floor.get(item_id)
+    if stack is None or stack[0] + stack[1] < qty:
+        return False
+    dropped = min(qty, stack[1])
+    stack[0] -= qty - dropped
+    stack[1] -= dropped
+    if not stack[1]:
+        stack[2] = 0
+    if not stack[0] + stack[1]:
+        del floor[item_id]
+    return True
+
+
+def next_drop(floor):
+    """dropped_at of the oldest drop, which decays first, or None if nothing dropped is here."""
+    return min((stack[2] for stack in floor.values() if stack[1]), default=None)
+
+
+def expire(floor, before):
+    """Reclaims the drops last added to before `before`. Returns how many items went."""
+    old = [item_id for item_id, stack in floor.items() if stack[1] and stack[2] < before]
+    reclaimed = 0
+    for item_id in old:
+        dropped = floor[item_id][1]
+        _take_dropped(floor, item_id, dropped)
+        reclaimed += dropped
+    return reclaimed
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class Timer:
+    __slots__ = ("when", "fn", "args", "cancelled")
+
+    def __init__(self, when, fn, args):
+        self.when = when
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class GameLoop:
+    """
+    One thread, one timer heap. Callbacks scheduled with call_at()/call_later()
+    run on the loop thread during the first tick at or after their due time,
+    so everything the engine does on a schedule happens in one place instead
+    of in a sleeping thread per fight.
+
+    The loop ticks `tick_rate` times a second. A tick that takes longer than
+    the tick interval counts as an overrun, and the missed ticks are skipped
+    rather than replayed. `lag` is how late a timer ran compared to its due time.
+
+    `tick_scope`, if given, is a context manager factory entered around every
+    tick, e.g. to batch up what the timers send. `timer_observer`, if given,
+    is called as timer_observer(fn, lag_seconds, run_seconds) after each timer.
+    """
+
+    def __init__(self, tick_rate=10, tick_scope=None, timer_observer=None):
+        self.tick_rate = tick_rate
+        self.tick_scope = tick_scope
+        self.timer_observer = timer_observer
+        self.interval = 1.0 / tick_rate
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"ticks": 0, "overruns": 0, "skipped_ticks": 0, "timers_run": 0, "errors": 0,
+                      "last_tick_ms": 0.0, "max_tick_ms": 0.0, "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def call_at(self, when, fn, *args):
+        """Runs fn(*args) on the loop thread at `when` (time.time() clock). Thread-safe."""
+        timer = Timer(when, fn, args)
+        with self._lock:
+            heapq.heappush(self._heap, (when, next(self._seq), timer))
+        return timer
+
+    def call_later(self, delay, fn, *args):
+        return self.call_at(time.time() + delay, fn, *args)
+
+    def call_soon(self, fn, *args):
+        """Runs fn(*args) on the next tick."""
+        return self.call_at(0, fn, *args)
+
+    def pending(self):
+        with self._lock:
+            return len(self._heap)
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run_once(self, now=None):
+        """Runs every timer that is due. Returns how many ran."""
+        now = time.time() if now is None else now
+        ran = 0
+        worst_lag = 0.0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                when, _, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+            lag = now - when if when else 0.0
+            worst_lag = max(worst_lag, lag)
+            started = time.perf_counter()
+            try:
+                timer.fn(*timer.args)
+            except Exception:
+                self.stats["errors"] += 1
+                traceback.print_exc()
+            if self.timer_observer is not None:
+                self.timer_observer(timer.fn, lag, time.perf_counter() - started)
+            ran += 1
+
+        self.stats["timers_run"] += ran
+        self.stats["last_lag_ms"] = worst_lag * 1000
+        self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], worst_lag * 1000)
+        return ran
+
+    def run_forever(self):
+        next_tick = time.time()
+        while True:
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            start = time.time()
+            if self.tick_scope is None:
+                self.run_once(start)
+            else:
+                with self.tick_scope():
+                    self.run_once(start)
+            elapsed = time.time() - start
+
+            self.stats["ticks"] += 1
+            self.stats["last_tick_ms"] = elapsed * 1000
+            self.stats["max_tick_ms"] = max(self.stats["max_tick_ms"], elapsed * 1000)
+
+            next_tick += self.interval
+            if elapsed > self.interval:
+                self.stats["overruns"] += 1
+            behind = time.time() - next_tick
+            if behind > 0:
+                # Don't try to catch up on ticks we slept through
+                skipped = int(behind / self.interval) + 1
+                self.stats["skipped_ticks"] += skipped
+                next_tick += skipped * self.interval
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,153 @@
+"""
+Runs the MUD as several gateway worker processes behind one listening
+socket, in front of one engine process (main.py) that owns the game.
+
+Gateways only hold connections: they forward each client event to the
+engine over the queue (fanout.ENGINE_CHANNEL) and deliver whatever the engine
+emits back (fanout.SOCKETIO_CHANNEL) to the sockets they hold. `players` and
+`WORLD` only ever exist in the engine, so workers can't disagree about them.
+
+The master process binds the listener, starts the engine and hands the
+listening socket to each worker, and the kernel spreads new connections over
+them. Workers only speak the websocket transport: with no sticky sessions a
+long-polling client's next request could land on another worker.
+
+    python gateway.py --workers 4 --port 8000
+    MUD_QUEUE=redis://localhost:6379/0 python gateway.py
+
+Settings default from MUD_GATEWAY_WORKERS, MUD_HOST, MUD_PORT and MUD_QUEUE
+(unix:///tmp/mud-fanout.sock, with the broker run by the master).
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from flask import Flask, render_template, request
+from flask_socketio import SocketIO
+from werkzeug.serving import make_server
+
+import fanout
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUEUE = "unix:///tmp/mud-fanout.sock"
+ENGINE_READY_TIMEOUT = 30  # seconds
+
+log = logging.getLogger("mud.gateway")
+
+
+def create_gateway(backend):
+    """A gateway app and its SocketIO, forwarding to whichever engine listens on backend."""
+    app = Flask(__name__)
+    socketio = SocketIO(app, client_manager=fanout.QueueManager(backend),
+                        async_mode='threading', transports=['websocket'])
+
+    def forward(event, *args):
+        backend.publish(fanout.ENGINE_CHANNEL, {"event": event, "sid": request.sid, "args": list(args)})
+
+    @app.route('/')
+    def index(): return render_template('index.html', transports=['websocket'])
+
+    @socketio.on('connect')
+    def handle_connect(auth=None):
+        # The engine never sees the socket, so it gets the address from here
+        forward('connect', auth, request.remote_addr)
+
+    @socketio.on('disconnect')
+    def handle_disconnect():
+        forward('disconnect')
+
+    @socketio.on('hello')
+    def handle_hello(data):
+        forward('hello', data)
+
+    @socketio.on('command')
+    def handle_command(data):
+        forward('command', data)
+
+    return app, socketio
+
+
+def run_worker(fd, host, port, queue_url):
+    app, _ = create_gateway(fanout.open_backend(queue_url))
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    log.info("gateway worker %d serving", os.getpid())
+    server.serve_forever()
+
+
+def start_engine(queue_url):
+    """Starts main.py as the engine and waits until it is taking events off the queue."""
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ, MUD_QUEUE=queue_url, MUD_READY_FD=str(ready_w))
+    engine = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=ROOT, env=env,
+                              pass_fds=(ready_w,))
+    os.close(ready_w)
+    try:
+        ready, _, _ = select.select([ready_r], [], [], ENGINE_READY_TIMEOUT)
+        if not ready or not os.read(ready_r, 1):
+            engine.terminate()
+            raise RuntimeError("the engine did not start")
+    finally:
+        os.close(ready_r)
+    return engine
+
+
+def run_master(args):
+    if args.queue.startswith("unix://"):
+        fanout.start_broker(args.queue[len("unix://"):])
+
+    listener = socket.create_server((args.host, args.port), backlog=128)
+    listener.set_inheritable(True)
+    fd = listener.fileno()
+
+    children = [start_engine(args.queue)]
+    for _ in range(args.workers):
+        children.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker-fd", str(fd),
+             "--host", args.host, "--port", str(args.port), "--queue", args.queue],
+            cwd=ROOT, pass_fds=(fd,)))
+    log.info("%d gateway workers on %s:%d, queue %s", args.workers, args.host, args.port, args.queue)
+
+    def stop(signum=None, frame=None):
+        # Workers first, so their disconnects reach the engine before it exits
+        for child in reversed(children):
+            if child.poll() is None:
+                child.terminate()
+                try:
+                    child.wait(10)
+                except subprocess.TimeoutExpired:
+                    child.kill()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # If any process dies, take the rest down rather than run half a server
+    while all(child.poll() is None for child in children):
+        time.sleep(0.5)
+    stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MUD_GATEWAY_WORKERS", os.cpu_count() or 2)))
+    parser.add_argument("--host", default=os.environ.get("MUD_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MUD_PORT", 8000)))
+    parser.add_argument("--queue", default=os.environ.get("MUD_QUEUE", DEFAULT_QUEUE))
+    parser.add_argument("--worker-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("MUD_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.worker_fd is not None:
+        run_worker(args.worker_fd, args.host, args.port, args.queue)
+    else:
+        run_master(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Player inventories as item id -> quantity, so a hundred potions are one
+entry and taking, using or dropping one is a dict update whatever else is
+in the pack. The inventory table in players.db already stores them this
+way; Inventory is the same shape in memory.
+
+An InventoryRules holds the limits every inventory shares: how many of one
+item fit in a stack (an item's own "stack" field, else stack_limit), and
+optionally a total weight from the items' "weight" fields. Items without a
+weight weigh nothing. The running weight is kept as items come and go, so
+checking the cap is O(1) too.
+
+Limits are checked when something is added, not when an inventory is
+loaded: a player already carrying more than a new limit keeps it, they just
+can't pick up more.
+"""
+
+
+class InventoryRules:
+    """Limits shared by every inventory. max_weight 0 means no weight cap."""
+
+    def __init__(self, catalog, stack_limit=99, max_weight=0):
+        self.catalog = catalog  # item id -> item dict, ITEMS
+        self.stack_limit = stack_limit
+        self.max_weight = max_weight
+
+    def weight(self, item_id):
+        return self.catalog.get(item_id, {}).get('weight') or 0
+
+    def stack(self, item_id):
+        return self.catalog.get(item_id, {}).get('stack', self.stack_limit)
+
+    def new(self, contents=()):
+        """
+        An Inventory holding `contents`: a mapping of item id -> quantity,
+        (item id, quantity) rows as read from the inventory table, or a
+        legacy flat list of item ids with repeats.
+        """
+        inventory = Inventory(self)
+        pairs = contents.items() if isinstance(contents, dict) else contents
+        for entry in pairs:
+            item_id, qty = (entry, 1) if isinstance(entry, str) else entry
+            if qty > 0:
+                inventory.add(item_id, qty)
+        return inventory
+
+
+class Inventory(dict):
+    """item id -> quantity (always > 0). Use add() and remove() rather than setting counts directly."""
+    __slots__ = ("rules", "weight")
+
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = rules
+        self.weight = 0
+
+    def count(self, item_id):
+        return self.get(item_id, 0)
+
+    def refuses(self, item_id, qty=1):
+        """Why qty more of item_id won't fit ('stack' or 'weight'), or None if they will."""
+        rules = self.rules
+        if self.get(item_id, 0) + qty > rules.stack(item_id):
+            return 'stack'
+        if rules.max_weight and self.weight + rules.weight(item_id) * qty > rules.max_weight:
+            return 'weight'
+        return None
+
+    def add(self, item_id, qty=1):
+        """Adds qty of item_id, limits or not; check refuses() first where they apply."""
+        self[item_id] = self.get(item_id, 0) + qty
+        self.weight += self.rules.weight(item_id) * qty
+
+    def remove(self, item_id, qty=1):
+        """Takes qty of item_id out. False, and nothing taken, if there aren't that many."""
+        have = self.get(item_id, 0)
+        if have < qty:
+            return False
+        if have == qty:
+            del self[item_id]
+        else:
+            self[item_id] = have - qty
+        self.weight -= self.rules.weight(item_id) * qty
+        return True
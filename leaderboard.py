@@ -0,0 +1,54 @@
+import bisect
+import threading
+
+
+class Leaderboard:
+    """
+    Players ordered by XP, kept sorted as scores change.
+    Every known player has an entry, not just the top N, so someone dropping
+    out of the top (XP resets on level up) is replaced without asking the DB.
+    Updates are O(log n) to find the slot plus a list shift; top() is a slice.
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self._entries = {}  # name -> (level, xp, gold)
+        self._order = []    # sorted (-xp, name) keys
+        self._lock = threading.Lock()
+
+    def seed(self, rows):
+        """Replaces the contents with (name, level, xp, gold) rows, e.g. from the DB."""
+        with self._lock:
+            self._entries = {name: (level, xp, gold) for name, level, xp, gold in rows}
+            self._order = sorted((-xp, name) for name, (level, xp, gold) in self._entries.items())
+
+    def update(self, name, level, xp, gold):
+        with self._lock:
+            old = self._entries.get(name)
+            if old == (level, xp, gold):
+                return
+            if old is not None and old[1] != xp:
+                self._remove_key((-old[1], name))
+            if old is None or old[1] != xp:
+                bisect.insort(self._order, (-xp, name))
+            self._entries[name] = (level, xp, gold)
+
+    def remove(self, name):
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._remove_key((-old[1], name))
+
+    def _remove_key(self, key):
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    def top(self, limit=None):
+        """Returns [(name, level, xp, gold), ...] with the highest XP first."""
+        with self._lock:
+            keys = self._order[:limit or self.size]
+            return [(name,) + self._entries[name] for _, name in keys]
+
+    def __len__(self):
+        return len(self._entries)
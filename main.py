@@ -1,623 +1,1054 @@
 import random
+import bisect
+import heapq
 import time
 import threading
 import sqlite3
+import os
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit, join_room, leave_room
+import logging
+import atexit
+import signal
+import sys
+import traceback
+import itertools
+import secrets
+from werkzeug.serving import make_server
+from flask import Flask, Response, render_template, request
+from flask_socketio import SocketIO
+from itsdangerous import BadSignature, URLSafeSerializer
 from collections import Counter
+from contextlib import contextmanager
+from storage import ConnectionPool
+from leaderboard import Leaderboard
+from gameloop import GameLoop
+from roomstore import RoomStore
+from routes import RouteIndex
+from inventory import InventoryRules
+import auth
+import fanout
+import floors
+import metrics
+import monsters
+import worlddata
+import worldgen
+
+logging.basicConfig(level=os.environ.get("MUD_LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("mud")
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'incarnadine_secret'
-socketio = SocketIO(app)
+app.config['SECRET_KEY'] = os.environ.get("MUD_SECRET_KEY", 'incarnadine_secret')  # signs resume tokens
 
-DB_PATH = "players.db"
+# With MUD_QUEUE set (local://, unix:///path or redis://...) this process is
+# the engine behind gateway.py: it owns all game state, takes client events
+# off the queue and publishes its emits back for the gateways to deliver.
+# Without it, it serves clients itself as before.
+MUD_QUEUE = os.environ.get("MUD_QUEUE")
+if MUD_QUEUE:
+    socketio = SocketIO(app, client_manager=fanout.QueueManager(fanout.open_backend(MUD_QUEUE), write_only=True))
+else:
+    socketio = SocketIO(app)
+
+# Everything /metrics reports. Hot paths only observe into histograms; the
+# rest is read from the stats dicts the engine keeps anyway when scraped
+# (see the METRICS section at the bottom).
+METRICS = metrics.Registry()
+DB_WAIT_SECONDS = METRICS.histogram("mud_db_wait_seconds", "Time spent waiting for a pooled SQLite connection.")
+DB_BUSY_SECONDS = METRICS.histogram("mud_db_busy_seconds", "Time each borrowed SQLite connection was in use.")
+
+
+def _observe_db(wait, held):
+    DB_WAIT_SECONDS.observe(wait)
+    DB_BUSY_SECONDS.observe(held)
+
+
+DB_PATH = os.environ.get("MUD_DB_PATH", "players.db")
+db = ConnectionPool(DB_PATH, size=int(os.environ.get("MUD_DB_POOL_SIZE", 4)), observer=_observe_db)
 
 
 # --- 1. DATABASE UPDATES ---
+# Bump when the schema changes and add the upgrade step to init_db()
+SCHEMA_VERSION = 1
+
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Added password_hash column
-    c.execute('''CREATE TABLE IF NOT EXISTS players
-                 (username TEXT PRIMARY KEY, password_hash TEXT, location TEXT, 
-                  level INTEGER, xp INTEGER, gold INTEGER, attunement INTEGER, 
-                  hardiness INTEGER, wit INTEGER, current_hp INTEGER, equipped TEXT, inventory TEXT)''')
-    conn.commit()
-    conn.close()
-
-
-def save_player(p, password=None):
+    with db.transaction() as conn:
+        # Added password_hash column. `inventory` is the legacy JSON column, NULL once migrated.
+        conn.execute('''CREATE TABLE IF NOT EXISTS players
+                     (username TEXT PRIMARY KEY, password_hash TEXT, location TEXT, 
+                      level INTEGER, xp INTEGER, gold INTEGER, attunement INTEGER, 
+                      hardiness INTEGER, wit INTEGER, current_hp INTEGER, equipped TEXT, inventory TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS inventory
+                     (username TEXT NOT NULL, item_id TEXT NOT NULL, qty INTEGER NOT NULL,
+                      PRIMARY KEY (username, item_id)) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_players_xp ON players (xp DESC)")
+        # Names are case-insensitive: logins look the account up through this
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_players_name_nocase ON players (username COLLATE NOCASE)")
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            migrate_inventory_json(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_inventory_json(conn):
+    """Moves the old players.inventory JSON lists into the inventory table."""
+    rows = conn.execute("SELECT username, inventory FROM players WHERE inventory IS NOT NULL").fetchall()
+    moved = 0
+    for username, inv_json in rows:
+        try:
+            items = json.loads(inv_json) or []
+        except ValueError:
+            log.warning("unreadable inventory for %s, leaving it in place: %r", username, inv_json)
+            continue
+        for item_id, qty in Counter(items).items():
+            conn.execute(INVENTORY_DELTA, (username, item_id, qty))
+        conn.execute("UPDATE players SET inventory = NULL WHERE username=?", (username,))
+        moved += 1
+    if moved:
+        log.info("migrated %d JSON inventories to the inventory table", moved)
+
+
+# Fixed query strings, so each pooled connection prepares them once
+PLAYER_UPSERT = '''INSERT INTO players (username, password_hash, location, level, xp, gold,
+                                      attunement, hardiness, wit, current_hp, equipped)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(username) DO UPDATE SET
+                       password_hash=excluded.password_hash, location=excluded.location,
+                       level=excluded.level, xp=excluded.xp, gold=excluded.gold,
+                       attunement=excluded.attunement, hardiness=excluded.hardiness, wit=excluded.wit,
+                       current_hp=excluded.current_hp, equipped=excluded.equipped'''
+PLAYER_SELECT = '''SELECT username, password_hash, location, level, xp, gold,
+                          attunement, hardiness, wit, current_hp, equipped
+                   FROM players WHERE username=? COLLATE NOCASE
+                   ORDER BY username=? DESC LIMIT 1'''
+INVENTORY_SELECT = "SELECT item_id, qty FROM inventory WHERE username=? ORDER BY item_id"
+INVENTORY_DELTA = '''INSERT INTO inventory (username, item_id, qty) VALUES (?, ?, ?)
+                     ON CONFLICT(username, item_id) DO UPDATE SET qty = qty + excluded.qty'''
+INVENTORY_PRUNE = "DELETE FROM inventory WHERE username=? AND item_id=? AND qty <= 0"
+LEADERBOARD_SELECT = "SELECT username, level, xp, gold FROM players ORDER BY xp DESC LIMIT ?"
+LEADERBOARD_SEED = "SELECT username, level, xp, gold FROM players"
+
+# --- WRITE-BEHIND SAVES ---
+# save_player() only records the player's latest row here, and inventory
+# changes are queued as per-item quantity deltas. A single writer thread drains
+# both every SAVE_FLUSH_INTERVAL seconds in one transaction, so ten saves of the
+# same player between flushes cost one row write, and a pickup followed by a
+# drop of the same item cancels out entirely.
+SAVE_FLUSH_INTERVAL = 2.0
+SLOW_FLUSH_MS = 250
+
+_pending_saves = {}  # username -> row tuple
+_pending_items = {}  # (username, item_id) -> net quantity change
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()  # held for the whole DB write, so readers can wait on it
+_flush_requested = threading.Event()
+
+SAVE_STATS = {"queued": 0, "merged": 0, "flushes": 0, "rows_written": 0, "item_deltas_written": 0,
+              "failures": 0, "slow_flushes": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+SAVE_FLUSH_SECONDS = METRICS.histogram("mud_save_flush_seconds", "Duration of write-behind flushes.")
+
+
+def _player_row(p):
+    return (p['name'], p['password_hash'], p['location'], p['level'], p['xp'], p['gold'],
+            p['stats']['Attunement'], p['stats']['Hardiness'], p['stats']['Wit'],
+            p['current_hp'], p['equipped'])
+
+
+def save_player(p):
     """
-    Saves player. If a password is provided (on creation), it hashes it.
-    Otherwise, it keeps the existing hash.
+    Saves player stats, password hash included (hashing happens in the
+    login pool, see LOGIN).
+    The row is snapshotted now and written by the next flush. Inventory is
+    not part of the row, see save_inventory_change().
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    inv_json = json.dumps(p['inventory'])
+    row = _player_row(p)
+    with _pending_lock:
+        if p['name'] in _pending_saves:
+            SAVE_STATS['merged'] += 1
+        _pending_saves[p['name']] = row
+        SAVE_STATS['queued'] += 1
+
+
+def save_inventory_change(p, item_id, qty):
+    """Queues +qty/-qty of one item for a registered player."""
+    if "Guest_" in p['name']:
+        return
+    key = (p['name'], item_id)
+    with _pending_lock:
+        if key in _pending_items:
+            SAVE_STATS['merged'] += 1
+        _pending_items[key] = _pending_items.get(key, 0) + qty
+        SAVE_STATS['queued'] += 1
 
-    if password:
-        p['password_hash'] = generate_password_hash(password)
 
-    c.execute('''INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (p['name'], p['password_hash'], p['location'], p['level'], p['xp'], p['gold'],
-               p['stats']['Attunement'], p['stats']['Hardiness'], p['stats']['Wit'],
-               p['current_hp'], p['equipped'], inv_json))
-    conn.commit()
-    conn.close()
+def flush_saves(username=None):
+    """
+    Writes every queued row and inventory delta in one transaction, or only
+    those of username. Returns the write count.
+    """
+    with _flush_lock:
+        with _pending_lock:
+            if username is None:
+                batch = dict(_pending_saves)
+                _pending_saves.clear()
+                deltas = {key: qty for key, qty in _pending_items.items() if qty}
+                _pending_items.clear()
+            else:
+                # Queued under the name as registered, whatever case it was typed in
+                folded = username.lower()
+                batch = {name: _pending_saves.pop(name) for name in
+                         [name for name in _pending_saves if name.lower() == folded]}
+                keys = [key for key in _pending_items if key[0].lower() == folded]
+                deltas = {key: _pending_items.pop(key) for key in keys}
+                deltas = {key: qty for key, qty in deltas.items() if qty}
+            if not batch and not deltas:
+                return 0
+
+        start = time.perf_counter()
+        try:
+            with db.transaction() as conn:
+                conn.executemany(PLAYER_UPSERT, batch.values())
+                conn.executemany(INVENTORY_DELTA, [(name, item, qty) for (name, item), qty in deltas.items()])
+                conn.executemany(INVENTORY_PRUNE, [key for key, qty in deltas.items() if qty < 0])
+        except sqlite3.Error:
+            # Put the work back: rows unless a newer save arrived, deltas always add up
+            with _pending_lock:
+                for name, row in batch.items():
+                    _pending_saves.setdefault(name, row)
+                for key, qty in deltas.items():
+                    _pending_items[key] = _pending_items.get(key, 0) + qty
+                SAVE_STATS['failures'] += 1
+            raise
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        SAVE_STATS['flushes'] += 1
+        SAVE_STATS['rows_written'] += len(batch)
+        SAVE_STATS['item_deltas_written'] += len(deltas)
+        SAVE_STATS['last_flush_ms'] = elapsed_ms
+        SAVE_STATS['max_flush_ms'] = max(SAVE_STATS['max_flush_ms'], elapsed_ms)
+        SAVE_FLUSH_SECONDS.observe(elapsed_ms / 1000)
+        if elapsed_ms > SLOW_FLUSH_MS:
+            SAVE_STATS['slow_flushes'] += 1
+            log.warning("slow player flush, %d rows + %d item deltas in %.0fms", len(batch), len(deltas), elapsed_ms)
+        return len(batch) + len(deltas)
+
+
+def request_flush():
+    """Wakes the writer thread without waiting for the write to finish."""
+    _flush_requested.set()
+
+
+def save_queue_stats():
+    with _pending_lock:
+        depth = len(_pending_saves) + len(_pending_items)
+    return dict(SAVE_STATS, queue_depth=depth)
+
+
+def save_writer():
+    while True:
+        _flush_requested.wait(SAVE_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        try:
+            flush_saves()
+        except sqlite3.Error as e:
+            log.warning("player flush failed, will retry: %s", e)
 
 
 def load_player_data(username):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM players WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    """
+    The account called username in any case, with its name as registered, or
+    None. Accounts from before names were case-insensitive can differ only in
+    case; an exact match wins then.
+    """
+    # A save for this player may still be sitting in the queue (quick relog).
+    # Write just theirs; the lock also waits out a flush already writing it
+    flush_saves(username)
+    with db.connection() as conn:
+        row = conn.execute(PLAYER_SELECT, (username, username)).fetchone()
+        items = conn.execute(INVENTORY_SELECT, (row[0],)).fetchall() if row else []
     if row:
         return {
             "name": row[0], "password_hash": row[1], "location": row[2],
             "level": row[3], "xp": row[4], "gold": row[5],
             "stats": {"Attunement": row[6], "Hardiness": row[7], "Wit": row[8]},
-            "current_hp": row[9], "equipped": row[10], "inventory": json.loads(row[11]), "is_in_combat": False
+            "current_hp": row[9], "equipped": row[10],
+            "inventory": INVENTORY.new(items), "is_in_combat": False
         }
     return None
 
 def get_leaderboard(limit=10):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Sort by XP descending so the highest earners are at the top
-    c.execute("SELECT username, level, xp, gold FROM players ORDER BY xp DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    """Reads the ranking straight from SQLite. `top` uses the in-memory `leaderboard` instead."""
+    with db.connection() as conn:
+        # Sort by XP descending so the highest earners are at the top
+        return conn.execute(LEADERBOARD_SELECT, (limit,)).fetchall()
+
+
+# Live ranking for `top`: seeded from the DB once, then kept current as
+# online players earn XP and gold, including progress not yet flushed.
+leaderboard = Leaderboard(size=10)
+
+
+def seed_leaderboard():
+    with db.connection() as conn:
+        leaderboard.seed(conn.execute(LEADERBOARD_SEED).fetchall())
+
+
+def update_leaderboard(p):
+    if "Guest_" not in p['name']:
+        leaderboard.update(p['name'], p['level'], p['xp'], p['gold'])
 
 
 init_db()
+seed_leaderboard()
+threading.Thread(target=save_writer, daemon=True).start()
+atexit.register(db.close)
+atexit.register(flush_saves)  # atexit runs LIFO: flush before closing the pool
 
 # --- 1. DATABASES ---
-ITEMS = {
-    # --- CONSUMABLES ---
-    "potion": {"name": "Red Potion", "type": "potion", "price": 20, "effect": "heal", "value": 30, "desc": "A bubbling crimson liquid. Heals 30 HP."},
-    "elixir": {"name": "Luminous Elixir", "type": "potion", "price": 50, "effect": "heal", "value": 100, "desc": "Smells like ozone. Heals 100 HP."},
-    "stale_bread": {"name": "Stale Bread", "type": "food", "price": 2, "effect": "heal", "value": 5, "desc": "Hard enough to use as a weapon, but edible. Heals 5 HP."},
-
-    # --- WEAPONS / GEAR ---
-    "ladle": {"name": "Plastic Ladle", "type": "weapon", "damage": 1, "weight": 1, "price": 5, "value": 1,
-              "desc": "How could this get worse as a weapon?"},
-    "spoon": {"name": "Wooden Spoon", "type": "weapon", "damage": 2, "weight": 1, "price": 10, "value": 2,
-                    "desc": "What are you going to stir me to death?"},
-    "rusty_sword": {"name": "Rusty Sword", "type": "weapon", "damage": 3, "weight": 4, "price": 15, "value": 5, "desc": "Better than your fists, barely."},
-    "sword": {"name": "Iron Longsword", "type": "weapon", "damage": 15, "weight": 5, "price": 50, "value": 10, "desc": "Its a crappy iron sword"},
-    "broadsword": {"name": "Heavy Broadsword", "type": "weapon", "damage": 25, "weight": 8, "price": 150, "value": 75, "desc": "A double-edged blade with a leather-wrapped hilt."},
-
-    # --- MATERIALS & QUEST ITEMS ---
-    "iron_ingot": {"name": "Iron Ingot", "type": "material", "price": 40, "effect": None, "value": 20, "desc": "A heavy block of metal. Could be used for crafting."},
-    "iron_key": {"name": "Iron Key", "type": "quest", "price": 0, "effect": "unlock", "value": 0, "desc": "A heavy, skeleton-style key from the Foyer."},
-    "the_crown": {"name": "The Diamond Crown", "type": "quest", "price": 10000, "effect": "win", "value": 0, "desc": "The ultimate symbol of the Castle's master."},
-
-    # --- ATTUNEMENT ITEMS ---
-    "crystal": {"name": "Prismatic Crystal", "type": "potion", "price": 100, "effect": "boost", "value": 2, "desc": "Used to increase your magical attunement (+2)."},
-    "chronoshard": {"name": "Chronoshard", "type": "potion", "price": 500, "effect": "boost", "value": 10, "desc": "A fragment of a broken timeline. +10 Attunement."},
-
-    # --- FLAVOR / TRASH ---
-    "ever-ice": {"name": "Ever-Ice brand drink", "type": "flavor", "price": 10, "effect": None,
-                      "value": 2,
-                      "desc": "Ever-Ice, Deep Freeze Cool in every bottle. BEWARE: Do not drink unless your a Snowclaw."},
-    "eternal_watch": {"name": "The Time Piece for fit for an Eternal", "type": "flavor", "price": 1000, "effect": None, "value": 250,
-                      "desc": "Pretty awesome watch, to bad you cant do anything with it but I bet its worth alot of money!!"},
-    "broken_bottle": {"name": "Broken brown beer bottle", "type": "flavor", "price": 2, "effect": None, "value": 0,
-                     "desc": "Dont look to hard you'll poke your eye out."},
-    "lump_of_coal": {"name": "Lump of Coal", "type": "flavor", "price": 2, "effect": None, "value": 0,
-                      "desc": "Really no value unless your cold, probably just put it back."},
-    "porcelain_cup": {"name": "Victorian era cup", "type": "flavor", "price": 2, "effect": None, "value": 0,
-                    "desc": "Just and old cup, its empty."},
-    "sheet_music": {"name": "Old page of sheet music", "type": "flavor", "price": 2, "effect": None, "value": 0,
-                  "desc": "It contains half a poem, I thought I saw the first half somewhere."},
-    "old_map": {"name": "Old Map", "type": "flavor", "price": 5, "effect": None, "value": 0, "desc": "Smudged and unreadable."},
-    "parchment": {"name": "Scrap of Parchment", "type": "flavor", "price": 2, "effect": None, "value": 0, "desc": "It contains half a poem."},
-    "game_token": {"name": "Arcade Token", "type": "flavor", "price": 5, "effect": None, "value": 0, "desc": "Good for one game of Galaga... if the power was on."},
-    "void_dust": {"name": "Void Dust", "type": "flavor", "price": 25, "effect": None, "value": 0, "desc": "It slips through your fingers."},
-    "empty_vial": {"name": "Empty Vial", "type": "flavor", "price": 5, "effect": None, "value": 0,
-                  "desc": "Just a useless piece of glass."}
-
-}
-
-SPELLS = {
-    "fireball": {"cost": 10, "dmg_mult": 2.5, "desc": "High damage attack (10 HP)."},
-    "mend": {"cost": 15, "heal": 35, "desc": "Heal mid-battle (15 HP)."},
-    "blur": {"cost": 8, "buff": "wit", "value": 15, "desc": "Boost escape chance (8 HP)."}
-}
-
+# Items, spells, monster templates and rooms live in data/*.json (see
+# worlddata.py), checked against each other and indexed once at startup.
+# The rooms are then imported into the room store (see below) and only read
+# from the JSON again when the files change. Past them, data/worldgen.json
+# sets up the generated rooms (see worldgen.py), made as they are first used.
+DATA_DIR = os.environ.get("MUD_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+WORLD_DB_PATH = os.environ.get("MUD_WORLD_DB_PATH", os.path.join(os.path.dirname(DB_PATH), "world.db"))
+ROOM_CACHE_BYTES = int(float(os.environ.get("MUD_ROOM_CACHE_MB", 64)) * 1024 * 1024)
+PRELOAD_ROOMS = int(os.environ.get("MUD_PRELOAD_ROOMS", 1000))
+
+WORLD = RoomStore(WORLD_DB_PATH, budget=ROOM_CACHE_BYTES, pinned=lambda rid: rid in room_occupants,
+                  encode=monsters.to_json)
+atexit.register(WORLD.close)
+_world_source = repr((worlddata.source_key(DATA_DIR), worldgen.source_key(DATA_DIR)))
+if WORLD.source() == _world_source:
+    DATA = worlddata.load(DATA_DIR, rooms=False)
+    GENERATOR = worldgen.load(DATA_DIR, DATA)
+else:
+    DATA = worlddata.load(DATA_DIR)
+    for warning in DATA.warnings:
+        log.warning("world data: %s", warning)
+    GENERATOR = worldgen.load(DATA_DIR, DATA, DATA.rooms)
+    WORLD.import_rooms(GENERATOR.link(DATA.rooms) if GENERATOR else DATA.rooms, _world_source)
+    log.info("imported %d rooms into %s", len(DATA.rooms), WORLD_DB_PATH)
+    DATA.rooms = {}  # the store has them now
+WORLD.generator = GENERATOR
+# Rooms have always come back as the data files describe them after a
+# restart; what eviction saved only has to last while the server is up.
+WORLD.reset_state()
+
+ITEMS = DATA.items
+SPELLS = DATA.spells
+ITEM_IDS_BY_NAME = DATA.item_ids_by_name  # lowercase display name -> item id
+
+
+def item_id_for(text):
+    """The item id a player means by text, an id or a display name in any case. Unknown text comes back lowercased."""
+    text = text.lower()
+    return text if text in ITEMS else ITEM_IDS_BY_NAME.get(text, text)
+
+
+# p['inventory'] is an inventory.Inventory, item id -> quantity. No stack
+# holds more than STACK_LIMIT of one item (or the item's own "stack"), and
+# with CARRY_WEIGHT set nobody carries more than that many lbs of weighted
+# items. 0 leaves weight uncapped.
+STACK_LIMIT = int(os.environ.get("MUD_STACK_LIMIT", 99))
+CARRY_WEIGHT = float(os.environ.get("MUD_CARRY_WEIGHT", 0))
+INVENTORY = InventoryRules(ITEMS, STACK_LIMIT, CARRY_WEIGHT)
+
+
+def refusal(p, item_id, reason):
+    """What to tell p when their inventory refuses() an item."""
+    name = ITEMS[item_id]['name']
+    if reason == 'stack':
+        return f"You can't carry more than {INVENTORY.stack(item_id)} of the {name}."
+    return f"The {name} is too heavy: you already carry {p['inventory'].weight:g} of {CARRY_WEIGHT:g} lbs."
 
 
 # --- 2. THE EXPANDED WORLD (144,000-ish Doors) ---
-WORLD = {
-    # --- REGION 1: THE CORE CASTLE ---
-    "1": {
-        "name": "The Grand Foyer",
-        "desc": "The heart of the Castle. Phil sits at his card table outside his shop.",
-        "portals": {
-            "2": {"name": "The Library", "min_attunement": 0},
-            "3": {"name": "The Kitchen", "min_attunement": 0},
-            "4": {"name": "The Battlements", "min_attunement": 0},
-            "8": {"name": "The Lab", "min_attunement": 0},
-            "12": {"name": "The Music Room", "min_attunement": 0},
-            "15": {"name": "The Armory", "min_attunement": 0}
-        },
-        "has_shop": True,
-        "is_safe": True,
-        "items": [],
-        "monsters": [
-            {"name": "Castle Guard", "hp": 60, "max_hp": 60, "atk": 10, "xp": 40, "gold": 15, "loot": "iron_key", "is_aggro": False, "is_roaming": True, "dead_until": 0}
-        ]
-    },
-    "2": {
-        "name": "The Library of Whispers",
-        "desc": "Infinite shelves of gossip. Ozone fills the air.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "16": {"name": "Restricted Section", "min_attunement": 5},
-            "666": {"name": "The Void", "min_attunement": 20}
-        },
-        "items": ["parchment"],
-        "monsters": [
-            {"name": "Paper Golem", "hp": 50, "max_hp": 50, "atk": 8, "xp": 60, "gold": 15, "loot": "potion", "is_aggro": False, "is_roaming": False, "dead_until": 0},
-            {"name": "Ink Sprite", "hp": 20, "max_hp": 20, "atk": 5, "xp": 25, "gold": 5, "loot": "void_dust", "is_aggro": True, "is_roaming": True, "dead_until": 0}
-        ]
-    },
-    "3": {
-        "name": "The Great Kitchens",
-        "desc": "Gnomes and steam-powered spits. Smells like roasted phoenix.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "20": {"name": "The Cellar", "min_attunement": 0}
-        },
-        "items": ["ladle"],
-        "monsters": [
-            {"name": "Kitchen Scullion", "hp": 40, "max_hp": 40, "atk": 7, "xp": 40, "gold": 10, "loot": "potion", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "4": {
-        "name": "The Outer Battlements",
-        "desc": "Cold wind and a view of 144,000 horizons.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "7": {"name": "Primeval World", "min_attunement": 10},
-            "21": {"name": "Clockwork Tower", "min_attunement": 5}
-        },
-        "items": [],
-        "monsters": [
-            {"name": "Castle Gargoyle", "hp": 90, "max_hp": 90, "atk": 18, "xp": 150, "gold": 45, "loot": "crystal", "is_aggro": True, "is_roaming": False, "dead_until": 0},
-            {"name": "Castle Guard", "hp": 60, "max_hp": 60, "atk": 10, "xp": 40, "gold": 15, "loot": "iron_key", "is_aggro": False, "is_roaming": True, "dead_until": 0}
-        ]
-    },
-
-    # --- REGION 2: THE ARCANE WING ---
-    "8": {
-        "name": "The Alchemical Laboratory",
-        "desc": "Beakers bubble without heat. Smells of cloves.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "9": {"name": "Crystal Garden", "min_attunement": 2},
-            "22": {"name": "Hall of Mirrors", "min_attunement": 5}
-        },
-        "items": ["empty_vial"],
-        "monsters": [
-            {"name": "Homunculus", "hp": 70, "max_hp": 70, "atk": 12, "xp": 90, "gold": 30, "loot": "elixir", "is_aggro": False, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "9": {
-        "name": "The Crystal Garden",
-        "desc": "Flora made of prismatic glass.",
-        "portals": {
-            "8": {"name": "The Lab", "min_attunement": 0},
-            "23": {"name": "Gravity Well", "min_attunement": 15}
-        },
-        "items": [],
-        "monsters": [
-            {"name": "Glass Spider", "hp": 110, "max_hp": 110, "atk": 22, "xp": 180, "gold": 60, "loot": "crystal", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "15": {
-        "name": "The Armory of Ages",
-        "desc": "Suits of armor stand in silent vigil.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "24": {"name": "The Observatory", "min_attunement": 8}
-        },
-        "items": ["rusty_sword"],
-        "monsters": [
-            {"name": "Animated Plate", "hp": 120, "max_hp": 120, "atk": 25, "xp": 200, "gold": 50, "loot": "potion", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "16": {
-        "name": "The Restricted Section",
-        "desc": "Books here are chained to the walls because they bite.",
-        "portals": {
-            "2": {"name": "The Library", "min_attunement": 0},
-        },
-        "items": [],
-        "monsters": [
-            {"name": "Book Wyrm", "hp": 60, "max_hp": 60, "atk": 14, "xp": 100, "gold": 25, "loot": "potion",
-             "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-
-# --- REGION 3: EARTH ECHOES (Low Magic, High Nostalgia) ---
-    "12": {
-        "name": "The Music Room",
-        "desc": "A piano plays itself. The notes are visible sparks.",
-        "portals": {
-            "1": {"name": "The Foyer", "min_attunement": 0},
-            "13": {"name": "Victorian Parlour", "min_attunement": 0},
-            "1984": {"name": "The Arcade", "min_attunement": 0}
-        },
-        "items": ["sheet_music"],
-        "monsters": []
-    },
-    "13": {
-        "name": "The Victorian Parlor",
-        "desc": "Dusty tea sets and velvet chairs. A grandfather clock ticks backward.",
-        "portals": {
-            "12": {"name": "The Music Room", "min_attunement": 0},
-            "14": {"name": "The Fog of London", "min_attunement": 0}
-        },
-        "items": ["porcelain_cup"],
-        "monsters": []
-    },
-    "14": {
-        "name": "London - 1888",
-        "desc": "Fog so thick you can taste the coal smoke. A gaslight flickers.",
-        "portals": {
-            "13": {"name": "The Parlor", "min_attunement": 0}
-        },
-        "items": ["lump_of_coal"],
-        "monsters": [
-            {
-                "name": "Street Urchin",
-                "hp": 25, "max_hp": 25, "atk": 5,
-                "xp": 20, "gold": 2, "loot": "potion",
-                "is_aggro": False,
-                "is_roaming": True, # Urchins wander around!
-                "dead_until": 0
-            }
-        ]
-    },
-    "1984": {
-        "name": "The Neon Arcade",
-        "desc": "Smells like stale popcorn and ozone. Pac-man beeps eternally.",
-        "portals": {
-            "12": {"name": "The Music Room", "min_attunement": 0},
-            "25": {"name": "Dive Bar", "min_attunement": 0}
-        },
-        "items": ["game_token"],
-        "monsters": [],
-        "can_rest": True
-    },
-    "25": {
-        "name": "New York - The Dive Bar",
-        "desc": "The Rusty Anchor. A jukebox plays 'True' by Spandau Ballet.",
-        "portals": {
-            "1984": {"name": "The Arcade", "min_attunement": 0}
-        },
-        "items": ["broken_bottle"],
-        "monsters": [
-            {
-                "name": "Drunk Brawler",
-                "hp": 55, "max_hp": 55, "atk": 10,
-                "xp": 70, "gold": 12, "loot": "potion",
-                "is_aggro": True,
-                "is_roaming": False, # Brawlers usually stay at the bar
-                "dead_until": 0
-            }
-        ]
-    },
-
-"7": {
-        "name": "The Primeval World",
-        "desc": "Portal 7 leads to a humid jungle. Dinosaurs rule here.",
-        "portals": {
-            "4": {"name": "The Outer Battlements", "min_attunement": 0},
-            "26": {"name": "Tar Pits", "min_attunement": 0}
-        },
-        "items": [],
-        "monsters": [
-            {
-                "name": "Allosaurus", "hp": 300, "max_hp": 300, "atk": 45,
-                "xp": 700, "gold": 200, "loot": "crystal",
-                "is_aggro": True, "is_roaming": True, "dead_until": 0
-            }
-        ]
-    },
-    "26": {
-        "name": "The Tar Pits",
-        "desc": "A sticky, bubbling landscape. Skeletal remains poke out of the black goo.",
-        "portals": {"7": {"name": "Primeval World", "min_attunement": 0}},
-        "items": [],
-        "monsters": [
-            {
-                "name": "Tar Elemental", "hp": 150, "max_hp": 150, "atk": 20,
-                "xp": 250, "gold": 40, "loot": "elixir",
-                "is_aggro": True, "is_roaming": False, "dead_until": 0
-            }
-        ]
-    },
-    "20": {
-        "name": "The Wine Cellar",
-        "desc": "Vast tuns of wine that could drown a giant. Deeply dark.",
-        "portals": {
-            "3": {"name": "The Kitchen", "min_attunement": 0},
-            "27": {"name": "Dark Catacombs", "min_attunement": 0}
-        },
-        "items": [],
-        "monsters": [
-            {
-                "name": "Giant Spider", "hp": 45, "max_hp": 45, "atk": 9,
-                "xp": 50, "gold": 5, "loot": "potion",
-                "is_aggro": True, "is_roaming": False, "dead_until": 0
-            }
-        ]
-    },
-    "27": {
-        "name": "The Catacombs",
-        "desc": "The bones of former Guests form the architecture here.",
-        "portals": {
-            "20": {"name": "The Cellar", "min_attunement": 0},
-            "28": {"name": "Frozen Waste", "min_attunement": 0}
-        },
-        "items": [],
-        "monsters": [
-            {
-                "name": "Skeletal Guest", "hp": 80, "max_hp": 80, "atk": 15,
-                "xp": 120, "gold": 30, "loot": "crystal",
-                "is_aggro": True, "is_roaming": True, "dead_until": 0
-            }
-        ]
-    },
-
-    # --- REGION 5: THE OUTER REALMS (Extreme Difficulty) ---
-    "666": {
-        "name": "The Void",
-        "desc": "Gravity is a suggestion.",
-        "portals": {
-            "2": {"name": "The Library", "min_attunement": 0},
-            "667": {"name": "Edge of Forever", "min_attunement": 50}
-        },
-        "items": [],
-        "monsters": [
-            {"name": "Chaos Beast", "hp": 250, "max_hp": 250, "atk": 35, "xp": 500, "gold": 120, "loot": "crystal", "is_aggro": True, "is_roaming": True, "dead_until": 0}
-        ]
-    },
-    "667": {
-        "name": "The Edge of Forever",
-        "desc": "A platform of white light overlooking the end of time. The silence is deafening.",
-        "portals": {
-            "666": {"name": "The Void", "min_attunement": 0},
-            "999": {"name": "The Throne Room", "min_attunement": 75}
-        },
-        "items": ["void_dust", "chronoshard"],
-        "monsters": [
-            {
-                "name": "Time Warden",
-                "hp": 400, "max_hp": 400, "atk": 55,
-                "xp": 1000, "gold": 500,
-                "loot": "eternal_watch",
-                "is_aggro": True,
-                "is_roaming": False, # Wardens guard the gate
-                "dead_until": 0
-            }
-        ]
-    },
-    "999": {
-        "name": "The Throne Room",
-        "desc": "A massive seat carved from a single diamond.",
-        "portals": {
-            "667": {"name": "Edge of Forever", "min_attunement": 0}
-        },
-        "items": ["the_crown"],
-        "monsters": [
-            {"name": "Incarnadine Avatar", "hp": 1000, "max_hp": 1000, "atk": 80, "xp": 5000, "gold": 2000, "loot": "crystal", "is_aggro": False, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-
-    # --- ADDITIONAL ODDITIES ---
-    "21": {
-        "name": "The Clockwork Tower",
-        "desc": "Gears the size of houses grind against each other.",
-        "portals": {"4": {"name": "Outer Battlements", "min_attunement": 0}},
-        "items": [],
-        "monsters": [
-            {"name": "Clockwork Soldier", "hp": 100, "max_hp": 100, "atk": 20, "xp": 180, "gold": 40, "loot": "potion", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "22": {
-        "name": "The Hall of Mirrors",
-        "desc": "Every reflection shows a different version of you.",
-        "portals": {"8": {"name": "The Lab", "min_attunement": 0}},
-        "items": [],
-        "monsters": [
-            {"name": "Mirror Doppelganger", "hp": 90, "max_hp": 90, "atk": 18, "xp": 160, "gold": 35, "loot": "elixir", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "23": {
-        "name": "The Gravity Well",
-        "desc": "You walk on the walls. The floor is the ceiling.",
-        "portals": {"9": {"name": "Crystal Garden", "min_attunement": 0}},
-        "items": [],
-        "monsters": [
-            {"name": "Void Manta", "hp": 130, "max_hp": 130, "atk": 28, "xp": 220, "gold": 70, "loot": "crystal", "is_aggro": True, "is_roaming": True, "dead_until": 0}
-        ]
-    },
-    "24": {
-        "name": "The Solar Observatory",
-        "desc": "A lens focuses the light of a distant supernova onto a map.",
-        "portals": {"15": {"name": "The Armory", "min_attunement": 0}},
-        "items": [],
-        "monsters": [
-            {"name": "Solar Flare", "hp": 140, "max_hp": 140, "atk": 30, "xp": 240, "gold": 80, "loot": "crystal", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    },
-    "28": {
-        "name": "The Frozen Waste",
-        "desc": "An eternal blizzard. The air freezes in your lungs.",
-        "portals": {"27": {"name": "Dark Catacombs", "min_attunement": 0}},
-        "items": ["ever-ice"],
-        "monsters": [
-            {"name": "Frost Giant", "hp": 200, "max_hp": 200, "atk": 38, "xp": 350, "gold": 90, "loot": "potion", "is_aggro": True, "is_roaming": False, "dead_until": 0}
-        ]
-    }
-}
+# WORLD is a roomstore.RoomStore: WORLD[rid] pages a room in from
+# WORLD_DB_PATH when it isn't resident, and the least recently used rooms
+# nobody is standing in are written back and dropped once the resident ones
+# go over ROOM_CACHE_BYTES. Loading and evicting a room registers and
+# unregisters its monsters (see MONSTER REGISTRY). At startup the first
+# PRELOAD_ROOMS hand-written rooms are loaded, which for the shipped world is
+# all of them; generated rooms wait until something looks them up.
 
 players = {}
 
+# --- LOOKUP INDEXES ---
+# Kept in step with `players` so the hot lookups don't scan every session.
+# Only change a player's name, location or combat_target through the helpers
+# below (attach_player, detach_player, move_player, set_combat_target).
+sid_by_name = {}          # lowercase name -> sid
+room_occupants = {}       # room id -> set of sids standing there
+monster_engagements = {}  # monster id -> set of sids fighting it
+_index_lock = threading.RLock()
+
+
+def _index_add(index, key, sid):
+    index.setdefault(key, set()).add(sid)
+
+
+def _index_discard(index, key, sid):
+    sids = index.get(key)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del index[key]
+
+
+def attach_player(sid, p):
+    """Puts p in `players` under sid (replacing any Guest there) and indexes it."""
+    with _index_lock:
+        if sid in players:
+            detach_player(sid)
+        players[sid] = p
+        sid_by_name[p['name'].lower()] = sid
+        _index_add(room_occupants, p['location'], sid)
+        if p.get('combat_target') is not None:
+            _index_add(monster_engagements, p['combat_target'], sid)
+
+
+def detach_player(sid):
+    """Removes sid from `players` and every index. Returns the player dict."""
+    with _index_lock:
+        p = players.pop(sid, None)
+        if p is None:
+            return None
+        if sid_by_name.get(p['name'].lower()) == sid:
+            del sid_by_name[p['name'].lower()]
+        _index_discard(room_occupants, p['location'], sid)
+        if p.get('combat_target') is not None:
+            _index_discard(monster_engagements, p['combat_target'], sid)
+    return p
+
+
+def rekey_player(old_sid, new_sid):
+    """Files old_sid's player under new_sid (a reconnect), replacing any Guest there."""
+    with _index_lock:
+        if new_sid in players:
+            detach_player(new_sid)
+        p = detach_player(old_sid)
+        attach_player(new_sid, p)
+    return p
+
+
+def move_player(sid, dest):
+    p = players[sid]
+    with _index_lock:
+        origin = p['location']
+        _index_discard(room_occupants, origin, sid)
+        p['location'] = dest
+        _index_add(room_occupants, dest, sid)
 
-# --- 3. ENGINES (Combat, Leveling, Respawn) ---
-def monster_respawn_tick():
-    while True:
-        time.sleep(5)
-        now = time.time()
-        for rid, data in WORLD.items():
-            if data.get('dead_until') and now > data['dead_until']:
-                data['dead_until'] = 0
-                if data['monster']: data['monster']['hp'] = data['monster']['max_hp']
 
-threading.Thread(target=monster_respawn_tick, daemon=True).start()
+def set_combat_target(sid, monster_id):
+    p = players[sid]
+    with _index_lock:
+        if p.get('combat_target') is not None:
+            _index_discard(monster_engagements, p['combat_target'], sid)
+        p['combat_target'] = monster_id
+        if monster_id is not None:
+            _index_add(monster_engagements, monster_id, sid)
+
+
+def is_engaged(monster_id):
+    return monster_id in monster_engagements
+
+
+def find_player(name):
+    """Returns (sid, player) for an online player name, case-insensitive, or (None, None)."""
+    sid = sid_by_name.get(name.lower())
+    p = players.get(sid)
+    return (sid, p) if p is not None else (None, None)
+
+
+# --- ROUTES ---
+# `travel <room>` walks the shortest way there through portals the player's
+# attunement opens. ROUTES keeps a next-hop table per destination and
+# attunement tier, made the first time someone heads there, reaching out
+# TRAVEL_MAX_HOPS doors (see routes.py). Tables go stale by themselves when
+# the store's portals change.
+TRAVEL_MAX_HOPS = int(os.environ.get("MUD_TRAVEL_MAX_HOPS", 40))
+ROUTE_TABLES = int(os.environ.get("MUD_ROUTE_TABLES", 64))
+ROUTES = RouteIndex(WORLD, max_hops=TRAVEL_MAX_HOPS, max_tables=ROUTE_TABLES)
+
+
+# --- MONSTER REGISTRY ---
+# Every monster has a stable id ("<home room>.<slot>", from worlddata), so
+# combat targets and timers keep pointing at the same monster however room
+# lists are reordered. Monsters are monsters.Monster objects: the stats live
+# on m.template, shared by every monster of the kind, and each one carries
+# only hp, dead_until and m.room, the room it is currently in.
+# Only monsters in resident rooms are registered: a room's monsters come and
+# go with it, dead ones and roamers picking their timers back up on load.
+MONSTERS = {}  # monster id -> Monster
+MONSTER_TEMPLATES = DATA.monsters
+
+
+def room_loaded(rid, room):
+    now = time.time()
+    for m in room.get('monsters', []):
+        MONSTERS[m.id] = m
+        m.room = rid
+        if m.dead_until > now:
+            game_loop.call_at(m.dead_until, respawn_monster, m.id)
+        elif m.dead_until:
+            # Came due while the room was on disk, nobody there to see it
+            m.dead_until = 0
+            m.hp = m.template.max_hp
+        if m.template.is_roaming:
+            schedule_roamer(m.id, random.uniform(0, ROAM_INTERVAL))
+    oldest = floors.next_drop(room.get('items', {}))
+    if oldest is not None:
+        queue_floor(rid, oldest)
+
+
+def room_evicted(rid, room):
+    for m in room.get('monsters', []):
+        MONSTERS.pop(m.id, None)
+        timer = _roam_timers.pop(m.id, None)
+        if timer is not None:
+            timer.cancel()
+    _render_cache.pop(rid, None)
+    room_versions.pop(rid, None)
+
+
+def restore_room(room):
+    """RoomStore decode hook: a room read back from world.db has its monsters as Monster.state() lists."""
+    room['monsters'] = [MONSTER_TEMPLATES.restore(state) for state in room.get('monsters', [])]
+    if isinstance(room.get('items'), list):
+        room['items'] = floors.from_list(room['items'])  # saved before floors were stacked
+
+
+def monster_here(monster_id, room_id):
+    """The monster if it is currently in room_id, else None."""
+    m = MONSTERS.get(monster_id)
+    if m is not None and m.room == room_id:
+        return m
+    return None
 
-def move_monsters():
-    while True:
-        time.sleep(60)  # Wandering happens every 30 seconds
 
-        # We iterate over a list of IDs to avoid "dictionary changed size during iteration"
-        for rid in list(WORLD.keys()):
-            room = WORLD[rid]
+WORLD.on_load = room_loaded
+WORLD.on_evict = room_evicted
+WORLD.decode = restore_room
 
-            if 'monsters' not in room or not room['monsters']:
-                continue
 
-            # Iterate backwards through the list so we can safely remove items while looping
-            for i in range(len(room['monsters']) - 1, -1, -1):
-                random_number = random.randint(1, 100)
-                mob = room['monsters'][i]
+# --- SESSIONS & PROTOCOL ---
+# Protocol 1 (the default, and all an old client knows) gets server-rendered
+# HTML in 'status' events. A client that connects with auth {"proto": 2}, or
+# sends a 'hello' event, instead gets compact 'state' events ({"t": kind, ...})
+# for rooms, combat, who and help, and renders them itself. Everything else
+# is still a 'status' event for both. Protocol 3 is protocol 2 plus 'batch'
+# frames (see OUTBOUND BATCHING below).
+PROTOCOL_VERSION = 3
 
-                # --- 1. VALIDATION CHECKS ---
-                # Is it a roamer?
-                if not mob.get('is_roaming'):
-                    continue
+sessions = {}    # sid -> {"proto": int, "seen_rooms": set of room ids already described,
+                 #         "ip": client address or None, "login": pending login attempt or None}
+EMIT_STATS = {}  # "event:kind" -> {"emits": n, "bytes": n, ...}, to compare payload sizes
+EMIT_SAMPLE_EVERY = 16
 
-                if random_number < 90:
-                    continue
 
-                # Is it currently dead/respawning?
-                if mob.get('dead_until', 0) > time.time():
-                    continue
+def open_session(sid, proto=1, ip=None):
+    proto = max(1, min(int(proto or 1), PROTOCOL_VERSION))
+    sessions[sid] = {"proto": proto, "seen_rooms": set(), "ip": ip, "login": None}
+    return proto
 
-                # Is anyone currently fighting THIS specific monster?
-                # We check if any player in the room has this monster's index as their target
-                is_engaged = any(
-                    p.get('combat_target') == i and p['location'] == rid
-                    for p in players.values()
-                )
 
-                if is_engaged:
-                    continue
+def session_proto(sid):
+    session = sessions.get(sid)
+    return session['proto'] if session else 1
 
-                # --- 2. MOVEMENT LOGIC ---
-                possible_destinations = list(room.get('portals', {}).keys())
-                if not possible_destinations:
-                    continue
 
-                dest_id = random.choice(possible_destinations)
-                dest_room = WORLD.get(dest_id)
+def _count_emit(key, event, data):
+    stats = EMIT_STATS.get(key)
+    if stats is None:
+        stats = EMIT_STATS[key] = {"emits": 0, "bytes": 0, "sampled": 0, "sampled_bytes": 0}
+    stats['emits'] += 1
+    # Encoding every message just to count it would double the JSON work, so
+    # only 1 in EMIT_SAMPLE_EVERY is measured and the rest count at the
+    # running average for their kind. `bytes` is an estimate unless it's 1.
+    if stats['emits'] % EMIT_SAMPLE_EVERY == 1 or EMIT_SAMPLE_EVERY == 1:
+        # Size as it goes on the wire: 42["event",{...}]
+        size = len(json.dumps([event, data], separators=(',', ':'), ensure_ascii=False).encode()) + 2
+        stats['sampled'] += 1
+        stats['sampled_bytes'] += size
+    else:
+        size = stats['sampled_bytes'] // stats['sampled']
+    stats['bytes'] += size
+    return size
+
+
+# --- OUTBOUND BATCHING ---
+# Everything sent while a handler call or a game loop tick runs is collected
+# per recipient in an outbox for that thread, and written when the handler or
+# tick returns. A protocol 3 client then gets all of its messages in one
+# 'batch' frame ([[event, data], ...]) instead of one frame each; older
+# clients still get one frame per message, in the same order.
+#
+# The acting player's own messages go out as soon as their command returns.
+# What a command sends to other protocol 3 players (room chatter, arrivals,
+# departures) waits for the next game loop tick instead, so a busy room costs
+# each socket about one frame per tick rather than one per message.
+#
+# Sends outside of a batch scope go out immediately. A recipient's messages
+# are also written early once they pass BATCH_MAX_MESSAGES or
+# BATCH_MAX_BYTES, and a long handler or tick writes out what it has queued
+# once the oldest of it is BATCH_MAX_DELAY seconds old.
+BATCH_MAX_MESSAGES = 32
+BATCH_MAX_BYTES = 16 * 1024
+BATCH_MAX_DELAY = 0.05  # seconds
+
+_outbox = threading.local()
+_deferred = {}  # sid -> [messages, bytes, [(event, data), ...]] held for the next tick
+_deferred_lock = threading.Lock()
+FRAME_STATS = {"messages": 0, "frames": 0, "batches": 0, "deferred": 0, "dropped": 0}
+
+
+class _Outbox:
+    __slots__ = ("depth", "owner", "oldest", "queued")
+
+    def __init__(self):
+        self.depth = 0
+        self.owner = None   # sid of the acting player, None for a game loop tick
+        self.oldest = None  # when the oldest queued message was queued
+        self.queued = {}    # sid -> [messages, bytes, [(event, data), ...]]
+
+
+@contextmanager
+def batched(owner=None):
+    """
+    Collects outbound messages until the outermost batched() block exits.
+    Pass the acting player's sid from handlers; without one (a game loop
+    tick) the block also writes out everything held back for this tick.
+    """
+    box = getattr(_outbox, 'box', None)
+    if box is None:
+        box = _outbox.box = _Outbox()
+    if box.depth == 0:
+        box.owner = owner
+    box.depth += 1
+    try:
+        yield
+    finally:
+        box.depth -= 1
+        if box.depth == 0:
+            _flush_outbox(box, final=True)
+
+
+def _write_frames(sid, messages):
+    if sid not in sessions:
+        # A player held for resume (see SESSION RESUME) has no socket to write to
+        FRAME_STATS['dropped'] += len(messages)
+        return
+    if len(messages) > 1 and session_proto(sid) >= 3:
+        FRAME_STATS['frames'] += 1
+        FRAME_STATS['batches'] += 1
+        socketio.emit('batch', [[event, data] for event, data in messages], to=sid)
+        return
+    for event, data in messages:
+        FRAME_STATS['frames'] += 1
+        socketio.emit(event, data, to=sid)
+
+
+def _queue(outbox, sid, count, size, messages):
+    entry = outbox.get(sid)
+    if entry is None:
+        entry = outbox[sid] = [0, 0, []]
+    entry[0] += count
+    entry[1] += size
+    entry[2].extend(messages)
+    return entry
+
+
+def _take_deferred(sid):
+    with _deferred_lock:
+        entry = _deferred.pop(sid, None)
+    return entry[2] if entry else []
+
+
+def _flush_outbox(box, final=False):
+    queued, box.queued = box.queued, {}
+    box.oldest = None
+    for sid, (count, size, messages) in queued.items():
+        if box.owner is not None and sid != box.owner and session_proto(sid) >= 3:
+            with _deferred_lock:
+                entry = _queue(_deferred, sid, count, size, messages)
+                full = entry[0] >= BATCH_MAX_MESSAGES or entry[1] >= BATCH_MAX_BYTES
+                if full:
+                    del _deferred[sid]
+            FRAME_STATS['deferred'] += count
+            if full:
+                _write_frames(sid, entry[2])
+        else:
+            # Anything held back for sid was queued first, so it goes first
+            _write_frames(sid, _take_deferred(sid) + messages)
+    if box.owner is None and final:
+        # End of a tick: everything still held back goes out with it
+        with _deferred_lock:
+            held = list(_deferred.items())
+            _deferred.clear()
+        for sid, (_, _, messages) in held:
+            _write_frames(sid, messages)
+
+
+def deliver(sid, event, data, size=0):
+    """Sends one event to sid now, or queues it if a batched() block is open."""
+    FRAME_STATS['messages'] += 1
+    box = getattr(_outbox, 'box', None)
+    if box is None or box.depth == 0:
+        _write_frames(sid, _take_deferred(sid) + [(event, data)])
+        return
+    now = time.time()
+    if box.oldest is None:
+        box.oldest = now
+    entry = _queue(box.queued, sid, 1, size, [(event, data)])
+    if entry[0] >= BATCH_MAX_MESSAGES or entry[1] >= BATCH_MAX_BYTES:
+        del box.queued[sid]
+        _write_frames(sid, _take_deferred(sid) + entry[2])
+    elif now - box.oldest >= BATCH_MAX_DELAY:
+        _flush_outbox(box)
+
+
+def send_status(sid, html):
+    """A plain HTML 'status' message, the same for every protocol."""
+    data = {'msg': html}
+    deliver(sid, 'status', data, _count_emit('status:text', 'status', data))
+
+
+def send_room_status(room_id, html, skip=()):
+    for sid in list(room_occupants.get(room_id, ())):
+        if sid not in skip:
+            send_status(sid, html)
+
+
+def send_status_all(html):
+    for sid in list(players):
+        send_status(sid, html)
+
+
+def send_event(sid, kind, payload, render_html):
+    """
+    Sends one typed message to sid: the payload for protocol 2 clients, or
+    render_html() wrapped in a 'status' event for protocol 1. render_html is
+    only called when needed, so structured clients skip the HTML building.
+    """
+    if session_proto(sid) >= 2:
+        event, data = 'state', dict(payload, t=kind)
+    else:
+        event, data = 'status', {'msg': render_html()}
+    deliver(sid, event, data, _count_emit(f"{event}:{kind}", event, data))
+
+
+def send_room_event(room_id, kind, payload, render_html, skip=()):
+    """send_event() to everyone standing in a room. The HTML is rendered at most once."""
+    html = []
+
+    def render_once():
+        if not html:
+            html.append(render_html())
+        return html[0]
+
+    for sid in list(room_occupants.get(room_id, ())):
+        if sid not in skip:
+            send_event(sid, kind, payload, render_once)
+
 
-                if not dest_room:
-                    continue
+# --- 3. ENGINES (Combat, Leveling, Respawn) ---
+# Respawns are timers on the game loop heap, pushed when a monster dies and
+# keyed by its dead_until. Only due monsters are ever looked at, and an idle
+# world costs one heap peek per tick. A monster template can set its own
+# "respawn_delay" in seconds; otherwise RESPAWN_DELAY applies.
+RESPAWN_DELAY = 30
+RESPAWN_STATS = {"scheduled": 0, "revived": 0}
+
+
+def schedule_respawn(m):
+    delay = m.template.respawn_delay
+    m.dead_until = time.time() + (RESPAWN_DELAY if delay is None else delay)
+    RESPAWN_STATS['scheduled'] += 1
+    game_loop.call_at(m.dead_until, respawn_monster, m.id)
+
+
+def respawn_monster(monster_id):
+    m = MONSTERS.get(monster_id)
+    if m is None or not m.dead_until:
+        return  # paged out, or already revived by a timer from before its room was
+    m.dead_until = 0
+    m.hp = m.template.max_hp
+    RESPAWN_STATS['revived'] += 1
+    touch_room(m.room)
+    name = m.template.name
+    send_room_event(m.room, 'spawn', {'foe': name}, lambda: f"✨ <i>A {name} materializes.</i>")
+
+
+# --- ROAMING ---
+# Each roaming monster has its own timer on the game loop. Every ROAM_INTERVAL
+# seconds it gets a ROAM_CHANCE percent roll to wander through a random
+# portal, the same odds the old full-world sweep gave it. First checks are
+# spread across the interval so roamers don't all move on the same tick.
+# The cost is one timer per roamer due, whatever the size of the world.
+# Roamers only roam while their room is resident; the timer is cancelled
+# when the room is paged out and set again when it comes back.
+ROAM_INTERVAL = 60
+ROAM_CHANCE = 11  # percent
+ROAM_STATS = {"checks": 0, "moves": 0, "engaged": 0}
+_roam_timers = {}  # monster id -> its pending roam timer
+
+
+def schedule_roamer(monster_id, delay):
+    _roam_timers[monster_id] = game_loop.call_later(delay, roam_monster, monster_id)
+
+
+def roam_monster(monster_id):
+    m = MONSTERS.get(monster_id)
+    if m is None:
+        _roam_timers.pop(monster_id, None)
+        return
+    schedule_roamer(monster_id, ROAM_INTERVAL)
+    ROAM_STATS['checks'] += 1
+
+    # --- 1. VALIDATION CHECKS ---
+    if random.randint(1, 100) <= 100 - ROAM_CHANCE:
+        return
+
+    # Is it currently dead/respawning?
+    if m.dead_until > time.time():
+        return
+
+    # Is anyone currently fighting THIS specific monster?
+    if is_engaged(monster_id):
+        ROAM_STATS['engaged'] += 1
+        return
+
+    # --- 2. MOVEMENT LOGIC ---
+    rid = m.room
+    room = WORLD[rid]
+    possible_destinations = list(room.get('portals', {}).keys())
+    if not possible_destinations:
+        return
+
+    dest_id = random.choice(possible_destinations)
+    dest_room = WORLD.get(dest_id)
+    if not dest_room:
+        return
+
+    # Notify players in the current room
+    name = m.template.name
+    send_room_event(rid, 'wander', {'foe': name, 'dir': 'out'},
+                    lambda: f"🐾 <i>The {name} wanders away.</i>")
+
+    # Remove from current room, add to destination room list. Nobody targets
+    # monsters by list position any more, so this can't retarget a fight.
+    room['monsters'] = [other for other in room['monsters'] if other is not m]
+    dest_room.setdefault('monsters', []).append(m)
+    m.room = dest_id
+    touch_room(rid)
+    touch_room(dest_id)
+    ROAM_STATS['moves'] += 1
+
+    # Notify players in the new room
+    send_room_event(dest_id, 'wander', {'foe': name, 'dir': 'in'},
+                    lambda: f"🐾 <i>A {name} wanders in.</i>")
+
+
+# --- FLOORS ---
+# room['items'] is a floors.py floor, item id -> [placed, dropped,
+# dropped_at], holding at most FLOOR_CAP items with the oldest drops pushed
+# off first. What was dropped on a stack decays FLOOR_DECAY seconds after the
+# last drop onto it; what the data files put there never does. The sweeper
+# runs once a tick on the game loop and only looks at rooms whose oldest drop
+# has come due, taken off a heap, for at most FLOOR_SWEEP_BUDGET_MS; whatever
+# is left waits for the next tick. Only resident rooms are swept, a paged-out
+# room's drops are queued again when it loads.
+FLOOR_CAP = int(os.environ.get("MUD_FLOOR_CAP", 50))
+FLOOR_DECAY = float(os.environ.get("MUD_FLOOR_DECAY", 600))  # seconds
+FLOOR_SWEEP_BUDGET_MS = float(os.environ.get("MUD_FLOOR_SWEEP_BUDGET_MS", 1.0))
+FLOOR_STATS = {"dropped": 0, "pushed_off": 0, "refused": 0, "reclaimed": 0, "swept_rooms": 0, "over_budget": 0}
+_floor_due = []     # heap of (when the room's oldest drop decays, room id)
+_floor_queued = {}  # room id -> when, so each room is on the heap once
+_floor_lock = threading.Lock()
+
+
+def drop_on_floor(room_id, room, item_id, qty=1):
+    """Puts qty of item_id on a room's floor. False if it is full of things that never decay."""
+    now = time.time()
+    pushed = floors.add(room.setdefault('items', {}), item_id, now, FLOOR_CAP, qty)
+    if pushed is None:
+        FLOOR_STATS['refused'] += qty
+        return False
+    FLOOR_STATS['dropped'] += qty
+    FLOOR_STATS['pushed_off'] += pushed
+    queue_floor(room_id, now)
+    touch_room(room_id)
+    return True
+
+
+def queue_floor(room_id, dropped_at):
+    # Stamps only move forward, so an entry already on the heap is never late
+    with _floor_lock:
+        if room_id not in _floor_queued:
+            when = _floor_queued[room_id] = dropped_at + FLOOR_DECAY
+            heapq.heappush(_floor_due, (when, room_id))
+
+
+def sweep_floors():
+    game_loop.call_later(game_loop.interval, sweep_floors)
+    now = time.time()
+    deadline = time.perf_counter() + FLOOR_SWEEP_BUDGET_MS / 1000
+    while True:
+        with _floor_lock:
+            if not _floor_due or _floor_due[0][0] > now:
+                return
+            if time.perf_counter() >= deadline:
+                FLOOR_STATS['over_budget'] += 1
+                return
+            _, room_id = heapq.heappop(_floor_due)
+            del _floor_queued[room_id]
+        room = WORLD.peek(room_id)
+        if room is None:
+            continue  # paged out
+        floor = room.get('items', {})
+        reclaimed = floors.expire(floor, now - FLOOR_DECAY)
+        FLOOR_STATS['swept_rooms'] += 1
+        if reclaimed:
+            FLOOR_STATS['reclaimed'] += reclaimed
+            touch_room(room_id)
+        oldest = floors.next_drop(floor)
+        if oldest is not None:
+            queue_floor(room_id, oldest)
+
+
+# All combat rounds run on the one game loop thread. Each fighting player has
+# at most one pending round timer; combat_round re-arms it while the fight lasts.
+GAME_TICK_RATE = float(os.environ.get("MUD_TICK_RATE", 10))  # ticks per second
+COMBAT_ROUND_SECONDS = 3  # Faster pace than 5s feels better for MUDs
+
+TIMER_LAG_SECONDS = METRICS.histogram("mud_timer_lag_seconds", "How late game loop timers ran, by callback.", ("timer",))
+TIMER_RUN_SECONDS = METRICS.histogram("mud_timer_seconds", "Time game loop timers took to run, by callback.", ("timer",))
+
+
+def _observe_timer(fn, lag, elapsed):
+    TIMER_LAG_SECONDS.observe(lag, fn.__name__)
+    TIMER_RUN_SECONDS.observe(elapsed, fn.__name__)
+
+
+game_loop = GameLoop(tick_rate=GAME_TICK_RATE, tick_scope=batched, timer_observer=_observe_timer)
+_combat_rounds = {}  # sid -> pending round Timer
+_combat_lock = threading.Lock()
+
+
+def start_combat(sid):
+    """Starts resolving rounds for sid on the next tick, unless it is already fighting."""
+    with _combat_lock:
+        if sid not in _combat_rounds:
+            _combat_rounds[sid] = game_loop.call_soon(combat_round, sid)
+
+
+def combat_round(sid):
+    combat_tick(sid)
+    with _combat_lock:
+        # Re-check under the lock: a command may have picked a new target meanwhile
+        if sid in players and players[sid].get('combat_target') is not None:
+            _combat_rounds[sid] = game_loop.call_later(COMBAT_ROUND_SECONDS, combat_round, sid)
+        else:
+            _combat_rounds.pop(sid, None)
 
-                # Notify players in the current room
-                socketio.emit('status', {'msg': f"🐾 <i>The {mob['name']} wanders away.</i>"}, room=rid)
 
-                # Remove from current room, add to destination room list
-                moving_mob = room['monsters'].pop(i)
-                dest_room.setdefault('monsters', []).append(moving_mob)
+def move_combat(old_sid, new_sid):
+    """Hands old_sid's pending combat round to new_sid, due at the same time."""
+    with _combat_lock:
+        timer = _combat_rounds.pop(old_sid, None)
+        if timer is not None:
+            timer.cancel()
+            _combat_rounds[new_sid] = game_loop.call_at(timer.when, combat_round, new_sid)
 
-                # Notify players in the new room
-                socketio.emit('status', {'msg': f"🐾 <i>A {mob['name']} wanders in.</i>"}, room=dest_id)
 
+def active_combats():
+    with _combat_lock:
+        return len(_combat_rounds)
 
-# Start the thread at the bottom of your file (before socketio.run)
-threading.Thread(target=move_monsters, daemon=True).start()
 
 def combat_tick(sid):
-    # Ensure the player still exists and has a target index
-    while sid in players and players[sid].get('combat_target') is not None:
-        p = players[sid]
-        room = WORLD.get(p['location'])
-
-        # 1. Get the specific monster from the room list
-        target_idx = p['combat_target']
-        monsters = room.get('monsters', [])
-
-        # Validate target exists and is alive
-        if target_idx >= len(monsters) or monsters[target_idx].get('dead_until', 0) > 0:
-            p['combat_target'] = None
-            break
+    """Resolves one combat round for sid. Returns True if the fight goes on."""
+    # Ensure the player still exists and has a target
+    if sid not in players or players[sid].get('combat_target') is None:
+        return False
 
-        m = monsters[target_idx]
+    p = players[sid]
+    room = WORLD.get(p['location'])
 
-        # 2. Player's Turn: Calculate Damage
-        # Math: Base (8-15) + Attunement scaling
-        p_dmg = random.randint(8, 15) + (p['stats'].get('Attunement', 0) // 2)
+    # 1. Get the specific monster, which has to be here with us
+    m = monster_here(p['combat_target'], p['location'])
 
-        # Check equipped item for bonus damage
-        if p.get('equipped') and p['equipped'] in ITEMS:
-            p_dmg += ITEMS[p['equipped']].get('damage', 0)
+    # Validate target exists and is alive
+    if m is None or m.dead_until > 0:
+        set_combat_target(sid, None)
+        return False
+    t = m.template  # name, atk, xp, gold and loot are shared by its whole kind
 
-        m['hp'] -= p_dmg
-        socketio.emit('status', {
-            'msg': f"⚔️ <b>Round:</b> Hit {m['name']} for {p_dmg}. (Foe HP: {max(0, m['hp'])})"
-        }, room=sid)
+    # 2. Player's Turn: Calculate Damage
+    # Math: Base (8-15) + Attunement scaling
+    p_dmg = random.randint(8, 15) + (p['stats'].get('Attunement', 0) // 2)
 
-        # 3. Check Monster Death
-        if m['hp'] <= 0:
-            m['dead_until'] = time.time() + m.get('respawn_delay', 30)
-            m['hp'] = m['max_hp']  # Reset for next respawn
+    # Check equipped item for bonus damage
+    if p.get('equipped') and p['equipped'] in ITEMS:
+        p_dmg += ITEMS[p['equipped']].get('damage', 0)
 
-            p['xp'] += m['xp']
-            p['gold'] += m['gold']
+    m.hp -= p_dmg
+    touch_room(p['location'])  # protocol 2 room views show its hp
+    foe_hp = max(0, m.hp)
+    send_event(sid, 'hit', {'foe': t.name, 'dmg': p_dmg, 'foe_hp': foe_hp},
+               lambda: f"⚔️ <b>Round:</b> Hit {t.name} for {p_dmg}. (Foe HP: {foe_hp})")
 
-            # Add loot to room floor (new behavior) or direct to inventory
-            room.setdefault('items', []).append(m['loot'])
+    # 3. Check Monster Death
+    if m.hp <= 0:
+        schedule_respawn(m)
+        m.hp = t.max_hp  # Reset for next respawn
 
-            p['combat_target'] = None  # End combat
+        p['xp'] += t.xp
+        p['gold'] += t.gold
+        update_leaderboard(p)
 
-            socketio.emit('status', {
-                'msg': f"<b style='color:#0f0;'>DEFEATED!</b> {m['name']} dropped {m['loot']} and {m['gold']} gold."
-            }, room=sid)
+        # Add loot to room floor (new behavior) or direct to inventory
+        if t.loot is not None:
+            drop_on_floor(p['location'], room, t.loot)
+        touch_room(p['location'])
 
-            check_level_up(sid)
-            break
+        set_combat_target(sid, None)  # End combat
 
-        # 4. Monster's Turn: Retaliation
-        # Math: Monster ATK - (Wit / 4) for damage mitigation
-        m_dmg = max(2, m['atk'] - (p['stats'].get('Wit', 0) // 4))
-        p['current_hp'] -= m_dmg
-
-        socketio.emit('status', {
-            'msg': f"💢 {m['name']} hits for {m_dmg}! (HP: {max(0, p['current_hp'])})"
-        }, room=sid)
-
-        # 5. Check Player Death
-        if p['current_hp'] <= 0:
-            p['combat_target'] = None
-            p['location'] = "1"  # Respawn point
-            p['current_hp'] = p['stats'].get('Hardiness', 100)
-            socketio.emit('status', {
-                'msg': "<h1 style='color:red;'>DE-MATERIALIZED!</h1> Respawned in Foyer."
-            }, room=sid)
-            send_room_desc(sid)  # Refresh the room view
-            break
+        send_event(sid, 'kill', {'foe': t.name, 'loot': t.loot, 'gold': t.gold},
+                   lambda: f"<b style='color:#0f0;'>DEFEATED!</b> {t.name} dropped {t.loot} and {t.gold} gold.")
+
+        check_level_up(sid)
+        save_player(p)  # xp, gold and any new level
+        return False
+
+    # 4. Monster's Turn: Retaliation
+    # Math: Monster ATK - (Wit / 4) for damage mitigation
+    m_dmg = max(2, t.atk - (p['stats'].get('Wit', 0) // 4))
+    p['current_hp'] -= m_dmg
+
+    send_event(sid, 'hurt', {'foe': t.name, 'dmg': m_dmg, 'hp': max(0, p['current_hp'])},
+               lambda: f"💢 {t.name} hits for {m_dmg}! (HP: {max(0, p['current_hp'])})")
+
+    # 5. Check Player Death
+    if p['current_hp'] <= 0:
+        set_combat_target(sid, None)
+        move_player(sid, "1")  # Respawn point
+        p['current_hp'] = p['stats'].get('Hardiness', 100)
+        send_event(sid, 'died', {'room': "1"},
+                   lambda: "<h1 style='color:red;'>DE-MATERIALIZED!</h1> Respawned in Foyer.")
+        send_room_desc(sid)  # Refresh the room view
+        return False
+
+    return True
 
-        time.sleep(3)  # Faster pace than 5s feels better for MUDs
+
+game_loop.start()
+game_loop.call_soon(sweep_floors)
+WORLD.preload(PRELOAD_ROOMS)
 
 
 def check_level_up(sid):
@@ -629,89 +1060,368 @@ def check_level_up(sid):
         p['stats']['Hardiness'] += 20;
         p['stats']['Wit'] += 3
         p['current_hp'] = p['stats']['Hardiness']
-        socketio.emit('status', {'msg': "<h2 style='color:gold;'>★ LEVEL UP! ★</h2>"}, room=sid)
+        update_leaderboard(p)
+        send_event(sid, 'levelup', {'level': p['level']}, lambda: "<h2 style='color:gold;'>★ LEVEL UP! ★</h2>")
+
+
+# --- ROOM RENDER CACHE ---
+# A room view is made of fragments with different lifetimes:
+#   static  - header, description and shop flag; built once per room
+#   portals - one version per attunement tier (how many portal thresholds the
+#             viewer meets), since that is all that changes between viewers
+#   dynamic - floor items and living monsters; stamped with the room version,
+#             which touch_room() bumps whenever that state changes, and with the
+#             next time a dead monster comes back to life
+# The protocol 2 room payload (room_state) is cached the same way, down to
+# its exits, items and monsters encoded as one JSON string per tier and
+# version, so only the fields that depend on who is looking are added per
+# viewer and the socket layer has one string to scan and escape rather than a
+# few hundred list entries.
+room_versions = {}  # room id -> version counter
+_render_cache = {}  # room id -> cached fragments
+
+
+def touch_room(room_id):
+    """Call after changing a room's items or monsters so cached views are rebuilt."""
+    room_versions[room_id] = room_versions.get(room_id, 0) + 1
+
+
+def invalidate_room_render(room_id=None):
+    """Drops every cached fragment for a room (or all rooms), e.g. after editing portals."""
+    if room_id is None:
+        _render_cache.clear()
+    else:
+        _render_cache.pop(room_id, None)
 
 
-def send_room_desc(sid):
-    p = players[sid]
-    room_id = p['location']
+def _render_static(room):
+    # --- 1. Header & Description ---
+    head = f"<div style='border-bottom: 1px solid #444; margin-bottom: 8px;'>"
+    head += f"<b style='font-size: 1.25em; color: #FFD700;'>{room['name']}</b></div>"
+    head += f"<p style='color: #CCCCCC; line-height: 1.4;'>{room['desc']}</p>"
+
+    # --- 5. Room Flags ---
+    tail = ""
+    if room.get("has_shop"):
+        tail += "<p style='color: #DAA520; font-weight: bold;'>[SHOP] Phil is here, ready to trade.</p>"
+
+    thresholds = sorted({info.get('min_attunement', 0) for info in room.get("portals", {}).values()})
+    return {"head": head, "tail": tail, "thresholds": thresholds, "portals": {}, "dynamic": None,
+            "exits": {}, "state": None, "views": {}}
+
+
+def _cached_room(room_id):
+    """(room, its render cache entry), making the entry if need be."""
     room = WORLD[room_id]
+    cache = _render_cache.get(room_id)
+    if cache is None:
+        cache = _render_cache[room_id] = _render_static(room)
+    return room, cache
 
-    # --- 1. Header & Description ---
-    msg = f"<div style='border-bottom: 1px solid #444; margin-bottom: 8px;'>"
-    msg += f"<b style='font-size: 1.25em; color: #FFD700;'>{room['name']}</b></div>"
-    msg += f"<p style='color: #CCCCCC; line-height: 1.4;'>{room['desc']}</p>"
 
+def _render_portals(room, attunement):
     # --- 2. Portals (Exits) ---
-    if room.get("portals"):
-        exit_list = []
-        for target_id, info in room["portals"].items():
-            # Check player attunement against portal requirement
-            if p['stats']['Attunement'] >= info.get('min_attunement', 0):
-                color = "#00BFFF"
-                exit_list.append(f"<span style='color: {color};'>[{target_id}] {info['name']}</span>")
-            else:
-                exit_list.append(f"<span style='color: #555555;'>[Locked] ???</span>")
-        msg += f"<p><b>Visible Exits:</b> {', '.join(exit_list)}</p>"
+    if not room.get("portals"):
+        return ""
+    exit_list = []
+    for target_id, info in room["portals"].items():
+        # Check player attunement against portal requirement
+        if attunement >= info.get('min_attunement', 0):
+            color = "#00BFFF"
+            exit_list.append(f"<span style='color: {color};'>[{target_id}] {info['name']}</span>")
+        else:
+            exit_list.append(f"<span style='color: #555555;'>[Locked] ???</span>")
+    return f"<p><b>Visible Exits:</b> {', '.join(exit_list)}</p>"
 
+
+def _render_dynamic(room, version, now):
+    msg = ""
     # --- 3. Items on the Floor ---
-    if room.get("items") and room.get("items") != [None]:
-        readable_items = [i.replace('_', ' ').title() for i in room['items']]
+    if room.get("items"):
+        readable_items = []
+        for i, stack in room['items'].items():
+            qty = floors.count(stack)
+            readable_items.append(i.replace('_', ' ').title() + (f" (x{qty})" if qty > 1 else ""))
         item_list = ", ".join([f"<span style='color: #00FF7F;'>{item}</span>" for item in readable_items])
         msg += f"<p style='margin: 10px 0;'><b>You see:</b> {item_list}</p>"
 
     # --- 4. Monsters & Aggro Check ---
-    aggro_target_idx = None
+    aggro_target = None
+    valid_until = float('inf')
 
     if room.get("monsters"):
         msg += "<div style='margin-top: 10px;'><b>Creatures:</b><ul style='margin-top: 5px; list-style-type: square;'>"
 
-        for i, m in enumerate(room["monsters"]):
+        for m in room["monsters"]:
             # Only process living monsters
-            if m.get("dead_until", 0) <= time.time():
-                is_aggro = m.get("is_aggro", False)
-                color = "#FF4500" if is_aggro else "#87CEEB"
-                roam_text = " <small><i>(Roaming)</i></small>" if m.get("is_roaming") else ""
-                msg += f"<li style='color: {color};'><b>{m['name']}</b>{roam_text}</li>"
+            if m.dead_until <= now:
+                t = m.template
+                color = "#FF4500" if t.is_aggro else "#87CEEB"
+                roam_text = " <small><i>(Roaming)</i></small>" if t.is_roaming else ""
+                msg += f"<li style='color: {color};'><b>{t.name}</b>{roam_text}</li>"
 
                 # AGGRO LOGIC: If the monster is aggro and we don't have a target yet
-                if is_aggro and aggro_target_idx is None:
-                    aggro_target_idx = i
+                if t.is_aggro and aggro_target is None:
+                    aggro_target = m.id
+            else:
+                # The view goes stale when this one is due back
+                valid_until = min(valid_until, m.dead_until)
 
         msg += "</ul></div>"
 
-    # --- 5. Room Flags ---
-    if room.get("has_shop"):
-        msg += "<p style='color: #DAA520; font-weight: bold;'>[SHOP] Phil is here, ready to trade.</p>"
+    return {"version": version, "valid_until": valid_until, "html": msg, "aggro_target": aggro_target}
+
+
+def render_room(room_id, attunement):
+    """Returns (html, id of the first living aggro monster or None) for a viewer's attunement."""
+    room, cache = _cached_room(room_id)
+
+    tier = bisect.bisect_right(cache['thresholds'], attunement)
+    portals = cache['portals'].get(tier)
+    if portals is None:
+        portals = cache['portals'][tier] = _render_portals(room, attunement)
+
+    now = time.time()
+    version = room_versions.get(room_id, 0)
+    dynamic = cache['dynamic']
+    if dynamic is None or dynamic['version'] != version or now >= dynamic['valid_until']:
+        dynamic = cache['dynamic'] = _render_dynamic(room, version, now)
+
+    return cache['head'] + portals + dynamic['html'] + cache['tail'], dynamic['aggro_target']
+
+
+def _state_exits(room, attunement):
+    # [id, name, id, name, ...]; locked exits stay anonymous, as in the HTML view
+    exits = []
+    for target_id, info in room.get('portals', {}).items():
+        if attunement >= info.get('min_attunement', 0):
+            exits += (target_id, info['name'])
+        else:
+            exits += (None, None)
+    return exits
+
+
+def _state_dynamic(room, version, now):
+    # Flat lists rather than a list per entry, which keeps the encoded view short
+    items = []  # [id, qty, id, qty, ...], one pair per stack
+    for item_id, stack in room.get('items', {}).items():
+        items += (item_id, floors.count(stack))
+
+    mobs = []  # [id, name, hp, max_hp, flags, ...] with flags 1 = aggro, 2 = roaming
+    aggro_target = None
+    valid_until = float('inf')
+    for m in room.get('monsters', []):
+        if m.dead_until <= now:
+            t = m.template
+            mobs += (m.id, t.name, m.hp, t.max_hp, (1 if t.is_aggro else 0) | (2 if t.is_roaming else 0))
+            if t.is_aggro and aggro_target is None:
+                aggro_target = m.id
+        else:
+            valid_until = min(valid_until, m.dead_until)
+    return {"version": version, "valid_until": valid_until, "items": items, "mobs": mobs,
+            "aggro_target": aggro_target}
 
-    # Send the room description first
-    emit('status', {'msg': msg}, room=sid)
+
+def room_state(sid, room_id, attunement):
+    """
+    The protocol 2 room payload and the first living aggro monster's id.
+    Name, description and flags are static, so they are only sent the first
+    time this session sees the room; the client keeps them. Exits, items and
+    monsters go in `view`, a JSON string from the render cache shared by
+    everyone of the viewer's tier until the room changes.
+    """
+    room, cache = _cached_room(room_id)
+
+    now = time.time()
+    version = room_versions.get(room_id, 0)
+    dynamic = cache['state']
+    if dynamic is None or dynamic['version'] != version or now >= dynamic['valid_until']:
+        dynamic = cache['state'] = _state_dynamic(room, version, now)
+
+    tier = bisect.bisect_right(cache['thresholds'], attunement)
+    view = cache['views'].get(tier)
+    if view is None or view[0] is not dynamic:
+        exits = cache['exits'].get(tier)
+        if exits is None:
+            exits = cache['exits'][tier] = _state_exits(room, attunement)
+        body = {'exits': exits, 'items': dynamic['items'], 'mobs': dynamic['mobs']}
+        view = cache['views'][tier] = (dynamic, json.dumps(body, separators=(',', ':'), ensure_ascii=False))
+
+    state = {'id': room_id, 'view': view[1]}
+    seen = sessions[sid]['seen_rooms'] if sid in sessions else set()
+    if room_id not in seen:
+        seen.add(room_id)
+        state['name'] = room['name']
+        state['desc'] = room['desc']
+        if room.get('has_shop'):
+            state['shop'] = 1
+    return state, dynamic['aggro_target']
+
+
+def send_room_desc(sid):
+    p = players[sid]
+    room_id = p['location']
+    room = WORLD[room_id]
+
+    # Send the room description first. Both paths use socketio.emit, because
+    # the game loop calls this too (respawn after death) outside of any request.
+    if session_proto(sid) >= 2:
+        state, aggro_target = room_state(sid, room_id, p['stats']['Attunement'])
+        send_event(sid, 'room', state, None)
+    else:
+        msg, aggro_target = render_room(room_id, p['stats']['Attunement'])
+        send_event(sid, 'room', None, lambda: msg)
 
     # --- 6. Trigger Combat if Aggroed ---
     # We only auto-attack if the player isn't already in combat
     random_number = random.randint(1, 100)
-    if aggro_target_idx is not None and p.get('combat_target') is None and not "Guest_" in p["name"] and not room.get("is_safe", None) and random_number > 50:
-        p['combat_target'] = aggro_target_idx
-        monster_name = room["monsters"][aggro_target_idx]['name']
-        emit('status', {'msg': f"<b style='color: #FF0000;'>⚠️ The {monster_name} notices you and lunges at you!</b>"}, room=sid)
-        socketio.start_background_task(combat_tick, sid)
+    if aggro_target is not None and p.get('combat_target') is None and not "Guest_" in p["name"] and not room.get("is_safe", None) and random_number > 50:
+        set_combat_target(sid, aggro_target)
+        monster_name = MONSTERS[aggro_target].template.name
+        send_event(sid, 'aggro', {'foe': monster_name},
+                   lambda: f"<b style='color: #FF0000;'>⚠️ The {monster_name} notices you and lunges at you!</b>")
+        start_combat(sid)
+
+
+# --- SESSION RESUME ---
+# A registered player whose connection drops isn't logged out at once: they
+# stay in the world, same room and same fight, for RESUME_GRACE seconds with
+# no socket. Every login hands the client a signed resume token (a 'resume'
+# event) and a connect that presents it takes the player over again, with no
+# DB read and no password hash. That works whether or not the server has
+# noticed the old socket is dead yet.
+#
+# Tokens carry the name and a random nonce. Only the newest nonce issued for
+# a name is honoured and every resume issues a new one, so each token works
+# once. MUD_SECRET_KEY signs them.
+RESUME_GRACE = float(os.environ.get("MUD_RESUME_GRACE", 60))  # seconds; 0 logs out on disconnect
+RESUME_STATS = {"issued": 0, "held": 0, "resumed": 0, "expired": 0, "rejected": 0}
+_resume_signer = URLSafeSerializer(app.config['SECRET_KEY'], salt="mud-resume")
+_resume_nonces = {}  # name as registered -> nonce of the newest token issued
+held_players = {}    # name as registered -> sid a disconnected player is still filed under
+_resume_lock = threading.Lock()
+
+
+def issue_resume_token(sid):
+    name = players[sid]['name']
+    nonce = secrets.token_urlsafe(12)
+    with _resume_lock:
+        _resume_nonces[name] = nonce
+    RESUME_STATS['issued'] += 1
+    deliver(sid, 'resume', {'token': _resume_signer.dumps({"name": name, "nonce": nonce})})
+
+
+def hold_player(sid):
+    """Keeps sid's player in the world after their socket went away, until RESUME_GRACE runs out."""
+    with _resume_lock:
+        held_players[players[sid]['name']] = sid
+    RESUME_STATS['held'] += 1
+    game_loop.call_later(RESUME_GRACE, release_held_player, sid)
+
+
+def release_held_player(sid):
+    p = players.get(sid)
+    if p is None:
+        return  # resumed under another sid, or gone
+    with _resume_lock:
+        if held_players.get(p['name']) != sid:
+            return
+        del held_players[p['name']]
+    RESUME_STATS['expired'] += 1
+    log_out(sid)
+
+
+def take_over_player(sid, name):
+    """
+    Moves the player called name, held or still attached to a live socket,
+    over to sid along with their fight. Returns the player, or None.
+    """
+    with _resume_lock:
+        old_sid = held_players.get(name) or sid_by_name.get(name.lower())
+        old = players.get(old_sid)
+        # name is the account as registered; never hand over an older
+        # account whose name differs only in case
+        if old_sid == sid or old is None or old['name'] != name:
+            return None
+        held_players.pop(name, None)
+    live = sessions.pop(old_sid, None) is not None
+    p = rekey_player(old_sid, sid)
+    move_combat(old_sid, sid)
+    _take_deferred(old_sid)  # held back for a socket that is gone
+    if live:
+        # Its disconnect finds nothing left to do once it arrives
+        socketio.server.disconnect(old_sid, namespace='/')
+    RESUME_STATS['resumed'] += 1
+    return p
+
+
+def resume_session(sid, token):
+    """Takes over the player token was issued for. Returns the player, or None."""
+    try:
+        claim = _resume_signer.loads(token)
+        name, nonce = claim['name'], claim['nonce']
+    except (BadSignature, TypeError, KeyError):
+        name = nonce = None
+    with _resume_lock:
+        valid = name is not None and _resume_nonces.get(name) == nonce
+    p = take_over_player(sid, name) if valid else None
+    if p is None:
+        RESUME_STATS['rejected'] += 1
+    return p
+
+
+def log_out(sid):
+    """Saves sid's player one last time, tells the room and takes them out of the world."""
+    p = players[sid]
+    if "Guest_" not in p['name']:
+        save_player(p)
+        request_flush()
+        with _resume_lock:
+            _resume_nonces.pop(p['name'], None)
+
+    departure_msg = f"<i>{p['name']} has faded into the mists of time (Logged out).</i>"
+    with batched(sid):
+        send_room_status(p['location'], departure_msg, skip=(sid,))
+
+    detach_player(sid)
+    log.info("%s disconnected and saved", p['name'])
 
 
 # --- 4. SOCKETS ---
 @app.route('/')
-def index(): return render_template('index.html')
+def index(): return render_template('index.html', transports=['polling', 'websocket'])
 
 
+# The socket handlers below only pick the sid off the request. The session
+# functions they call do the work, so the engine can run the same code for
+# events forwarded by the gateways (see ENGINE_EVENTS).
 @socketio.on('connect')
-def handle_connect():
-    sid = request.sid
-    players[sid] = {
-        "name": f"Guest_{sid[:4]}", "location": "1", "level": 1, "xp": 0, "gold": 50,
-        "stats": {"Attunement": 0, "Hardiness": 60, "Wit": 12},
-        "current_hp": 60, "equipped": None, "inventory": [], "is_in_combat": False
-    }
-    emit('status', {'msg': "<b>Welcome, Guest.</b> The 144,000 doors await. Type 'help' for all commands."})
-    send_room_desc(sid)
+def handle_connect(auth=None):
+    connect_session(request.sid, auth, request.remote_addr)
+
+
+def connect_session(sid, auth=None, ip=None):
+    auth = auth if isinstance(auth, dict) else {}
+    proto = open_session(sid, auth.get('proto', 1), ip)
+    with batched(sid):
+        if proto >= 2:
+            deliver(sid, 'hello', {'proto': proto})
+        token = auth.get('resume')
+        if token:
+            p = resume_session(sid, token)
+            if p is not None:
+                send_status(sid, f"🔌 Reconnected. Welcome back, <b>{p['name']}</b>!")
+                issue_resume_token(sid)
+                send_room_desc(sid)
+                return
+            deliver(sid, 'resume', {'token': None})  # stale, the client can forget it
+        attach_player(sid, {
+            "name": f"Guest_{sid[:4]}", "location": "1", "level": 1, "xp": 0, "gold": 50,
+            "stats": {"Attunement": 0, "Hardiness": 60, "Wit": 12},
+            "current_hp": 60, "equipped": None, "inventory": INVENTORY.new(), "is_in_combat": False
+        })
+        send_status(sid, "<b>Welcome, Guest.</b> The 144,000 doors await. Type 'help' for all commands.")
+        send_room_desc(sid)
 
 
 # @socketio.on('command')
@@ -724,629 +1434,986 @@ def handle_connect():
 #     room = WORLD[p['location']]
 @socketio.on('disconnect')
 def handle_disconnect():
-    sid = request.sid
-    if sid in players:
-        p = players[sid]
+    disconnect_session(request.sid)
 
-        # 1. Save progress to DB one last time
-        if "Guest_" not in p['name']:
-            save_player(p)
 
-        # 2. Notify others in the room
-        departure_msg = f"<i>{p['name']} has faded into the mists of time (Logged out).</i>"
-        emit('status', {'msg': departure_msg}, room=p['location'], include_self=False)
+def disconnect_session(sid):
+    sessions.pop(sid, None)
+    if sid not in players:
+        return
+    p = players[sid]
+    if "Guest_" in p['name'] or RESUME_GRACE <= 0:
+        log_out(sid)
+        return
+    # Save now anyway, in case the server goes down during the grace window
+    save_player(p)
+    request_flush()
+    hold_player(sid)
+    log.info("%s disconnected, held for %.0fs", p['name'], RESUME_GRACE)
+
+
+@socketio.on('hello')
+def handle_hello(data):
+    hello_session(request.sid, data)
+
+
+def hello_session(sid, data):
+    """Late protocol negotiation for clients that could not send connect auth."""
+    wanted = data.get('proto', 1) if isinstance(data, dict) else 1
+    previous = sessions.get(sid, {})
+    proto = open_session(sid, wanted, previous.get('ip'))
+    sessions[sid]['seen_rooms'] = previous.get('seen_rooms', set()) if proto >= 2 else set()
+    sessions[sid]['login'] = previous.get('login')
+    deliver(sid, 'hello', {'proto': proto})
+
 
-        # 3. Remove from active memory
-        del players[sid]
-        print(f"DEBUG: {p['name']} disconnected and saved.")
+# --- 5. COMMANDS ---
+# Every verb is a handler registered with @command. Aliases point at the same
+# entry, so dispatch is a single dict lookup whatever the verb.
+# Handlers take (sid, p, room, cmd, raw): the session id, the player dict,
+# their current room, the split command and the raw input line.
+COMMANDS = {}       # verb or alias -> command entry
+COMMAND_STATS = {}  # command name -> call/error counts and timings
+COMMAND_SECONDS = METRICS.histogram("mud_command_seconds", "Command handler latency, by command.", ("command",))
+
+
+def command(*names, auth=True):
+    """Registers a handler under one or more verbs. auth=False lets Guests use it."""
+    def register(fn):
+        entry = {"name": names[0], "handler": fn, "auth": auth}
+        for name in names:
+            COMMANDS[name] = entry
+        COMMAND_STATS[names[0]] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        return fn
+    return register
+
+
+def command_stats():
+    return {name: dict(stats) for name, stats in COMMAND_STATS.items()}
 
 
 @socketio.on('command')
 def handle_command(data):
-    sid = request.sid
+    run_command(request.sid, data)
+
+
+def run_command(sid, data):
     raw = data.get('msg', '').strip()
     cmd = raw.split()
+    if not cmd or sid not in players: return
     p = players[sid]
-    room = WORLD[p['location']]
-    if not cmd: return
 
-    # --- REWORKED LOGIN: login [name] [password] ---
-    if cmd[0].lower() == "login":
-        if len(cmd) < 3:
-            emit('status', {'msg': "⚠️ Usage: <b>login [name] [password]</b>"})
-            return
+    entry = COMMANDS.get(cmd[0].lower())
+
+    # Restrict all other commands until logged in
+    if "Guest_" in p["name"] and (entry is None or entry['auth']):
+        send_status(sid, "Identify yourself. Use: <b>login [name] [password]</b>")
+        return
+    if entry is None:
+        send_status(sid, "The command '{}' is not available at this time.".format(cmd[0]))
+        return
+
+    stats = COMMAND_STATS[entry['name']]
+    start = time.perf_counter()
+    try:
+        with batched(sid):
+            entry['handler'](sid, p, WORLD[p['location']], cmd, raw)
+    except Exception:
+        stats['errors'] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats['calls'] += 1
+        stats['total_ms'] += elapsed_ms
+        if elapsed_ms > stats['max_ms']:
+            stats['max_ms'] = elapsed_ms
+        COMMAND_SECONDS.observe(elapsed_ms / 1000, entry['name'])
+
+
+# --- REWORKED LOGIN: login [name] [password] ---
+# Password hashes are slow on purpose, so they never run on a handler or the
+# game loop. cmd_login looks the name up, hands the hashing to the PASSWORDS
+# pool and returns; finish_login() runs on the game loop once the pool is done
+# and logs the player in. Each session has at most one attempt in flight, and
+# the pool turns work away past MUD_HASH_QUEUE pending jobs, so a login storm
+# waits on the pool instead of on everybody else's commands.
+#
+# Every attempt counts against the client's address (LOGIN_IP_LIMIT per
+# LOGIN_WINDOW seconds) and every wrong password against the name
+# (LOGIN_NAME_LIMIT per LOGIN_NAME_WINDOW), so password guessing is slow for
+# the guesser and nobody else. MUD_PASSWORD_HASH sets the method and cost for
+# new hashes; older hashes are redone at the next good login.
+LOGIN_WINDOW = 60
+LOGIN_IP_LIMIT = int(os.environ.get("MUD_LOGIN_IP_LIMIT", 20))
+LOGIN_NAME_WINDOW = 300
+LOGIN_NAME_LIMIT = int(os.environ.get("MUD_LOGIN_NAME_LIMIT", 5))
+
+PASSWORD_HASH_SECONDS = METRICS.histogram("mud_password_hash_seconds", "Time the login pool spent per job, by op.",
+                                          ("op",))
+PASSWORDS = auth.PasswordHasher(workers=int(os.environ.get("MUD_HASH_WORKERS", 2)),
+                                max_pending=int(os.environ.get("MUD_HASH_QUEUE", 64)),
+                                method=os.environ.get("MUD_PASSWORD_HASH", "scrypt"),
+                                observer=lambda op, seconds: PASSWORD_HASH_SECONDS.observe(seconds, op))
+login_attempts = auth.RateLimiter(LOGIN_IP_LIMIT, LOGIN_WINDOW)         # client address -> attempts
+login_failures = auth.RateLimiter(LOGIN_NAME_LIMIT, LOGIN_NAME_WINDOW)  # lowercased name -> wrong passwords
+_claimed_names = set()  # lowercased names with a registration in flight
+_login_ids = itertools.count(1)
+LOGIN_STATS = {"attempts": 0, "ok": 0, "registered": 0, "bad_password": 0, "throttled": 0, "busy": 0,
+               "abandoned": 0}
+
+
+@command("login", auth=False)
+def cmd_login(sid, p, room, cmd, raw):
+    if len(cmd) < 3:
+        send_status(sid, "⚠️ Usage: <b>login [name] [password]</b>")
+        return
+
+    name, password = cmd[1], cmd[2]
+    session = sessions[sid]
+    if session['login'] is not None:
+        send_status(sid, "⏳ Still checking your last login, one moment...")
+        return
+
+    wait = login_failures.retry_after(name.lower())
+    if not wait and session['ip']:
+        wait = login_attempts.hit(session['ip'])
+    if wait:
+        LOGIN_STATS['throttled'] += 1
+        send_status(sid, f"⏳ <span style='color:orange;'>Too many login attempts. Try again in {int(wait) + 1}s.</span>")
+        return
 
-        name, password = cmd[1], cmd[2]
-        existing_p = load_player_data(name)
+    existing_p = load_player_data(name)
+    if existing_p is not None:
+        name = existing_p['name']  # as registered, whatever case it was typed in
+    if existing_p is None and "Guest_" in name:
+        send_status(sid, "❌ <span style='color:red;'>'Guest_' is not allowed in a registered username.</span>")
+        return
+    if existing_p is None and name.lower() in _claimed_names:
+        send_status(sid, "❌ <span style='color:red;'>Someone is registering that name right now.</span>")
+        return
 
+    try:
         if existing_p:
-            # Check if the password is correct
-            if check_password_hash(existing_p['password_hash'], password):
-                players[sid] = existing_p
-                emit('status', {'msg': f"✅ Authenticated. Welcome back, <b>{name}</b>!"})
-                send_room_desc(sid)
-                p = players[sid];
-                room = WORLD[p['location']]
-            else:
-                emit('status', {'msg': "❌ <span style='color:red;'>Incorrect password for this Guest.</span>"})
-        elif "Guest_" in name:
-            emit('status', {'msg': "❌ <span style='color:red;'>'Guest_' is not allowed in a registered username.</span>"})
+            job = PASSWORDS.verify(existing_p['password_hash'], password)
         else:
-            # Create new player
-            new_p = {
-                "name": name, "location": "1", "level": 1, "xp": 0, "gold": 50,
-                "stats": {"Attunement": 0, "Hardiness": 60, "Wit": 12},
-                "current_hp": 60, "equipped": None, "inventory": [], "is_in_combat": False
-            }
-            save_player(new_p, password=password)  # Hashes the password here
-            players[sid] = load_player_data(name)  # Reload to get the hash into memory
-            emit('status', {'msg': f"🌟 New Guest <b>{name}</b> registered and logged in!"})
-            send_room_desc(sid)
-            p = players[sid];
-            room = WORLD[p['location']]
+            job = PASSWORDS.hash(password)
+    except auth.HasherBusy:
+        LOGIN_STATS['busy'] += 1
+        send_status(sid, "⏳ The gates are crowded. Try again in a moment.")
         return
 
-    elif cmd[0] in ["quit", "exit"]:
-        if p.get('is_in_combat'):
-            emit('status', {'msg': "❌ You cannot quit while in combat! Fight or flee first!"})
+    LOGIN_STATS['attempts'] += 1
+    attempt = session['login'] = next(_login_ids)
+    if existing_p is None:
+        _claimed_names.add(name.lower())
+    job.add_done_callback(lambda job: game_loop.call_soon(finish_login, sid, attempt, name, existing_p, job))
+
+
+def finish_login(sid, attempt, name, existing_p, job):
+    """Game loop side of cmd_login, once the pool has checked or made the hash."""
+    if existing_p is None:
+        _claimed_names.discard(name.lower())
+    session = sessions.get(sid)
+    if session is None or session['login'] != attempt or sid not in players:
+        LOGIN_STATS['abandoned'] += 1  # they left (or quit) while we were hashing
+        return
+    session['login'] = None
+    try:
+        result = job.result()
+    except Exception:
+        traceback.print_exc()
+        send_status(sid, "❌ <span style='color:red;'>The gates jammed. Please try again.</span>")
+        return
+
+    if existing_p:
+        ok, new_hash = result
+        if not ok:
+            LOGIN_STATS['bad_password'] += 1
+            login_failures.hit(name.lower())
+            send_status(sid, "❌ <span style='color:red;'>Incorrect password for this Guest.</span>")
             return
+        login_failures.reset(name.lower())
+        # A player already in the world, held from a dropped connection or
+        # still playing on another socket, is newer than the DB copy: take
+        # that one over rather than attach a second, stale copy of them
+        if players[sid]['name'] == name:
+            p = players[sid]
         else:
-            sid = request.sid
-            if sid in players:
-                p = players[sid]
-                emit('status', {'msg': f"<i>{p['name']} has phased out of existence.</i>"},
-                     room=p['location'], include_self=False)
-                del players[sid]
-
-
-
-    elif cmd[0] == "help":
-        help_msg = (
-            "<div style='border: 1px dashed #d4af37; padding: 10px; margin: 10px 0;'>"
-            "<b style='color: #d4af37;'>--- COMMANDS ---</b><br>"
-            "<b>login [username] [password]:</b> Login to your hero.<br>"
-            "<b>quit:</b> Leave these realms. <br>"
-            "<b>look:</b> Scan the room.<br><b>stats:</b> View status.<br>"
-            "<b>go [number]:</b> Enter a portal.<br><b>attack:</b> Fight monster.<br>"
-            "<b>inv:</b> View items.<br><b>use [item]:</b> Use an item.<br>"
-            "<b>attack:</b> attack the monster that might be near you.<br>"
-            "<b>retreat:</b> I guess if your a coward you can do that.<br>"
-            "<b>cast [spell]:</b> Cast a spell, current spells available are fireball/mend/blur.<br>"
-            "<b>list:</b> List the items in a nearby shop.<br>"
-            "<b>buy [item]:</b> Buy an item from the nearby shop.<br>"
-            "<b>use [item}:</b> Use an item from your inventory.<br>"
-            "<b>say [text]:</b> Chat with others in the room.<br>"
-            "<b>shout [text]:</b> Chat with others in the server.<br>"
-            "<b>who:</b> List others in the server.<br>"
-            "<b>where [player name]:</b> Where is another player?.<br>"
-            "<b>top:</b> List the top players on the server.<br>"
-            "<b>wield [weapon]:</b> Wield your weapon.<br>"
-            "<b>unwield:</b> Sheath your weapon.<br>"
-            "<b>probe [item]:</b> What is this thing?.<br>"
-            "<b>drop [item]:</b> Drop an item your inventory.<br>"
-            "<b>pickup [item]:</b> Pickup an item from a room.<br>"
-            "<b>give [player] [item]:</b> Give an item to another player."
-            "</div>"
-        )
-        emit('status', {'msg': help_msg})
-    # Restrict all other commands until logged in
-    if "Guest_" in p["name"]:
-        emit('status', {'msg': "Identify yourself. Use: <b>login [name] [password]</b>"})
+            p = take_over_player(sid, name)
+        if p is None:
+            p = existing_p
+            attach_player(sid, p)
+        if new_hash:
+            p['password_hash'] = new_hash
+            save_player(p)
+        LOGIN_STATS['ok'] += 1
+        update_leaderboard(p)
+        send_status(sid, f"✅ Authenticated. Welcome back, <b>{name}</b>!")
+        issue_resume_token(sid)
+        send_room_desc(sid)
+    else:
+        # Create new player
+        new_p = {
+            "name": name, "password_hash": result, "location": "1", "level": 1, "xp": 0, "gold": 50,
+            "stats": {"Attunement": 0, "Hardiness": 60, "Wit": 12},
+            "current_hp": 60, "equipped": None, "inventory": INVENTORY.new(), "is_in_combat": False
+        }
+        save_player(new_p)
+        LOGIN_STATS['registered'] += 1
+        attach_player(sid, new_p)
+        update_leaderboard(new_p)
+        send_status(sid, f"🌟 New Guest <b>{name}</b> registered and logged in!")
+        issue_resume_token(sid)
+        send_room_desc(sid)
+
+
+@command("quit", "exit", auth=False)
+def cmd_quit(sid, p, room, cmd, raw):
+    if p.get('is_in_combat'):
+        send_status(sid, "❌ You cannot quit while in combat! Fight or flee first!")
+        return
+    send_room_status(p['location'], f"<i>{p['name']} has phased out of existence.</i>", skip=(sid,))
+    detach_player(sid)
+
+
+HELP_ENTRIES = [
+    ("login [username] [password]", "Login to your hero."),
+    ("quit", "Leave these realms. "),
+    ("look", "Scan the room."), ("stats", "View status."),
+    ("go [number]", "Enter a portal."), ("attack", "Fight monster."),
+    ("travel [room number]", f"Walk the shortest way to a room up to {TRAVEL_MAX_HOPS} portals away."),
+    ("inv", "View items."), ("use [item]", "Use an item."),
+    ("attack", "attack the monster that might be near you."),
+    ("retreat", "I guess if your a coward you can do that."),
+    ("cast [spell]", "Cast a spell, current spells available are fireball/mend/blur."),
+    ("list", "List the items in a nearby shop."),
+    ("buy [item]", "Buy an item from the nearby shop."),
+    ("use [item}", "Use an item from your inventory."),
+    ("say [text]", "Chat with others in the room."),
+    ("shout [text]", "Chat with others in the server."),
+    ("who", "List others in the server."),
+    ("where [player name]", "Where is another player?."),
+    ("top", "List the top players on the server."),
+    ("wield [weapon]", "Wield your weapon."),
+    ("unwield", "Sheath your weapon."),
+    ("probe [item]", "What is this thing?."),
+    ("drop [item]", "Drop an item your inventory."),
+    ("pickup [item]", "Pickup an item from a room."),
+    ("give [player] [item]", "Give an item to another player."),
+]
+HELP_HTML = (
+    "<div style='border: 1px dashed #d4af37; padding: 10px; margin: 10px 0;'>"
+    "<b style='color: #d4af37;'>--- COMMANDS ---</b><br>"
+    + "<br>".join(f"<b>{usage}:</b> {desc}" for usage, desc in HELP_ENTRIES)
+    + "</div>"
+)
+
+
+@command("help", auth=False)
+def cmd_help(sid, p, room, cmd, raw):
+    send_event(sid, 'help', {'commands': HELP_ENTRIES}, lambda: HELP_HTML)
+
+
+@command("look")
+def cmd_look(sid, p, room, cmd, raw):
+    send_room_desc(sid)
+
+
+@command("who")
+def cmd_who(sid, p, room, cmd, raw):
+    # [name, level, room name] for every active player session, looking
+    # each occupied room up in the store once however many stand in it
+    room_names = {}
+    online = []
+    for other_p in list(players.values()):
+        room_name = room_names.get(other_p['location'])
+        if room_name is None:
+            room_name = room_names[other_p['location']] = WORLD.get(other_p['location'], {}).get('name', 'Unknown Void')
+        online.append([other_p['name'], other_p['level'], room_name])
+
+    def render():
+        # Start the header
+        who_list = ["<br>--- <b>Current Guests in the Realm</b> ---"]
+        for name, level, room_name in online:
+            # Format: [Level] Name - Location
+            who_list.append(f"• <span style='color:#00d4ff;'>Lvl {level}</span> "
+                            f"<b>{name}</b> - <i>{room_name}</i>")
+        # Add a footer with the total count
+        who_list.append(f"--- <b>Total: {len(online)}</b> ---<br>")
+        return "<br>".join(who_list)
+
+    # Send only to the player who typed it
+    send_event(sid, 'who', {'players': online}, render)
+
+
+@command("stats", "whoami")
+def cmd_stats(sid, p, room, cmd, raw):
+    send_status(sid, f"Name: {p['name']} | LVL: {p['level']} | HP: {p['current_hp']} | ATN: {p['stats']['Attunement']} | Gold: {p['gold']} | XP: {p['xp']} | Equipped: {p['equipped']}")
+
+
+@command("inv")
+def cmd_inv(sid, p, room, cmd, raw):
+    msg = f"Inventory:"
+    inv_items = p['inventory']
+    if inv_items:
+        formatted = []
+        for item_id, count in inv_items.items():
+            name = ITEMS[item_id]['name']
+            if count > 1:
+                formatted.append(f"{name} (x{count})")
+            else:
+                formatted.append(name)
+        msg += f"<br>📦 <b>You see:</b> {', '.join(formatted)}<br>"
+        if CARRY_WEIGHT:
+            msg += f"⚖️ Carrying {inv_items.weight:g} of {CARRY_WEIGHT:g} lbs.<br>"
+    send_status(sid, msg)
+
+
+@command("list")
+def cmd_list(sid, p, room, cmd, raw):
+    if room.get('has_shop'):
+        send_status(sid, "Phil's Items: potion (20g), crystal (100g), elixir (50), sword(50g), broadsword(150g), spoon(5g)")
+
+
+@command("buy")
+def cmd_buy(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Buy what?</i>")
         return
+
+    item = item_id_for(" ".join(cmd[1:]))
+    if room.get('has_shop') and item in ITEMS and p['gold'] >= ITEMS[item]['price']:
+        reason = p['inventory'].refuses(item)
+        if reason:
+            send_status(sid, refusal(p, item, reason))
+            return
+        p['gold'] -= ITEMS[item]['price'];
+        p['inventory'].add(item)
+        save_inventory_change(p, item, 1)
+        save_player(p)  # gold has to land with the item
+        update_leaderboard(p)
+        send_status(sid, f"Bought {item}.")
     else:
+        send_status(sid, f"Check your wallet, also are you sure there is a shop here?.")
+
+
+@command("cast")
+def cmd_cast(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Cast what?</i>")
+        return
+
+    s = cmd[1]
+    if s in SPELLS and p['current_hp'] > SPELLS[s]['cost']:
+        p['current_hp'] -= SPELLS[s]['cost']
+        if s == "fireball" and p['is_in_combat']:
+            dmg = int(p['stats']['Attunement'] * 2.5)
+            room['monster']['hp'] -= dmg
+            send_status(sid, f"🔥 Fireball deals {dmg} damage!")
+        elif s == "mend":
+            p['current_hp'] = min(p['stats']['Hardiness'], p['current_hp'] + 35)
+            send_status(sid, "✨ Mended wounds.")
+
+
+@command("go", "enter")
+def cmd_go(sid, p, room, cmd, raw):
+    if p['is_in_combat']:
+        send_status(sid, "You can't walk away while being attacked!")
+        return
+
+    target = cmd[1] if len(cmd) > 1 else ""
+    if target in room['portals']:
+        gate = room['portals'][target]
+        if p['stats']['Attunement'] >= gate['min_attunement']:
+            # Notify old room
+            send_room_status(p['location'], f"<i>{p['name']} vanished through a portal.</i>", skip=(sid,))
+            # Move player
+            move_player(sid, target)
+            save_player(p)
+
+            # Notify new room
+            send_room_status(target, f"<i>{p['name']} stepped out of the shadows.</i>", skip=(sid,))
 
-        if cmd[0] == "look":
             send_room_desc(sid)
-        elif cmd[0].lower() == "who":
-            # Start the header
-            who_list = ["<br>--- <b>Current Guests in the Realm</b> ---"]
-
-            # Iterate through all active player sessions
-            for sid, other_p in players.items():
-                room_name = WORLD.get(other_p['location'], {}).get('name', 'Unknown Void')
-
-                # Format: [Level] Name - Location
-                entry = (f"• <span style='color:#00d4ff;'>Lvl {other_p['level']}</span> "
-                         f"<b>{other_p['name']}</b> - <i>{room_name}</i>")
-                who_list.append(entry)
-
-            # Add a footer with the total count
-            who_list.append(f"--- <b>Total: {len(players)}</b> ---<br>")
-
-            # Send only to the player who typed it
-            emit('status', {'msg': "<br>".join(who_list)})
-        elif cmd[0] in ["stats","whoami"]:
-            emit('status',
-                 {'msg': f"Name: {p['name']} | LVL: {p['level']} | HP: {p['current_hp']} | ATN: {p['stats']['Attunement']} | Gold: {p['gold']} | XP: {p['xp']} | Equipped: {p['equipped']}"})
-        elif cmd[0] == "inv":
-            msg = f"Inventory:"
-            inv_items = p['inventory']
-            if inv_items:
-                counts = Counter(ITEMS[i]['name'] for i in inv_items)
-                formatted = []
-                for name, count in counts.items():
-                    if count > 1:
-                        formatted.append(f"{name} (x{count})")
-                    else:
-                        formatted.append(name)
-                msg += f"<br>📦 <b>You see:</b> {', '.join(formatted)}<br>"
-            emit('status', {'msg': msg})
-        elif cmd[0] == "list":
-            if room.get('has_shop'):
-                emit('status', {'msg': "Phil's Items: potion (20g), crystal (100g), elixir (50), sword(50g), broadsword(150g), spoon(5g)"})
-        elif cmd[0] == "buy" and len(cmd) > 1:
-            item = cmd[1]
-            if room.get('has_shop') and item in ITEMS and p['gold'] >= ITEMS[item]['price']:
-                p['gold'] -= ITEMS[item]['price'];
-                p['inventory'].append(item)
-                emit('status', {'msg': f"Bought {item}."})
-            else:
-                emit('status', {'msg': f"Check your wallet, also are you sure there is a shop here?."})
-        elif cmd[0] == "cast" and len(cmd) > 1:
-            s = cmd[1]
-            if s in SPELLS and p['current_hp'] > SPELLS[s]['cost']:
-                p['current_hp'] -= SPELLS[s]['cost']
-                if s == "fireball" and p['is_in_combat']:
-                    dmg = int(p['stats']['Attunement'] * 2.5)
-                    room['monster']['hp'] -= dmg
-                    emit('status', {'msg': f"🔥 Fireball deals {dmg} damage!"})
-                elif s == "mend":
-                    p['current_hp'] = min(p['stats']['Hardiness'], p['current_hp'] + 35)
-                    emit('status', {'msg': "✨ Mended wounds."})
-        elif cmd[0] in ["go", "enter"]:
-            if p['is_in_combat']:
-                emit('status', {'msg': "You can't walk away while being attacked!"})
-                return
+        else:
+            send_status(sid, "The portal remains solid. You need more Attunement.")
+    else:
+        send_status(sid, "Invalid portal number.")
 
-            target = cmd[1] if len(cmd) > 1 else ""
-            if target in room['portals']:
-                gate = room['portals'][target]
-                if p['stats']['Attunement'] >= gate['min_attunement']:
-                    # Notify old room
-                    emit('status', {'msg': f"<i>{p['name']} vanished through a portal.</i>"},
-                         room=p['location'], include_self=False)
-                    leave_room(p['location'])
-
-                    # Move player
-                    p['location'] = target
-                    join_room(target)
-                    save_player(p)
-
-                    # Notify new room
-                    emit('status', {'msg': f"<i>{p['name']} stepped out of the shadows.</i>"},
-                         room=target, include_self=False)
-
-                    send_room_desc(sid)
-                else:
-                    emit('status', {'msg': "The portal remains solid. You need more Attunement."})
-            else:
-                emit('status', {'msg': "Invalid portal number."})
-        elif cmd[0] == "attack":
-            room = WORLD[p['location']]
-            monsters = room.get('monsters', [])
 
-            # 1. Identify which monster to hit (optional name matching)
-            target_query = " ".join(cmd[1:]).lower() if len(cmd) > 1 else None
+@command("travel")
+def cmd_travel(sid, p, room, cmd, raw):
+    if p['is_in_combat']:
+        send_status(sid, "You can't walk away while being attacked!")
+        return
+    if len(cmd) < 2:
+        send_status(sid, "<i>Usage: travel [room number]</i>")
+        return
 
-            # Filter for monsters that are currently alive
-            active_mobs = [(i, m) for i, m in enumerate(monsters) if m.get('dead_until', 0) == 0]
+    origin, destination = p['location'], cmd[1]
+    if destination == origin:
+        send_status(sid, "You are already there.")
+        return
+    path = ROUTES.route(origin, destination, p['stats']['Attunement']) if destination in WORLD else None
+    if not path:
+        send_status(sid, f"You know no way there within {TRAVEL_MAX_HOPS} portals.")
+        return
 
-            if room.get("is_safe", None):
-                emit('status', {'msg': "This is a safe area, no one is allowed to fight."}, room=sid)
-                return
+    # Walk it here rather than a `go` per portal: the rooms on the way are
+    # only checked for monsters that stop you, and whoever stands in them
+    # sees you pass. The first living aggro monster ends the walk early.
+    here, blocker, now = origin, None, time.time()
+    for step in path:
+        if step not in WORLD[here].get('portals', {}):
+            break  # the route went stale under us
+        here = step
+        if here == destination:
+            break
+        through = WORLD[here]
+        if not through.get('is_safe'):
+            blocker = next((m for m in through.get('monsters', ()) if m.template.is_aggro and m.dead_until <= now), None)
+            if blocker is not None:
+                break
+        send_room_status(here, f"<i>{p['name']} hurried through.</i>", skip=(sid,))
+    if here == origin:
+        send_status(sid, "The way there is closed.")
+        return
 
-            if not active_mobs:
-                emit('status', {'msg': "There is nothing here to attack."}, room=sid)
-                return
+    send_room_status(origin, f"<i>{p['name']} vanished through a portal.</i>", skip=(sid,))
+    move_player(sid, here)
+    save_player(p)
+    send_room_status(here, f"<i>{p['name']} stepped out of the shadows.</i>", skip=(sid,))
+
+    hops = path.index(here) + 1
+    room_name = WORLD[here]['name']
+    foe = blocker.template.name if blocker is not None else None
+
+    def render():
+        msg = f"🚶 You pass through {hops} portal{'s' if hops != 1 else ''} to <b>{room_name}</b>."
+        if foe is not None:
+            msg += f" <b style='color: #FF4500;'>A {foe} bars the way onward.</b>"
+        return msg
+
+    payload = {'hops': hops, 'room': room_name}
+    if foe is not None:
+        payload['foe'] = foe
+    send_event(sid, 'travel', payload, render)
+    send_room_desc(sid)
 
-            # 2. Selection Logic
-            chosen_idx = None
-            if target_query:
-                for idx, m in active_mobs:
-                    if target_query in m['name'].lower():
-                        chosen_idx = idx
-                        break
-                if chosen_idx is None:
-                    emit('status', {'msg': f"You don't see a '{target_query}' here."}, room=sid)
-                    return
-            else:
-                # Default to the first living monster in the list
-                chosen_idx = active_mobs[0][0]
-
-            # 3. Check if the player is already fighting
-            if p.get('combat_target') is not None:
-                # If they are already fighting, we just update the target
-                p['combat_target'] = chosen_idx
-                emit('status', {'msg': f"You shift your focus to the <b>{monsters[chosen_idx]['name']}</b>!"},
-                     room=sid)
-            else:
-                # Start a new combat thread
-                p['combat_target'] = chosen_idx
-                emit('status', {'msg': f"<b>You engage the {monsters[chosen_idx]['name']}!</b>"}, room=sid)
-                socketio.start_background_task(combat_tick, sid)
-        elif cmd[0] == "retreat":
-            if p['is_in_combat']:
-                # Success chance = 40% + Wit
-                if random.randint(1, 100) <= (40 + p['stats']['Wit']):
-                    p['is_in_combat'] = False
-                    p['location'] = "1"
-                    emit('status', {'msg': "<b style='color: #00ffff;'>You successfully escaped to the Foyer!</b>"})
-                else:
-                    m = room['monster']
-                    p['current_hp'] -= m['atk']
-                    emit('status', {
-                        'msg': f"<b style='color: #ffaa00;'>Retreat failed!</b> {m['name']} catches you for {m['atk']} damage!"})
-            else:
-                emit('status', {'msg': "You aren't in combat."})
-        elif cmd[0].lower() == "say":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Say what?</i>"})
-                return
 
-            # Extract everything after the word 'say' to keep spaces intact
-            # raw is the full string from the user input
-            message_content = raw.split(' ', 1)[1]
+@command("attack")
+def cmd_attack(sid, p, room, cmd, raw):
+    # 1. Identify which monster to hit (optional name matching)
+    target_query = " ".join(cmd[1:]).lower() if len(cmd) > 1 else None
 
-            # Format the message for the chat
-            chat_msg = f"<b>{p['name']}</b> says: <span style='color:#f1c40f;'>\"{message_content}\"</span>"
+    # Filter for monsters that are currently alive
+    active_mobs = [m for m in room.get('monsters', []) if m.dead_until == 0]
 
-            # Emit to everyone in the same location room
-            emit('status', {'msg': chat_msg}, room=p['location'])
-        elif cmd[0].lower() == "shout":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Your voice echoes, but you said nothing.</i>"})
-                return
+    if room.get("is_safe", None):
+        send_status(sid, "This is a safe area, no one is allowed to fight.")
+        return
 
-            message_content = raw.split(' ', 1)[1]
-            shout_msg = f"📢 <b>{p['name']} shouts:</b> <span style='color:#e74c3c;'>{message_content.upper()}!!</span>"
+    if not active_mobs:
+        send_status(sid, "There is nothing here to attack.")
+        return
 
-            # Leaving out 'room' emits to every connected socket globally
-            emit('status', {'msg': shout_msg}, broadcast=True)
-        elif cmd[0] == "use" and len(cmd) > 1:
-            item_id = cmd[1].lower()
+    # 2. Selection Logic
+    chosen = None
+    if target_query:
+        chosen = next((m for m in active_mobs if target_query in m.template.name.lower()), None)
+        if chosen is None:
+            send_status(sid, f"You don't see a '{target_query}' here.")
+            return
+    else:
+        # Default to the first living monster in the list
+        chosen = active_mobs[0]
+
+    # 3. Check if the player is already fighting
+    if p.get('combat_target') is not None:
+        # If they are already fighting, we just update the target
+        set_combat_target(sid, chosen.id)
+        send_status(sid, f"You shift your focus to the <b>{chosen.template.name}</b>!")
+    else:
+        # Start a new fight on the game loop
+        set_combat_target(sid, chosen.id)
+        send_status(sid, f"<b>You engage the {chosen.template.name}!</b>")
+        start_combat(sid)
+
+
+@command("retreat")
+def cmd_retreat(sid, p, room, cmd, raw):
+    if p['is_in_combat']:
+        # Success chance = 40% + Wit
+        if random.randint(1, 100) <= (40 + p['stats']['Wit']):
+            p['is_in_combat'] = False
+            move_player(sid, "1")
+            send_status(sid, "<b style='color: #00ffff;'>You successfully escaped to the Foyer!</b>")
+        else:
+            m = room['monster']
+            p['current_hp'] -= m['atk']
+            send_status(sid, f"<b style='color: #ffaa00;'>Retreat failed!</b> {m['name']} catches you for {m['atk']} damage!")
+    else:
+        send_status(sid, "You aren't in combat.")
 
-            if item_id in p['inventory']:
-                item_data = ITEMS.get(item_id)
 
-                # 1. Handle Potions and Consumables
-                if item_data["type"] == "potion" or item_data["type"] == "food":
-                    effect = item_data.get("effect")
-                    val = item_data.get("value", 0)
+@command("say")
+def cmd_say(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Say what?</i>")
+        return
 
-                    if effect == "heal":
-                        # Uses 'Hardiness' as the max HP cap
-                        p['current_hp'] = min(p['stats']['Hardiness'], p['current_hp'] + val)
-                        emit('status', {'msg': f"🥤 You drink the {item_data['name']}. Healed for {val} HP!"}, room=sid)
+    # Extract everything after the word 'say' to keep spaces intact
+    # raw is the full string from the user input
+    message_content = raw.split(' ', 1)[1]
 
-                    elif effect == "boost":
-                        p['stats']['Attunement'] += val
-                        emit('status', {'msg': f"✨ The {item_data['name']} shatters! Attunement increased by {val}."},
-                             room=sid)
+    # Format the message for the chat
+    chat_msg = f"<b>{p['name']}</b> says: <span style='color:#f1c40f;'>\"{message_content}\"</span>"
 
-                    elif effect == "wit_boost":
-                        p['stats']['Wit'] += val
-                        emit('status', {'msg': f"🧠 You drink the {item_data['name']}. Wit increased by {val}."},
-                             room=sid)
+    # Emit to everyone in the same location room
+    send_room_status(p['location'], chat_msg)
 
-                    # Remove item after successful use
-                    p['inventory'].remove(item_id)
 
-                # 2. Handle Weapons (Prevent "using" them like potions)
-                elif item_data["type"] == "weapon":
-                    emit('status', {'msg': "<i>You can't eat that. Try 'equip' instead!</i>"}, room=sid)
+@command("shout")
+def cmd_shout(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Your voice echoes, but you said nothing.</i>")
+        return
 
-                # 3. Handle Quest/Flavor Items
-                else:
-                    emit('status', {'msg': f"You fiddle with the {item_data['name']}, but nothing happens."}, room=sid)
-            else:
-                emit('status', {'msg': "You aren't carrying that."}, room=sid)
-        elif cmd[0].lower() == "where":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Usage: where [name]</i>"})
-                return
+    message_content = raw.split(' ', 1)[1]
+    shout_msg = f"📢 <b>{p['name']} shouts:</b> <span style='color:#e74c3c;'>{message_content.upper()}!!</span>"
 
-            target_name = cmd[1].lower()
-            found = False
+    # Leaving out 'room' emits to every connected socket globally
+    send_status_all(shout_msg)
 
-            for sid, other_p in players.items():
-                if other_p['name'].lower() == target_name:
-                    room_name = WORLD[other_p['location']]['name']
-                    emit('status', {'msg': f"📍 <b>{other_p['name']}</b> is currently in: <i>{room_name}</i>"})
-                    found = True
-                    break
 
-            if not found:
-                emit('status', {'msg': f"❌ Guest '{cmd[1]}' is not currently in this reality."})
+@command("use")
+def cmd_use(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Use what?</i>")
+        return
 
-        elif cmd[0].lower() in ["leaderboard", "top"]:
+    item_id = item_id_for(" ".join(cmd[1:]))
 
-            top_players = get_leaderboard()
+    if item_id in p['inventory']:
+        item_data = ITEMS.get(item_id)
 
-            if not top_players:
-                emit('status', {'msg': "The history books are currently empty."})
+        # 1. Handle Potions and Consumables
+        if item_data["type"] == "potion" or item_data["type"] == "food":
+            effect = item_data.get("effect")
+            val = item_data.get("value", 0)
 
-                return
+            if effect == "heal":
+                # Uses 'Hardiness' as the max HP cap
+                p['current_hp'] = min(p['stats']['Hardiness'], p['current_hp'] + val)
+                send_status(sid, f"🥤 You drink the {item_data['name']}. Healed for {val} HP!")
 
-            # Build the entire message in one variable
+            elif effect == "boost":
+                p['stats']['Attunement'] += val
+                send_status(sid, f"✨ The {item_data['name']} shatters! Attunement increased by {val}.")
 
+            elif effect == "wit_boost":
+                p['stats']['Wit'] += val
+                send_status(sid, f"🧠 You drink the {item_data['name']}. Wit increased by {val}.")
 
-            output = "🏆 --- <b>LEGENDS OF THE REALM</b> ---<br>"
+            # Remove item after successful use
+            p['inventory'].remove(item_id)
+            save_inventory_change(p, item_id, -1)
 
-            for i, (name, level, xp, gold) in enumerate(top_players, 1):
-                medal = "🥇 " if i == 1 else "🥈 " if i == 2 else "🥉 " if i == 3 else f"{i}. "
+        # 2. Handle Weapons (Prevent "using" them like potions)
+        elif item_data["type"] == "weapon":
+            send_status(sid, "<i>You can't eat that. Try 'equip' instead!</i>")
 
-                output += f"{medal}<b>{name}</b> - <span style='color:#f1c40f;'>Lvl {level}</span> ({xp} XP) | 💰 {gold}g<br>"
+        # 3. Handle Quest/Flavor Items
+        else:
+            send_status(sid, f"You fiddle with the {item_data['name']}, but nothing happens.")
+    else:
+        send_status(sid, "You aren't carrying that.")
 
-            output += "--------------------------------"
 
-            # Send exactly once
+@command("where")
+def cmd_where(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Usage: where [name]</i>")
+        return
 
-            emit('status', {'msg': output})
-        elif cmd[0].lower() == "clear":
-            # We emit a special 'clear' event instead of a 'status' message
-            emit('clear_screen')
-        elif cmd[0].lower() in ["wield", "equip"]:
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Wield what?</i>"})
-                return
+    _, other_p = find_player(cmd[1])
 
-            item_name = " ".join(cmd[1:]).lower()
+    if other_p:
+        room_name = WORLD[other_p['location']]['name']
+        send_status(sid, f"📍 <b>{other_p['name']}</b> is currently in: <i>{room_name}</i>")
+    else:
+        send_status(sid, f"❌ Guest '{cmd[1]}' is not currently in this reality.")
 
-            # 1. Find the item in inventory
-            item_to_wield = next((i for i in p['inventory'] if i.lower() == item_name), None)
 
-            if not item_to_wield:
-                emit('status', {'msg': f"You aren't carrying a '{item_name}'."})
-                return
+@command("leaderboard", "top")
+def cmd_top(sid, p, room, cmd, raw):
+    top_players = leaderboard.top()
 
-            if ITEMS[item_to_wield].get('type') != 'weapon':
-                emit('status', {'msg': f"You can't effectively wield a {item_name} as a weapon."})
-                return
+    if not top_players:
+        send_status(sid, "The history books are currently empty.")
+        return
 
-            # 2. Equip the item
-            p['equipped'] = item_to_wield
-            save_player(p)
+    # Build the entire message in one variable
+    output = "🏆 --- <b>LEGENDS OF THE REALM</b> ---<br>"
 
-            emit('status', {
-                'msg': f"⚔️ You are now wielding: <b>{ITEMS[item_to_wield]['name']}</b> (Bonus: +{ITEMS[item_to_wield]['damage']} dmg)"})
-            emit('status', {'msg': f"<i>{p['name']} draws a {ITEMS[item_to_wield]['name']}.</i>"}, room=p['location'],
-                 include_self=False)
-        elif cmd[0].lower() == "unwield":
-            p['equipped'] = None
-            emit('status', {'msg': "You sheath your weapon and prepare to use your fists."})
+    for i, (name, level, xp, gold) in enumerate(top_players, 1):
+        medal = "🥇 " if i == 1 else "🥈 " if i == 2 else "🥉 " if i == 3 else f"{i}. "
 
-        elif cmd[0].lower() in ["inspect", "probe", "examine"]:
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>What do you want to inspect?</i>"})
-                return
+        output += f"{medal}<b>{name}</b> - <span style='color:#f1c40f;'>Lvl {level}</span> ({xp} XP) | 💰 {gold}g<br>"
 
-            item_name = " ".join(cmd[1:]).lower()
-            room = WORLD[p['location']]
+    output += "--------------------------------"
 
-            # 1. Search Inventory first, then the room
-            target_item = next((i for i in p['inventory'] if i.lower() == item_name), None)
+    # Send exactly once
+    send_status(sid, output)
 
-            # Check if targeting a player instead of an item
-            target_player = next((other for sid, other in players.items()
-                                  if other['name'].lower() == item_name), None)
 
-            if target_player:
-                desc = f"👤 <b>{target_player['name']}</b> (Lvl {target_player['level']})<br>"
-                desc += f"Status: {'In Combat' if target_player['is_in_combat'] else 'Idle'}"
-                emit('status', {'msg': desc})
-                return
+@command("clear")
+def cmd_clear(sid, p, room, cmd, raw):
+    # We emit a special 'clear' event instead of a 'status' message
+    deliver(sid, 'clear_screen', None)
 
-            location_label = "Inventory"
-            if not target_item:
-                target_item = next((i for i in room.get('items', []) if i.lower() == item_name), None)
-                location_label = "Room"
-                target_item = ITEMS[target_item]
-            else:
-                target_item = ITEMS[target_item]
 
-            if not target_item:
-                emit('status', {'msg': f"You don't see a '{item_name}' here or in your pack."})
-                return
+@command("wield", "equip")
+def cmd_wield(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Wield what?</i>")
+        return
 
-            # 2. Build the inspection report
-            res = [f"<br>🔎 <b>Inspecting: {target_item['name']}</b> ({location_label})"]
-            res.append(f"<i>{target_item.get('desc', 'A mysterious object with no visible markings.')}</i>")
-            res.append("----------------------------")
+    item_name = item_id_for(" ".join(cmd[1:]))
 
-            # Dynamically show stats based on item type
-            if 'damage' in target_item:
-                res.append(f"⚔️ <b>Damage:</b> {target_item['damage']}")
-            if 'armor' in target_item:
-                res.append(f"🛡️ <b>Protection:</b> {target_item['armor']}")
-            if 'weight' in target_item:
-                res.append(f"⚖️ <b>Weight:</b> {target_item['weight']} lbs")
-            if 'value' in target_item:
-                res.append(f"💰 <b>Market Value:</b> {target_item['value']} gold")
+    # 1. Find the item in inventory
+    item_to_wield = item_name if item_name in p['inventory'] else None
 
+    if not item_to_wield:
+        send_status(sid, f"You aren't carrying a '{item_name}'.")
+        return
 
-            res.append("----------------------------<br>")
+    if ITEMS[item_to_wield].get('type') != 'weapon':
+        send_status(sid, f"You can't effectively wield a {item_name} as a weapon.")
+        return
 
-            emit('status', {'msg': "<br>".join(res)})
+    # 2. Equip the item
+    p['equipped'] = item_to_wield
+    save_player(p)
 
-        elif cmd[0].lower() in ["get", "take", "pickup"]:
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Take what?</i>"})
-                return
+    send_status(sid, f"⚔️ You are now wielding: <b>{ITEMS[item_to_wield]['name']}</b> (Bonus: +{ITEMS[item_to_wield]['damage']} dmg)")
+    send_room_status(p['location'], f"<i>{p['name']} draws a {ITEMS[item_to_wield]['name']}.</i>", skip=(sid,))
 
-            item_name = " ".join(cmd[1:]).lower()
-            room = WORLD[p['location']]
 
-            # 1. Find the item on the floor
-            # We use a list comprehension to find the index so we can pop it out
-            item_index = next((index for (index, d) in enumerate(room.get('items', []))
-                               if d.lower() == item_name), None)
+@command("unwield")
+def cmd_unwield(sid, p, room, cmd, raw):
+    p['equipped'] = None
+    send_status(sid, "You sheath your weapon and prepare to use your fists.")
 
-            if item_index is not None:
-                # 2. Transfer item: Room -> Player
-                item = room['items'].pop(item_index)
-                p['inventory'].append(item)
 
-                save_player(p)  # Save inventory state
+@command("inspect", "probe", "examine")
+def cmd_inspect(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>What do you want to inspect?</i>")
+        return
 
-                emit('status', {'msg': f"You picked up: <b>{item}</b>"})
-                emit('status', {'msg': f"<i>{p['name']} picks up a {item}.</i>"},
-                     room=p['location'], include_self=False)
-            else:
-                emit('status', {'msg': f"There is no '{item_name}' here."})
-        elif cmd[0].lower() == "drop":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Drop what?</i>"})
-                return
+    item_name = " ".join(cmd[1:]).lower()
 
-            item_name = " ".join(cmd[1:]).lower()
+    # 1. Search Inventory first, then the room
+    item_id = item_id_for(item_name)
+    target_item = item_id if item_id in p['inventory'] else None
 
-            # 1. Find item in player inventory
-            item_index = next((index for (index, d) in enumerate(p['inventory'])
-                               if d.lower() == item_name), None)
+    # Check if targeting a player instead of an item
+    _, target_player = find_player(item_name)
 
-            if item_index is not None:
-                # 2. Transfer item: Player -> Room
-                item = p['inventory'].pop(item_index)
+    if target_player:
+        desc = f"👤 <b>{target_player['name']}</b> (Lvl {target_player['level']})<br>"
+        desc += f"Status: {'In Combat' if target_player['is_in_combat'] else 'Idle'}"
+        send_status(sid, desc)
+        return
 
-                # Ensure the room has an items list
-                if 'items' not in WORLD[p['location']]:
-                    WORLD[p['location']]['items'] = []
+    location_label = "Inventory"
+    if not target_item:
+        target_item = item_id if item_id in room.get('items', {}) else None
+        location_label = "Room"
 
-                WORLD[p['location']]['items'].append(item)
+    if not target_item:
+        send_status(sid, f"You don't see a '{item_name}' here or in your pack.")
+        return
+    target_item = ITEMS[target_item]
 
-                # 3. Handle 'equipped' safety (If they drop what they are wielding)
-                if p.get('equipped') and p['equipped'] == item_name:
-                    p['equipped'] = None
-                    emit('status', {'msg': "<i>(You unequipped the item before dropping it.)</i>"})
+    # 2. Build the inspection report
+    res = [f"<br>🔎 <b>Inspecting: {target_item['name']}</b> ({location_label})"]
+    res.append(f"<i>{target_item.get('desc', 'A mysterious object with no visible markings.')}</i>")
+    res.append("----------------------------")
 
-                save_player(p)
+    # Dynamically show stats based on item type
+    if 'damage' in target_item:
+        res.append(f"⚔️ <b>Damage:</b> {target_item['damage']}")
+    if 'armor' in target_item:
+        res.append(f"🛡️ <b>Protection:</b> {target_item['armor']}")
+    if 'weight' in target_item:
+        res.append(f"⚖️ <b>Weight:</b> {target_item['weight']} lbs")
+    if 'value' in target_item:
+        res.append(f"💰 <b>Market Value:</b> {target_item['value']} gold")
 
-                emit('status', {'msg': f"You dropped: <b>{item}</b>"})
-                emit('status', {'msg': f"<i>{p['name']} dropped a {item} on the floor.</i>"},
-                     room=p['location'], include_self=False)
-            else:
-                emit('status', {'msg': f"You aren't carrying a '{item_name}'."})
-        elif cmd[0].lower() == "give":
-            if len(cmd) < 3:
-                emit('status', {'msg': "<i>Usage: give [item] [player_name]</i>"})
-                return
+    res.append("----------------------------<br>")
 
-            # The last word is the target player name
-            target_name = cmd[-1].lower()
-            # Everything between 'give' and the target name is the item
-            item_name = " ".join(cmd[1:-1]).lower()
-
-            # 1. Find the target player in the current room
-            target_sid = None
-            target_p = None
-            for sid, other_p in players.items():
-                if other_p['name'].lower() == target_name and other_p['location'] == p['location']:
-                    target_sid = sid
-                    target_p = other_p
-                    break
-
-            if not target_p:
-                emit('status', {'msg': f"❌ You don't see anyone named '{target_name}' here."})
-                return
+    send_status(sid, "<br>".join(res))
 
-            # 2. Find the item in your inventory
-            item_index = next((index for (index, d) in enumerate(p['inventory'])
-                               if d.lower() == item_name), None)
 
-            if item_index is None:
-                emit('status', {'msg': f"You aren't carrying a '{item_name}'."})
-                return
+@command("get", "take", "pickup")
+def cmd_get(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Take what?</i>")
+        return
+
+    item_name = item_id_for(" ".join(cmd[1:]))
+
+    # 1. Find the item on the floor
+    if item_name in room.get('items', {}):
+        item = item_name
+        reason = p['inventory'].refuses(item)
+        if reason:
+            send_status(sid, refusal(p, item, reason))
+            return
+        # 2. Transfer item: Room -> Player
+        floors.take(room['items'], item)
+        p['inventory'].add(item)
+        touch_room(p['location'])
+
+        save_inventory_change(p, item, 1)
+
+        send_status(sid, f"You picked up: <b>{item}</b>")
+        send_room_status(p['location'], f"<i>{p['name']} picks up a {item}.</i>", skip=(sid,))
+    else:
+        send_status(sid, f"There is no '{item_name}' here.")
+
+
+@command("drop")
+def cmd_drop(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Drop what?</i>")
+        return
 
-            # 3. Perform the transfer
-            item = p['inventory'].pop(item_index)
-            target_p['inventory'].append(item)
+    item_name = item_id_for(" ".join(cmd[1:]))
 
-            # 4. Safety: If you were wielding it, unequip it
-            if p.get('equipped') and p['equipped'] == ITEMS[item]['name']:
-                p['equipped'] = None
+    # 1. Find item in player inventory
+    if item_name in p['inventory']:
+        # 2. Transfer item: Player -> Room
+        item = item_name
+        if not drop_on_floor(p['location'], room, item):
+            send_status(sid, "There's no room left on the floor.")
+            return
+        p['inventory'].remove(item)
 
-            # 5. Save both players
+        # 3. Handle 'equipped' safety (If they drop the last one they are wielding)
+        if p.get('equipped') == item and item not in p['inventory']:
+            p['equipped'] = None
             save_player(p)
-            save_player(target_p)
+            send_status(sid, "<i>(You unequipped the item before dropping it.)</i>")
 
-            # 6. Notifications
-            # To the Giver
-            emit('status', {'msg': f"🎁 You gave the <b>{item['name']}</b> to <b>{target_p['name']}</b>."})
+        save_inventory_change(p, item, -1)
 
-            # To the Receiver
-            emit('status', {'msg': f"🎁 <b>{p['name']}</b> handed you a <b>{item['name']}</b>!"}, room=target_sid)
+        send_status(sid, f"You dropped: <b>{item}</b>")
+        send_room_status(p['location'], f"<i>{p['name']} dropped a {item} on the floor.</i>", skip=(sid,))
+    else:
+        send_status(sid, f"You aren't carrying a '{item_name}'.")
 
-            # To the Room (Observers)
-            emit('status', {'msg': f"<i>{p['name']} hands something to {target_p['name']}.</i>"},
-                 room=p['location'], skip_sid=[request.sid, target_sid])
-        elif cmd[0].lower() == "drop":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Drop what?</i>"})
-                return
 
-            item_name = " ".join(cmd[1:]).lower()
+@command("give")
+def cmd_give(sid, p, room, cmd, raw):
+    if len(cmd) < 3:
+        send_status(sid, "<i>Usage: give [item] [player_name]</i>")
+        return
 
-            # 1. Find item in player inventory
-            item_index = next((index for (index, d) in enumerate(p['inventory'])
-                               if d.lower() == item_name), None)
+    # The last word is the target player name
+    target_name = cmd[-1].lower()
+    # Everything between 'give' and the target name is the item
+    item_name = item_id_for(" ".join(cmd[1:-1]))
 
-            if item_index is not None:
-                # 2. Transfer item: Player -> Room
-                item = p['inventory'].pop(item_index)
+    # 1. Find the target player in the current room
+    target_sid, target_p = find_player(target_name)
 
-                # Ensure the room has an items list
-                if 'items' not in WORLD[p['location']]:
-                    WORLD[p['location']]['items'] = []
+    if not target_p or target_p['location'] != p['location']:
+        send_status(sid, f"❌ You don't see anyone named '{target_name}' here.")
+        return
 
-                WORLD[p['location']]['items'].append(item)
+    # 2. Find the item in your inventory
+    if item_name not in p['inventory']:
+        send_status(sid, f"You aren't carrying a '{item_name}'.")
+        return
+    item = item_name
 
-                # 3. Handle 'equipped' safety (If they drop what they are wielding)
-                if p.get('equipped') and p['equipped'] == item_name:
-                    p['equipped'] = None
-                    emit('status', {'msg': "<i>(You unequipped the item before dropping it.)</i>"})
+    if target_p['inventory'].refuses(item):
+        send_status(sid, f"❌ <b>{target_p['name']}</b> can't carry any more of the {ITEMS[item]['name']}.")
+        return
 
-                save_player(p)
+    # 3. Perform the transfer
+    p['inventory'].remove(item)
+    target_p['inventory'].add(item)
 
-                emit('status', {'msg': f"You dropped: <b>{item}</b>"})
-                emit('status', {'msg': f"<i>{p['name']} dropped a {item} on the floor.</i>"},
-                     room=p['location'], include_self=False)
-            else:
-                emit('status', {'msg': f"You aren't carrying a '{item_name}'."})
-        elif cmd[0].lower() == "junk":
-            if len(cmd) < 2:
-                emit('status', {'msg': "<i>Usage: junk [item]</i>"})
-                return
+    # 4. Safety: If you were wielding the last one, unequip it
+    if p.get('equipped') == item and item not in p['inventory']:
+        p['equipped'] = None
+        save_player(p)
 
-            # Everything between 'junk' and the target name is the item
-            item_name = " ".join(cmd[1:]).lower()
+    # 5. Save both inventories
+    save_inventory_change(p, item, -1)
+    save_inventory_change(target_p, item, 1)
 
-            # 2. Find the item in your inventory
-            item_index = next((index for (index, d) in enumerate(p['inventory'])
-                               if d.lower() == item_name), None)
+    # 6. Notifications
+    # To the Giver
+    send_status(sid, f"🎁 You gave the <b>{ITEMS[item]['name']}</b> to <b>{target_p['name']}</b>.")
 
-            if item_index is None:
-                emit('status', {'msg': f"You aren't carrying a '{item_name}'."})
-                return
+    # To the Receiver
+    send_status(target_sid, f"🎁 <b>{p['name']}</b> handed you a <b>{ITEMS[item]['name']}</b>!")
 
-            # 3. Perform the transfer
-            item = p['inventory'].pop(item_index)
+    # To the Room (Observers)
+    send_room_status(p['location'], f"<i>{p['name']} hands something to {target_p['name']}.</i>", skip=(sid, target_sid))
 
-            # 4. Safety: If you were wielding it, unequip it
-            if p.get('equipped') and p['equipped'] == ITEMS[item]['name']:
-                p['equipped'] = None
 
-            # 5. Save the players
-            save_player(p)
+@command("junk")
+def cmd_junk(sid, p, room, cmd, raw):
+    if len(cmd) < 2:
+        send_status(sid, "<i>Usage: junk [item]</i>")
+        return
 
-            # 6. Notifications
-            # To the Giver
-            emit('status', {'msg': f"🎁 You junk the <b>{ITEMS[item]['name']}</b>."})
+    # Everything between 'junk' and the target name is the item
+    item_name = item_id_for(" ".join(cmd[1:]))
+
+    # 2. Take it out of your inventory
+    if not p['inventory'].remove(item_name):
+        send_status(sid, f"You aren't carrying a '{item_name}'.")
+        return
+    item = item_name
+
+    # 3. Safety: If you were wielding the last one, unequip it
+    if p.get('equipped') == item and item not in p['inventory']:
+        p['equipped'] = None
+        save_player(p)
+
+    # 4. Save the inventory
+    save_inventory_change(p, item, -1)
+
+    # 5. Notifications
+    # To the Giver
+    send_status(sid, f"🎁 You junk the <b>{ITEMS[item]['name']}</b>.")
+
+    # To the Room (Observers)
+    send_room_status(p['location'], f"<i>{p['name']} tosses {ITEMS[item]['name']} into the trash.</i>")
+
+
+# --- METRICS ---
+# Read from the engine's own stats when /metrics is scraped.
+def _monster_counts():
+    counts = {}
+    now = time.time()
+    for m in list(MONSTERS.values()):
+        rid = m.room
+        state = "dead" if m.dead_until > now else "alive"
+        counts[(rid, state)] = counts.get((rid, state), 0) + 1
+        if m.template.is_roaming:
+            counts[(rid, "roaming")] = counts.get((rid, "roaming"), 0) + 1
+    return counts
+
+
+def _by_kind(stats, field):
+    return {tuple(key.split(':', 1)): entry[field] for key, entry in list(stats.items())}
+
+
+METRICS.sampled("mud_players_online", "Connected sessions, Guests included.", lambda: len(players))
+METRICS.sampled("mud_active_combats", "Players with a combat round scheduled.", active_combats)
+METRICS.sampled("mud_monsters", "Monsters per room by state (alive, dead, roaming).", _monster_counts,
+                labelnames=("room", "state"))
+METRICS.sampled("mud_emits_total", "Messages sent, by event and kind.", lambda: _by_kind(EMIT_STATS, 'emits'),
+                type="counter", labelnames=("event", "kind"))
+METRICS.sampled("mud_emit_bytes_total", "Estimated bytes sent (see EMIT_SAMPLE_EVERY), by event and kind.",
+                lambda: _by_kind(EMIT_STATS, 'bytes'), type="counter", labelnames=("event", "kind"))
+METRICS.sampled("mud_outbound_total",
+                "Outbound messages, frames written, batch frames, messages held for a tick and dropped for held players.",
+                lambda: {(key,): value for key, value in FRAME_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_command_errors_total", "Commands whose handler raised, by command.",
+                lambda: {(name,): stats['errors'] for name, stats in COMMAND_STATS.items() if stats['calls']},
+                type="counter", labelnames=("command",))
+METRICS.sampled("mud_save_queue_depth", "Player rows and inventory deltas waiting for the writer.",
+                lambda: save_queue_stats()['queue_depth'])
+METRICS.sampled("mud_save_total", "Write-behind counters (queued, merged, flushes, rows_written, ...).",
+                lambda: {(key,): value for key, value in SAVE_STATS.items() if not key.endswith('_ms')},
+                type="counter", labelnames=("what",))
+METRICS.sampled("mud_game_loop_total", "Game loop ticks, overruns, skipped ticks, timers run and timer errors.",
+                lambda: {(key,): value for key, value in game_loop.stats.items() if not key.endswith('_ms')},
+                type="counter", labelnames=("what",))
+METRICS.sampled("mud_game_loop_pending_timers", "Timers waiting on the game loop heap.", game_loop.pending)
+METRICS.sampled("mud_login_pending", "Password jobs running or waiting in the login pool.", PASSWORDS.pending)
+METRICS.sampled("mud_login_total", "Login outcomes (attempts, ok, registered, bad_password, throttled, busy, ...).",
+                lambda: {(key,): value for key, value in LOGIN_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_held_players", "Disconnected players kept in the world for a resume.", lambda: len(held_players))
+METRICS.sampled("mud_resume_total", "Resume tokens issued, players held, resumed, expired and tokens rejected.",
+                lambda: {(key,): value for key, value in RESUME_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_respawn_total", "Monster respawns scheduled and done.",
+                lambda: {(key,): value for key, value in RESPAWN_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_rooms_resident", "Rooms paged into memory.", lambda: WORLD.resident()[0])
+METRICS.sampled("mud_room_bytes_resident", "Estimated bytes held by resident rooms (see ROOM_CACHE_BYTES).",
+                lambda: WORLD.resident()[1])
+METRICS.sampled("mud_room_store_total",
+                "Room lookups served from memory (hits), rooms loaded (and of those, generated), unknown ids, "
+                "evictions and write-back commits.",
+                lambda: {(key,): value for key, value in WORLD.stats.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_roam_total", "Roaming checks, moves, and moves skipped because the monster was engaged.",
+                lambda: {(key,): value for key, value in ROAM_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_floor_items_total",
+                "Floor items dropped, pushed off full floors, refused, reclaimed by the decay sweeper; rooms swept, "
+                "and sweeps cut short by FLOOR_SWEEP_BUDGET_MS.",
+                lambda: {(key,): value for key, value in FLOOR_STATS.items()}, type="counter", labelnames=("what",))
+METRICS.sampled("mud_floors_queued", "Resident rooms with drops waiting to decay.", lambda: len(_floor_queued))
+METRICS.sampled("mud_route_index_total",
+                "travel route tables served from memory (hits) and searched for (builds), rooms those searches "
+                "visited, and times portal changes dropped every table.",
+                lambda: {(key,): value for key, value in ROUTES.stats.items()}, type="counter", labelnames=("what",))
+
+
+@app.route('/metrics')
+def metrics_page():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+# --- ENGINE MODE ---
+# Client events forwarded by the gateways on fanout.ENGINE_CHANNEL, as
+# {"event": name, "sid": sid, "args": [...]}. They run one at a time on this
+# thread in the order the queue delivers them, so the engine sees one
+# sequence of events just as a single process would.
+ENGINE_EVENTS = {"connect": connect_session, "disconnect": disconnect_session,
+                 "hello": hello_session, "command": run_command}
+ENGINE_STATS = {"events": 0, "errors": 0, "unknown": 0}
+
+
+def serve_engine(backend):
+    events = backend.listen(fanout.ENGINE_CHANNEL)
+    log.info("engine taking client events from %s", MUD_QUEUE)
+    # The engine serves no clients, but can still serve /metrics
+    metrics_port = os.environ.get("MUD_METRICS_PORT")
+    if metrics_port:
+        server = make_server(os.environ.get("MUD_HOST", "0.0.0.0"), int(metrics_port), app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    # gateway.py waits on this before it starts accepting connections
+    ready_fd = os.environ.get("MUD_READY_FD")
+    if ready_fd:
+        os.write(int(ready_fd), b"1")
+        os.close(int(ready_fd))
+    for message in events:
+        handler = ENGINE_EVENTS.get(message.get('event'))
+        if handler is None:
+            ENGINE_STATS['unknown'] += 1
+            continue
+        ENGINE_STATS['events'] += 1
+        try:
+            handler(message['sid'], *message.get('args', ()))
+        except Exception:
+            ENGINE_STATS['errors'] += 1
+            traceback.print_exc()
 
-            # To the Room (Observers)
-            emit('status', {'msg': f"<i>{p['name']} tosses {ITEMS[item]['name']} into the trash.</i>"},
-                 room=p['location'])
-        else:
-            emit('status', {'msg': "The command '{}' is not available at this time.".format(cmd[0])})
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, allow_unsafe_werkzeug=True, port=8000, host='0.0.0.0')
\ No newline at end of file
+    # Turn SIGTERM into a normal exit so atexit flushes the save queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if MUD_QUEUE:
+        serve_engine(fanout.open_backend(MUD_QUEUE))
+    else:
+        socketio.run(app, debug=os.environ.get("MUD_DEBUG", "1") == "1", allow_unsafe_werkzeug=True,
+                     port=int(os.environ.get("MUD_PORT", 8000)), host=os.environ.get("MUD_HOST", "0.0.0.0"))
\ No newline at end of file
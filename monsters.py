@@ -0,0 +1,120 @@
+"""
+Monsters are split in two: a MonsterTemplate with everything all monsters
+of a kind share (name, max_hp, atk, xp, gold, loot, flags), made once and
+never changed, and a Monster per spawn holding only its live state (id,
+template, hp, dead_until and the room it is in). Ten thousand Castle Guards
+are ten thousand small Monsters pointing at one template.
+
+A room entry that overrides template fields ({"template": "castle_guard",
+"atk": 12}), or a generated monster scaled for its depth, gets a variant
+template. Variants are made once per distinct set of overrides and shared
+the same way, keyed "castle_guard" + the overrides as JSON.
+
+Monsters are stored (in world.db, see roomstore.py) as their state list,
+[id, template key, hp, dead_until]; TemplateTable.restore() reads one back.
+"""
+import json
+
+# monsters.json fields, with the defaults for the optional ones
+TEMPLATE_FIELDS = {"name": None, "max_hp": None, "atk": None, "xp": None, "gold": None,
+                   "loot": None, "is_aggro": False, "is_roaming": False, "respawn_delay": None}
+
+
+class MonsterTemplate:
+    """Shared, read-only monster stats. `key` names it in stored state."""
+    __slots__ = ("key", "template_id") + tuple(TEMPLATE_FIELDS)
+
+    def __init__(self, key, template_id, fields):
+        set_ = object.__setattr__
+        set_(self, "key", key)
+        set_(self, "template_id", template_id)
+        for field, default in TEMPLATE_FIELDS.items():
+            set_(self, field, fields.get(field, default))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"monster templates are read-only ({self.key}.{name})")
+
+    def __reduce__(self):
+        return (MonsterTemplate, (self.key, self.template_id, {field: getattr(self, field) for field in TEMPLATE_FIELDS}))
+
+    def __repr__(self):
+        return f"<MonsterTemplate {self.key}>"
+
+
+class Monster:
+    """One spawned monster: what changes while it lives, dies and roams."""
+    __slots__ = ("id", "template", "hp", "dead_until", "room")
+
+    def __init__(self, monster_id, template, hp=None, dead_until=0, room=None):
+        self.id = monster_id
+        self.template = template
+        self.hp = template.max_hp if hp is None else hp
+        self.dead_until = dead_until
+        self.room = room
+
+    def state(self):
+        return [self.id, self.template.key, self.hp, self.dead_until]
+
+    def __repr__(self):
+        return f"<Monster {self.id} {self.template.name} {self.hp}/{self.template.max_hp}>"
+
+
+def to_json(obj):
+    """json.dumps default= hook for rooms holding Monsters."""
+    if isinstance(obj, Monster):
+        return obj.state()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+class TemplateTable:
+    """MonsterTemplates for the monsters.json entries (template id -> dict), variants made on demand."""
+
+    def __init__(self, templates):
+        self._source = templates
+        self._templates = {template_id: MonsterTemplate(template_id, template_id, fields)
+                           for template_id, fields in templates.items()}
+        self._variants = {}  # (template id, sorted override items) -> template, so spawning skips the JSON key
+
+    def __contains__(self, template_id):
+        return template_id in self._source
+
+    def __len__(self):
+        return len(self._templates)
+
+    def variant(self, template_id, overrides=None):
+        """The template for template_id with some fields overridden, shared by everyone asking for the same."""
+        if not overrides:
+            return self._templates[template_id]
+        memo = (template_id, tuple(sorted(overrides.items())))
+        template = self._variants.get(memo)
+        if template is None:
+            template = self._variants[memo] = self._variant(template_id, overrides)
+        return template
+
+    def _variant(self, template_id, overrides):
+        source = self._source[template_id]
+        overrides = {field: value for field, value in overrides.items()
+                     if field in TEMPLATE_FIELDS and value != source.get(field, TEMPLATE_FIELDS[field])}
+        if not overrides:
+            return self._templates[template_id]
+        key = template_id + json.dumps(overrides, sort_keys=True, separators=(",", ":"))
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = MonsterTemplate(key, template_id, dict(source, **overrides))
+        return template
+
+    def get(self, key):
+        """The template a stored key names. Raises KeyError for an unknown template id."""
+        template = self._templates.get(key)
+        if template is None:
+            template_id, _, overrides = key.partition("{")
+            template = self.variant(template_id, json.loads("{" + overrides) if overrides else None)
+        return template
+
+    def spawn(self, monster_id, template_id, overrides=None):
+        return Monster(monster_id, self.variant(template_id, overrides))
+
+    def restore(self, state):
+        """A Monster from its state() list."""
+        monster_id, key, hp, dead_until = state
+        return Monster(monster_id, self.get(key), hp, dead_until)
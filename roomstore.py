@@ -0,0 +1,353 @@
+"""
+Rooms paged in from SQLite on demand, so a world of any size runs in a
+bounded amount of memory.
+
+Each room is one row: its static JSON (as compiled by worlddata) and, once
+it has been evicted at least once, its dynamic state (floor items and
+monsters, with their hp and dead_until). A room is loaded the first time
+something looks it up and stays resident while it is used. When the rooms
+held in memory go over the byte budget, the least recently used ones that
+aren't pinned (see `pinned`) are written back and dropped.
+
+Rooms can also come from a generator (see worldgen.py) instead of a row:
+a generated room is made the first time its id is looked up, and only
+gets a row, holding just its dynamic state, when it is evicted.
+
+RoomStore behaves like the dict WORLD used to be: WORLD[rid], WORLD.get(rid),
+`rid in WORLD`, iteration and len() all work, the lookups paging rooms in
+as needed. Iterating items() or values() pages in every room, so leave
+that to tools and benchmarks.
+"""
+import itertools
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from storage import DEFAULT_PRAGMAS
+
+# Dynamic room fields, saved on eviction and laid over the static row on load
+STATE_FIELDS = ("items", "monsters")
+MAX_ABSENT = 10000  # unknown ids remembered, so asking again doesn't query
+SCHEMA_VERSION = 2  # world.db only caches the data files, so another version is dropped and rebuilt
+
+
+def deep_size(obj):
+    """
+    Rough bytes held by a JSON-shaped object. Shared strings are counted
+    every time, so it errs high; other objects (Monsters) count only their
+    own size, not what they point to.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sys.getsizeof(key) + deep_size(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            size += deep_size(value)
+    return size
+
+
+class RoomStore:
+    """
+    `budget` is in bytes, as estimated by deep_size() when a room is loaded.
+    Rooms for which pinned(rid) is true (players standing in them) are never
+    evicted, nor is any room used in the last `min_idle` seconds, so a caller
+    holding a room dict it just looked up never sees it written back under
+    it. The budget can run over while everything resident is in use.
+
+    on_load(rid, room) runs after a room comes into memory and
+    on_evict(rid, room) just before it goes, both under the store's lock.
+
+    `generator`, if given, answers for ids without a static row: it needs
+    generate(rid) returning a room dict or None, `in`, len(), ids(),
+    portals(rid), portals_into(rid) and gates().
+
+    Rooms holding more than JSON (Monster objects) need `encode`, a
+    json.dumps default= hook, and `decode(room)`, which turns a room read
+    back from JSON into what was encoded, in place.
+    """
+
+    def __init__(self, path, budget=64 * 1024 * 1024, min_idle=5.0, pinned=None, on_load=None, on_evict=None,
+                 generator=None, encode=None, decode=None):
+        self.path = path
+        self.budget = budget
+        self.min_idle = min_idle
+        self.pinned = pinned or (lambda rid: False)
+        self.on_load = on_load
+        self.on_evict = on_evict
+        self.generator = generator
+        self.encode = encode
+        self.decode = decode
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        for name, value in DEFAULT_PRAGMAS.items():
+            self._conn.execute(f"PRAGMA {name}={value}")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._conn.executescript("DROP TABLE IF EXISTS rooms; DROP TABLE IF EXISTS portals; DROP TABLE IF EXISTS meta;")
+            self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        # A NULL static is a generated room that has been evicted: only its state is kept
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS rooms (id TEXT PRIMARY KEY, static TEXT, state TEXT);
+            CREATE TABLE IF NOT EXISTS portals (source TEXT NOT NULL, target TEXT NOT NULL,
+                                                min_attunement INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS portals_by_target ON portals (target);
+            CREATE INDEX IF NOT EXISTS portals_by_source ON portals (source);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        self._lock = threading.RLock()
+        self._resident = OrderedDict()  # room id -> [room, estimated bytes, last used, state as loaded], least recent first
+        self._bytes = 0
+        self.portal_version = 0  # bumped whenever a room's portals may have changed
+        self._absent = set()  # ids looked up and not found
+        # write_backs counts commits; one can carry several evicted rooms
+        self.stats = {"hits": 0, "loads": 0, "generated": 0, "misses": 0, "evictions": 0, "write_backs": 0}
+
+    # --- seeding ---
+    def source(self):
+        """The source key the rooms were last imported with, or None."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key='source'").fetchone()
+        return row[0] if row else None
+
+    def import_rooms(self, rooms, source):
+        """Replaces every room with `rooms` (room id -> room dict) and records source."""
+        with self._lock:
+            self.clear_resident(write_back=False)
+            self._absent.clear()
+            with self._conn:
+                self._conn.execute("DELETE FROM rooms")
+                self._conn.execute("DELETE FROM portals")
+                self._conn.executemany("INSERT INTO rooms (id, static) VALUES (?, ?)",
+                                       ((rid, self._dumps(room)) for rid, room in rooms.items()))
+                self._conn.executemany("INSERT INTO portals VALUES (?, ?, ?)",
+                                       ((rid, target, portal.get('min_attunement', 0))
+                                        for rid, room in rooms.items() for target, portal in room.get('portals', {}).items()))
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (source,))
+            self.portal_version += 1
+
+    def reset_state(self):
+        """Forgets every room's saved dynamic state, so rooms load as the data files describe them."""
+        with self._lock:
+            self.clear_resident(write_back=False)
+            with self._conn:
+                self._conn.execute("DELETE FROM rooms WHERE static IS NULL")
+                self._conn.execute("UPDATE rooms SET state=NULL WHERE state IS NOT NULL")
+
+    def preload(self, limit):
+        """Loads up to `limit` rooms, in import order, while they fit the budget. Returns how many."""
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT id FROM rooms WHERE static IS NOT NULL ORDER BY rowid LIMIT ?",
+                                                         (limit,))]
+            loaded = 0
+            for rid in ids:
+                if self._bytes >= self.budget:
+                    break
+                if rid not in self._resident:
+                    self._load(rid)
+                    loaded += 1
+            return loaded
+
+    # --- the mapping ---
+    def _lookup(self, rid):
+        """The room, paging it in if need be, or None if there is no such room."""
+        with self._lock:
+            entry = self._resident.get(rid)
+            if entry is not None:
+                self._resident.move_to_end(rid)
+                entry[2] = time.monotonic()
+                self.stats['hits'] += 1
+                return entry[0]
+            room = self._load(rid)
+            if room is not None:
+                self._evict_over_budget()
+            return room
+
+    def __getitem__(self, rid):
+        room = self._lookup(rid)
+        if room is None:
+            raise KeyError(rid)
+        return room
+
+    def get(self, rid, default=None):
+        room = self._lookup(rid)
+        return default if room is None else room
+
+    def __contains__(self, rid):
+        with self._lock:
+            if rid in self._resident:
+                return True
+            if rid in self._absent:
+                return False
+            if self.generator is not None and rid in self.generator:
+                return True
+            return self._conn.execute("SELECT 1 FROM rooms WHERE id=?", (rid,)).fetchone() is not None
+
+    def __setitem__(self, rid, room):
+        """Adds or replaces a room, both resident and on disk."""
+        with self._lock:
+            self._drop(rid)
+            self._absent.discard(rid)
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO rooms (id, static) VALUES (?, ?)", (rid, self._dumps(room)))
+                self._conn.execute("DELETE FROM portals WHERE source=?", (rid,))
+                self._conn.executemany("INSERT INTO portals VALUES (?, ?, ?)",
+                                       ((rid, target, portal.get('min_attunement', 0))
+                                        for target, portal in room.get('portals', {}).items()))
+            self.portal_version += 1
+            self._admit(rid, room)
+            self._evict_over_budget()
+
+    def __iter__(self):
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT id FROM rooms WHERE static IS NOT NULL ORDER BY rowid")]
+        if self.generator is not None:
+            return itertools.chain(ids, self.generator.ids())
+        return iter(ids)
+
+    def __len__(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM rooms WHERE static IS NOT NULL").fetchone()[0]
+        return count + (len(self.generator) if self.generator is not None else 0)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        for rid in self:
+            yield rid, self[rid]
+
+    def values(self):
+        for rid in self:
+            yield self[rid]
+
+    def portals(self, rid):
+        """{target id: min_attunement} for rid's portals, without loading it."""
+        portals = self.generator.portals(rid) if self.generator is not None else {}
+        with self._lock:
+            portals.update(self._conn.execute("SELECT target, min_attunement FROM portals WHERE source=?", (rid,)))
+        return portals
+
+    def gates(self):
+        """Every min_attunement some portal needs, lowest first."""
+        with self._lock:
+            gates = {row[0] for row in self._conn.execute("SELECT DISTINCT min_attunement FROM portals")}
+        if self.generator is not None:
+            gates.update(self.generator.gates())
+        return sorted(gates)
+
+    def portals_into(self, rid):
+        """Ids of the rooms with a portal into rid, without loading any of them."""
+        with self._lock:
+            sources = [row[0] for row in self._conn.execute("SELECT source FROM portals WHERE target=?", (rid,))]
+        if self.generator is not None:
+            sources.extend(self.generator.portals_into(rid))
+        return list(dict.fromkeys(sources))
+
+    def is_resident(self, rid):
+        return rid in self._resident
+
+    def peek(self, rid):
+        """The room if it is resident, else None. Doesn't count as a use, so it won't keep the room in memory."""
+        entry = self._resident.get(rid)
+        return None if entry is None else entry[0]
+
+    def resident(self):
+        with self._lock:
+            return len(self._resident), self._bytes
+
+    # --- paging ---
+    def _load(self, rid):
+        row = room = None
+        decode = False
+        if rid not in self._absent:
+            row = self._conn.execute("SELECT static, state FROM rooms WHERE id=?", (rid,)).fetchone()
+        if row is not None and row[0] is not None:
+            room = json.loads(row[0])
+            decode = True
+        elif self.generator is not None:
+            room = self.generator.generate(rid)
+            if room is not None:
+                self.stats['generated'] += 1
+        if room is None:
+            self.stats['misses'] += 1
+            if len(self._absent) >= MAX_ABSENT:
+                self._absent.clear()
+            self._absent.add(rid)
+            return None
+        if row is not None and row[1] is not None:
+            room.update(json.loads(row[1]))
+            decode = True
+        if decode and self.decode is not None:
+            self.decode(room)
+        self.stats['loads'] += 1
+        self._admit(rid, room)
+        return room
+
+    def _dumps(self, room):
+        return json.dumps(room, separators=(",", ":"), default=self.encode)
+
+    def _state(self, room):
+        return self._dumps({field: room.get(field, []) for field in STATE_FIELDS})
+
+    def _admit(self, rid, room):
+        size = deep_size(room)
+        # The state as loaded, so a room nothing happened in isn't written back
+        self._resident[rid] = [room, size, time.monotonic(), self._state(room)]
+        self._bytes += size
+        if self.on_load is not None:
+            self.on_load(rid, room)
+
+    def _drop(self, rid):
+        entry = self._resident.pop(rid, None)
+        if entry is None:
+            return None
+        self._bytes -= entry[1]
+        if self.on_evict is not None:
+            self.on_evict(rid, entry[0])
+        return entry
+
+    def _evict_over_budget(self):
+        if self._bytes <= self.budget:
+            return
+        cutoff = time.monotonic() - self.min_idle
+        victims = []
+        over = self._bytes - self.budget
+        for rid, (room, size, last_used, loaded_state) in self._resident.items():
+            if over <= 0 or last_used > cutoff:
+                break  # everything after this was used more recently still
+            if self.pinned(rid):
+                continue
+            victims.append(rid)
+            over -= size
+        if victims:
+            self._write_back(victims)
+
+    def _write_back(self, rids):
+        states = []
+        for rid in rids:
+            room, size, last_used, loaded_state = self._drop(rid)
+            state = self._state(room)
+            if state != loaded_state:
+                states.append((rid, state))
+            self.stats['evictions'] += 1
+        if not states:
+            return
+        with self._conn:
+            # Generated rooms get their row here, with no static
+            self._conn.executemany("INSERT INTO rooms (id, state) VALUES (?, ?) "
+                                   "ON CONFLICT (id) DO UPDATE SET state=excluded.state", states)
+        self.stats['write_backs'] += 1
+
+    def clear_resident(self, write_back=True):
+        """Evicts every resident room, pinned or not (writing their state back unless told not to)."""
+        with self._lock:
+            if write_back:
+                self._write_back(list(self._resident))
+            else:
+                for rid in list(self._resident):
+                    self._drop(rid)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,123 @@
+"""
+Shortest ways through the portal graph, for walking a player to a room in
+one command instead of a `go` per door.
+
+A RouteIndex keeps next-hop tables: for one destination and one attunement
+tier, room id -> the room to step into next on a shortest way there. One
+breadth-first search out from the destination, along portals backwards,
+fills a table, and every player of that tier heading there shares it, from
+wherever they start. Tiers are the distinct min_attunement values portals
+need: a player with 7 attunement walks the same graph as one with 5 when no
+portal asks for 6 or 7, so they share tables too.
+
+The world is too big to route every room to every other, so tables are made
+the first time someone heads for a destination and reach out `max_hops`
+doors; farther rooms have no route. The least recently used tables go once
+there are more than `max_tables`, and what the search learned about each
+room's portals is kept (for up to `max_rooms` rooms) for the next search.
+
+`graph` needs portals(rid) ({target id: min_attunement}), portals_into(rid),
+gates() (every min_attunement, lowest first) and a portal_version that
+changes whenever any portal does; a RoomStore has all four. Everything
+cached is dropped when portal_version moves, or on invalidate().
+"""
+import bisect
+import threading
+from collections import OrderedDict
+
+
+class RouteIndex:
+    def __init__(self, graph, max_hops=40, max_tables=64, max_rooms=50000):
+        self.graph = graph
+        self.max_hops = max_hops
+        self.max_tables = max_tables
+        self.max_rooms = max_rooms
+        self._lock = threading.Lock()
+        self._version = None
+        self._gates = []
+        self._tables = OrderedDict()  # (gate, destination) -> {room id: next room id}, least recent first
+        self._links = OrderedDict()   # room id -> (its portals, ids of the rooms with one into it)
+        self.stats = {"hits": 0, "builds": 0, "rooms_searched": 0, "invalidations": 0}
+
+    def invalidate(self):
+        """Forgets every table, e.g. after portals were edited behind the graph's back."""
+        with self._lock:
+            self._version = None
+
+    def _check_version(self):
+        if self._version != self.graph.portal_version:
+            if self._version is not None:
+                self.stats['invalidations'] += 1
+            self._version = self.graph.portal_version
+            self._gates = self.graph.gates()
+            self._tables.clear()
+            self._links.clear()
+
+    def route(self, source, destination, attunement):
+        """
+        The room ids a shortest walk from source to destination steps into,
+        destination last: [] when already there, None if there is no way
+        within max_hops through portals attunement opens.
+        """
+        if source == destination:
+            return []
+        with self._lock:
+            self._check_version()
+            i = bisect.bisect_right(self._gates, attunement)
+            if not i:
+                return None
+            table = self._table(self._gates[i - 1], destination)
+            path = []
+            here = source
+            while here != destination:
+                here = table.get(here)
+                if here is None:
+                    return None
+                path.append(here)
+            return path
+
+    def _table(self, gate, destination):
+        key = (gate, destination)
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            self.stats['hits'] += 1
+            return table
+        table = self._tables[key] = self._search(gate, destination)
+        self.stats['builds'] += 1
+        while len(self._tables) > self.max_tables:
+            self._tables.popitem(last=False)
+        return table
+
+    def _search(self, gate, destination):
+        # Outward from the destination, one ring of rooms per door
+        next_hop = {}
+        seen = {destination}
+        ring = [destination]
+        for _ in range(self.max_hops):
+            outer = []
+            for rid in ring:
+                for source in self._room_links(rid)[1]:
+                    if source in seen:
+                        continue
+                    need = self._room_links(source)[0].get(rid)
+                    if need is None or need > gate:
+                        continue
+                    seen.add(source)
+                    next_hop[source] = rid
+                    outer.append(source)
+            if not outer:
+                break
+            ring = outer
+        self.stats['rooms_searched'] += len(seen)
+        return next_hop
+
+    def _room_links(self, rid):
+        links = self._links.get(rid)
+        if links is not None:
+            self._links.move_to_end(rid)
+            return links
+        links = self._links[rid] = (self.graph.portals(rid), self.graph.portals_into(rid))
+        if len(self._links) > self.max_rooms:
+            self._links.popitem(last=False)
+        return links
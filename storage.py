@@ -0,0 +1,105 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Applied to every pooled connection. WAL lets readers (logins, `top`) run
+# while the save writer holds the write lock; NORMAL sync is safe under WAL
+# and skips the fsync on every commit.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -8000,  # KiB, i.e. ~8MB page cache per connection
+    "busy_timeout": 5000,
+}
+
+# sqlite3 keeps a per-connection LRU of prepared statements keyed by SQL text,
+# so reusing long-lived connections with fixed query strings reuses the plans.
+STATEMENT_CACHE_SIZE = 128
+
+
+class ConnectionPool:
+    """
+    A bounded pool of long-lived SQLite connections.
+    Connections are opened lazily up to `size` and handed out one per caller;
+    when they are all busy, callers wait up to `timeout` seconds.
+    `observer`, if given, is called as observer(wait_seconds, held_seconds)
+    after every borrow, e.g. to record time spent in SQLite.
+    """
+
+    def __init__(self, path, size=4, timeout=10.0, pragmas=None, observer=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.observer = observer
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("connection pool is closed")
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"no free connection to {self.path} after {self.timeout}s")
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection; any open transaction is rolled back on return."""
+        start = time.perf_counter()
+        conn = self._acquire()
+        acquired = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+            if self.observer is not None:
+                self.observer(acquired - start, time.perf_counter() - acquired)
+
+    @contextmanager
+    def transaction(self):
+        """Borrows a connection and commits on success, rolls back on error."""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
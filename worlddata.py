@@ -0,0 +1,254 @@
+"""
+Loads the game's static data (items, spells, monster templates and rooms)
+from the JSON files in a data directory:
+
+    items.json     item id -> {"name", "type", "price", ...}
+    spells.json    spell name -> {"cost", ...}
+    monsters.json  template id -> {"name", "max_hp", "atk", "xp", "gold", "loot", ...};
+                   "respawn_delay" (seconds) is optional, see RESPAWN_DELAY in main.py
+    world.json     room id -> {"name", "desc", "portals", "items", "monsters", ...}
+
+A room's "items" list becomes its floor (see floors.py), where those items
+never decay. A room lists its monsters by template id, or as
+{"template": id, ...} to override some fields for that one monster. Each
+becomes a monsters.Monster with a stable id "<room id>.<slot>", sharing its
+(read-only) template with every other monster of the same kind.
+
+load() checks every reference between the files and raises WorldDataError
+listing everything wrong at once. The compiled result, indexes included, is
+pickled to <data dir>/.cache and reused while the JSON files are unchanged,
+so a large world costs one unpickle at startup instead of a parse and a
+validation pass. load(data_dir, rooms=False) reads and checks only the first
+three files, for when the rooms are already in a roomstore.RoomStore.
+"""
+import gc
+import json
+import logging
+import os
+import pickle
+import sys
+
+import floors
+from monsters import TEMPLATE_FIELDS, TemplateTable
+
+DATA_FILES = ("items.json", "spells.json", "monsters.json", "world.json")
+CACHE_DIR = ".cache"
+CACHE_FILE = "world.pickle"
+COMPILER_VERSION = 5  # bump when WorldData changes shape, to throw old caches away
+
+START_ROOM = "1"
+ITEM_FIELDS = {"name": str, "type": str, "price": int}
+MONSTER_FIELDS = {"name": str, "max_hp": int, "atk": int, "xp": int, "gold": int}
+ROOM_FIELDS = {"name": str, "desc": str}
+
+log = logging.getLogger("mud.worlddata")
+
+
+class WorldDataError(ValueError):
+    """The data files are inconsistent. One problem per line."""
+
+    def __init__(self, problems):
+        super().__init__("\n".join(problems))
+        self.problems = problems
+
+
+class WorldData:
+    """
+    The loaded data. `items`, `spells` and `rooms` keep the shapes main.py
+    always used for ITEMS, SPELLS and WORLD; `rooms` is empty when they were
+    not asked for. Indexes built once at load:
+
+        item_ids_by_name    lowercase display name -> item id
+        templates_by_name   lowercase monster name -> template dict
+        portals_into        room id -> ids of the rooms with a portal into it
+
+    `monsters` is the monsters.TemplateTable the rooms' monsters were spawned from.
+    """
+
+    def __init__(self, items, spells, templates, rooms, warnings=(), monsters=None):
+        self.items = items
+        self.spells = spells
+        self.templates = templates
+        self.monsters = monsters if monsters is not None else TemplateTable(templates)
+        self.rooms = rooms
+        self.warnings = list(warnings)
+        self.item_ids_by_name = {item['name'].lower(): item_id for item_id, item in items.items()}
+        self.templates_by_name = {template['name'].lower(): template for template in templates.values()}
+        self.portals_into = {}
+        for rid, room in rooms.items():
+            for target in room.get('portals', {}):
+                self.portals_into.setdefault(target, []).append(rid)
+
+
+def _check_fields(problems, where, entry, fields):
+    if not isinstance(entry, dict):
+        problems.append(f"{where}: expected an object")
+        return False
+    for field, kind in fields.items():
+        if not isinstance(entry.get(field), kind):
+            problems.append(f"{where}: '{field}' must be a {kind.__name__}")
+    return True
+
+
+def _check_top_level(raw, files):
+    problems = [f"{name}: expected an object at the top level" for name in files if not isinstance(raw.get(name), dict)]
+    if problems:
+        raise WorldDataError(problems)
+
+
+def _check_catalog(problems, items, templates):
+    names = {}
+    for item_id, item in items.items():
+        if _check_fields(problems, f"item {item_id}", item, ITEM_FIELDS) and isinstance(item.get('name'), str):
+            other = names.setdefault(item['name'].lower(), item_id)
+            if other != item_id:
+                problems.append(f"item {item_id}: same name as item {other} ({item['name']!r})")
+
+    for template_id, template in templates.items():
+        if _check_fields(problems, f"monster {template_id}", template, MONSTER_FIELDS):
+            if template.get('loot') is not None and template['loot'] not in items:
+                problems.append(f"monster {template_id}: loot {template['loot']!r} is not an item")
+            _check_monster_fields(problems, f"monster {template_id}", template)
+
+
+def _check_monster_fields(problems, where, fields):
+    for field in fields:
+        if field not in TEMPLATE_FIELDS and field != 'template':
+            problems.append(f"{where}: unknown field {field!r}")
+
+
+def compile_catalog(raw):
+    """Like compile_data, for items, spells and monsters alone. The WorldData has no rooms."""
+    _check_top_level(raw, DATA_FILES[:3])
+    items, spells, templates = (raw[name] for name in DATA_FILES[:3])
+    problems = []
+    _check_catalog(problems, items, templates)
+    if problems:
+        raise WorldDataError(problems)
+    return WorldData(items, spells, templates, {})
+
+
+def compile_data(raw):
+    """Validates the parsed JSON files ({file name: object}) and builds a WorldData."""
+    _check_top_level(raw, DATA_FILES)
+    items, spells, templates, rooms = (raw[name] for name in DATA_FILES)
+    problems, warnings = [], []
+    _check_catalog(problems, items, templates)
+    table = TemplateTable(templates) if not problems else None
+
+    for rid, room in rooms.items():
+        where = f"room {rid}"
+        if not _check_fields(problems, where, room, ROOM_FIELDS):
+            continue
+        for target, portal in room.get('portals', {}).items():
+            if target not in rooms:
+                problems.append(f"{where}: portal to {target}, which is not a room")
+            elif target == rid:
+                problems.append(f"{where}: portal to itself")
+            if not isinstance(portal, dict) or not isinstance(portal.get('min_attunement', 0), int):
+                problems.append(f"{where}: portal to {target} needs an integer min_attunement")
+        for item_id in room.get('items', []):
+            if item_id not in items:
+                problems.append(f"{where}: item {item_id!r} is not an item")
+        spawned = []
+        for entry in room.get('monsters', []):
+            template_id, overrides = (entry, {}) if isinstance(entry, str) else (entry.get('template'), entry)
+            if template_id not in templates:
+                problems.append(f"{where}: monster template {template_id!r} does not exist")
+                continue
+            _check_monster_fields(problems, f"{where}: monster {template_id}", overrides)
+            if table is not None:
+                spawned.append(table.spawn(f"{rid}.{len(spawned)}", template_id, overrides))
+        room['monsters'] = spawned
+
+    if START_ROOM not in rooms:
+        problems.append(f"world: no start room {START_ROOM}")
+    if problems:
+        raise WorldDataError(problems)
+
+    # Rooms nobody can walk into are legal (a GM can still move players
+    # there), but usually a typo in someone's portal list
+    seen, todo = {START_ROOM}, [START_ROOM]
+    while todo:
+        for target in rooms[todo.pop()].get('portals', {}):
+            if target not in seen:
+                seen.add(target)
+                todo.append(target)
+    unreachable = [rid for rid in rooms if rid not in seen]
+    if unreachable:
+        warnings.append(f"{len(unreachable)} room(s) unreachable from room {START_ROOM}: "
+                        + ", ".join(unreachable[:10]) + (" ..." if len(unreachable) > 10 else ""))
+
+    # One string object per repeated item id, however many rooms share it
+    for room in rooms.values():
+        room['items'] = floors.from_list(sys.intern(item_id) for item_id in room.get('items', []))
+    return WorldData(items, spells, templates, rooms, warnings, table)
+
+
+def source_key(data_dir):
+    """Changes whenever a data file (or the compiler) does."""
+    stats = [os.stat(os.path.join(data_dir, name)) for name in DATA_FILES]
+    return (COMPILER_VERSION,) + tuple((st.st_size, st.st_mtime_ns) for st in stats)
+
+
+def _read_cache(path, key):
+    try:
+        with open(path, "rb") as f:
+            cached_key, data = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        return None
+    return data if cached_key == key else None
+
+
+def _write_cache(path, key, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        # A read-only checkout still runs, it just compiles every time
+        log.warning("could not write the world cache %s: %s", path, e)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def _read_json(data_dir, files):
+    raw = {}
+    for name in files:
+        with open(os.path.join(data_dir, name), encoding="utf-8") as f:
+            try:
+                raw[name] = json.load(f)
+            except ValueError as e:
+                raise WorldDataError([f"{name}: {e}"])
+    return raw
+
+
+def load(data_dir, use_cache=True, rooms=True):
+    """
+    Returns the WorldData for data_dir, from the compiled cache when it is
+    current. With rooms=False only the small files are read, never the cache.
+    """
+    if not rooms:
+        return compile_catalog(_read_json(data_dir, DATA_FILES[:3]))
+    key = source_key(data_dir)
+    cache_path = os.path.join(data_dir, CACHE_DIR, CACHE_FILE)
+    # Everything built here lives for the whole run; don't let the collector
+    # walk it over and over while hundreds of thousands of dicts appear
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if use_cache:
+            data = _read_cache(cache_path, key)
+            if data is not None:
+                return data
+        data = compile_data(_read_json(data_dir, DATA_FILES))
+        if use_cache:
+            _write_cache(cache_path, key, data)
+        return data
+    finally:
+        if gc_was_enabled:
+            gc.enable()
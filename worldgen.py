@@ -0,0 +1,263 @@
+"""
+Generates the rooms past the hand-written castle from a seed, one room at a
+time, the first time something asks for it. data/worldgen.json sets it up:
+
+    seed          any string; the same seed always makes the same world
+    first_id      id of the first generated room (ids run first_id, first_id+1, ...)
+    width/height  the rooms form a width x height grid, numbered row by row
+    region_size   the grid is cut into region_size square regions, each with a theme
+    themes        name fragments, details for descriptions, and the monster
+                  templates and items that turn up there
+    entrance      the hand-written room whose portal leads to first_id
+
+Everything about a room comes from BLAKE2b hashes of the seed and the
+room's number (and a random.Random seeded with one, for the room's
+contents), never from hash(), so a room is the same in every process and
+after every restart without anything being stored.
+
+The grid is a maze: each room opens a portal north or west (a binary tree
+maze, so every room connects back to first_id) and a few more neighbours
+get shortcuts that need some attunement. Either side of a portal can work
+out the other from its own id, so a room's portals are known without
+generating its neighbours. Monsters get tougher by depth_scale per region
+away from the entrance, each depth and kind sharing one variant template
+(see monsters.py).
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+
+import floors
+from worlddata import WorldDataError
+
+CONFIG_FILE = "worldgen.json"
+GENERATOR_VERSION = 1  # bump when the same seed would come out differently
+
+
+class WorldGenerator:
+    def __init__(self, config, items, templates, monsters):
+        self.seed = str(config['seed'])
+        self.first_id = int(config['first_id'])
+        self.width = int(config['width'])
+        self.height = int(config['height'])
+        self.count = self.width * self.height
+        self.region_size = int(config.get('region_size', 40))
+        self.depth_scale = float(config.get('depth_scale', 0))
+        self.shortcut_chance = float(config.get('shortcut_chance', 0))
+        self.shortcut_attunement = list(config.get('shortcut_attunement', [0]))
+        self.entrance = config.get('entrance')
+        self.regions_across = -(-self.width // self.region_size)
+        self.themes = [self._table(theme, items, templates) for theme in config['themes']]
+        self.monsters = monsters  # the TemplateTable monsters are spawned from
+        self.config = config
+
+    @staticmethod
+    def _table(theme, items, templates):
+        # Cheap items and weak monsters turn up more often than dear and tough ones
+        theme = dict(theme)
+        theme['monster_weights'] = [1 / templates[t]['max_hp'] for t in theme['monsters']]
+        theme['item_weights'] = [1 / (items[i]['price'] + 1) for i in theme['items']]
+        theme['templates'] = templates
+        return theme
+
+    # --- ids ---
+    def __contains__(self, rid):
+        return self._index(rid) is not None
+
+    def __len__(self):
+        return self.count
+
+    def ids(self):
+        return (str(self.first_id + index) for index in range(self.count))
+
+    def _index(self, rid):
+        if not isinstance(rid, str) or not rid.isdigit() or (len(rid) > 1 and rid[0] == "0"):
+            return None
+        index = int(rid) - self.first_id
+        return index if 0 <= index < self.count else None
+
+    def _rid(self, index):
+        return str(self.first_id + index)
+
+    def _hash(self, *parts):
+        """A 64-bit number from the seed and parts. Cheaper than seeding a Random for one draw."""
+        key = ":".join([self.seed, *map(str, parts)]).encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    # --- layout ---
+    def _opens_north(self, index):
+        """The maze edge index carves: north, or west when False."""
+        row, col = divmod(index, self.width)
+        if row == 0:
+            return False
+        if col == 0:
+            return True
+        return self._hash("maze", index) & 1 == 0
+
+    def _neighbours(self, index):
+        row, col = divmod(index, self.width)
+        if row > 0:
+            yield index - self.width
+        if col > 0:
+            yield index - 1
+        if col < self.width - 1:
+            yield index + 1
+        if row < self.height - 1:
+            yield index + self.width
+
+    def _edge(self, a, b):
+        """min_attunement of the portal between neighbouring rooms a and b, or None if there is none."""
+        low, high = min(a, b), max(a, b)
+        # high carved into low (its north or west neighbour)?
+        if self._opens_north(high) == (high - low == self.width):
+            return 0
+        h = self._hash("edge", low, high)
+        if (h & 0xFFFFFFFF) / 2 ** 32 < self.shortcut_chance:
+            return self.shortcut_attunement[(h >> 32) % len(self.shortcut_attunement)]
+        return None
+
+    def portals(self, rid):
+        """{target id: min_attunement} for a generated room, without generating anything else."""
+        index = self._index(rid)
+        if index is None:
+            return {}
+        portals = {}
+        if index == 0 and self.entrance:
+            portals[self.entrance['room']] = 0
+        for other in self._neighbours(index):
+            gate = self._edge(index, other)
+            if gate is not None:
+                portals[self._rid(other)] = gate
+        return portals
+
+    def portals_into(self, rid):
+        """Ids of the generated rooms with a portal into rid. Generated portals always go both ways."""
+        if self.entrance and rid == self.entrance['room']:
+            return [self._rid(0)]
+        return list(self.portals(rid))
+
+    def gates(self):
+        """Every min_attunement a generated portal can need."""
+        return sorted({0, *self.shortcut_attunement})
+
+    def _region(self, index):
+        row, col = divmod(index, self.width)
+        region_row, region_col = row // self.region_size, col // self.region_size
+        number = region_row * self.regions_across + region_col
+        theme = self.themes[self._hash("region", number) % len(self.themes)]
+        return theme, region_row + region_col
+
+    def _name(self, index, theme):
+        h = self._hash("name", index)
+        return f"The {theme['adjectives'][h % len(theme['adjectives'])]} {theme['nouns'][(h >> 32) % len(theme['nouns'])]}"
+
+    # --- rooms ---
+    def generate(self, rid):
+        """The room dict for a generated id, shaped like a compiled worlddata room, or None."""
+        index = self._index(rid)
+        if index is None:
+            return None
+        theme, depth = self._region(index)
+        rng = random.Random(self._hash("room", index))
+        name = self._name(index, theme)
+
+        portals = {}
+        for target, gate in self.portals(rid).items():
+            if target == (self.entrance or {}).get('room'):
+                portal_name = self.entrance.get('back', target)
+            else:
+                other = self._index(target)
+                portal_name = self._name(other, self._region(other)[0])
+            portals[target] = {"name": portal_name, "min_attunement": gate}
+
+        details = rng.sample(theme['details'], min(2, len(theme['details'])))
+        items = []
+        if theme['items'] and rng.random() < 0.35:
+            items = rng.choices(theme['items'], theme['item_weights'], k=rng.choice((1, 1, 2)))
+        monsters = []
+        scale = 1 + self.depth_scale * depth
+        for _ in range(rng.choices((0, 1, 2), (5, 4, 1))[0]):
+            template_id = rng.choices(theme['monsters'], theme['monster_weights'])[0]
+            template = theme['templates'][template_id]
+            overrides = {field: int(round(template[field] * scale)) for field in ("max_hp", "atk", "xp", "gold")}
+            monsters.append(self.monsters.spawn(f"{rid}.{len(monsters)}", template_id, overrides))
+
+        return {"name": name, "desc": " ".join(details), "portals": portals,
+                "items": floors.from_list(sys.intern(item_id) for item_id in items), "monsters": monsters}
+
+    def link(self, rooms):
+        """Adds the entrance portal to the hand-written rooms (room id -> room dict) and returns them."""
+        if self.entrance:
+            rooms[self.entrance['room']].setdefault('portals', {})[self._rid(0)] = {
+                "name": self.entrance.get('name', "The Doors"), "min_attunement": 0}
+        return rooms
+
+
+def check(config, items, templates, rooms=None):
+    """Everything wrong with a worldgen config, one problem per line."""
+    problems = []
+    for field in ("seed", "first_id", "width", "height", "themes"):
+        if field not in config:
+            problems.append(f"{CONFIG_FILE}: missing '{field}'")
+    if problems:
+        return problems
+    for field in ("first_id", "width", "height", "region_size"):
+        if not isinstance(config.get(field, 1), int) or config.get(field, 1) < (0 if field == "first_id" else 1):
+            problems.append(f"{CONFIG_FILE}: '{field}' must be a positive integer")
+    if not config['themes']:
+        problems.append(f"{CONFIG_FILE}: no themes")
+    for i, theme in enumerate(config['themes']):
+        where = f"{CONFIG_FILE}: theme {theme.get('name', i)}"
+        for field in ("adjectives", "nouns", "details", "monsters", "items"):
+            if not isinstance(theme.get(field), list) or (field not in ("monsters", "items") and not theme[field]):
+                problems.append(f"{where}: '{field}' must be a list" + ("" if field in ("monsters", "items") else ", not empty"))
+        for template_id in theme.get('monsters') or []:
+            if template_id not in templates:
+                problems.append(f"{where}: monster template {template_id!r} does not exist")
+        for item_id in theme.get('items') or []:
+            if item_id not in items:
+                problems.append(f"{where}: item {item_id!r} is not an item")
+    entrance = config.get('entrance')
+    if rooms is not None and entrance and entrance.get('room') not in rooms:
+        problems.append(f"{CONFIG_FILE}: entrance room {entrance.get('room')!r} is not a room")
+    if rooms is not None and not problems:
+        first, last = config['first_id'], config['first_id'] + config['width'] * config['height']
+        clashes = [rid for rid in rooms if rid.isdigit() and first <= int(rid) < last]
+        if clashes:
+            problems.append(f"{CONFIG_FILE}: generated ids {first}-{last - 1} include hand-written rooms "
+                            + ", ".join(clashes[:10]))
+    return problems
+
+
+def source_key(data_dir):
+    """Changes whenever the generated world would (None without a worldgen.json)."""
+    try:
+        st = os.stat(os.path.join(data_dir, CONFIG_FILE))
+    except FileNotFoundError:
+        return None
+    return (GENERATOR_VERSION, st.st_size, st.st_mtime_ns)
+
+
+def load(data_dir, data, rooms=None):
+    """
+    The WorldGenerator for data_dir's worldgen.json, or None if there isn't
+    one. `data` is the WorldData for its items and monster templates; pass
+    the hand-written rooms too to check the entrance and the id range.
+    Raises WorldDataError if the config is wrong.
+    """
+    path = os.path.join(data_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        try:
+            config = json.load(f)
+        except ValueError as e:
+            raise WorldDataError([f"{CONFIG_FILE}: {e}"])
+    if not isinstance(config, dict):
+        raise WorldDataError([f"{CONFIG_FILE}: expected an object at the top level"])
+    problems = check(config, data.items, data.templates, rooms)
+    if problems:
+        raise WorldDataError(problems)
+    return WorldGenerator(config, data.items, data.templates, data.monsters)